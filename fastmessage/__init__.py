@@ -3,6 +3,8 @@ from .common import (
     OtherMethodOutput,
     InputDeviceName,
     MultipleReturnValues,
+    LazyBody,
+    PreSerializedOutput,
 )
 from .exceptions import (
     FastMessageException,
@@ -11,8 +13,81 @@ from .exceptions import (
     DuplicateCallbackException,
     UnnamedCallableException,
     NotAllowedParamKindException,
-    MethodValidationError
-
+    MethodValidationError,
+    UnknownCompressionCodecException,
+    DecompressionException,
+    ClaimCheckException,
+    CallbackTimeoutException,
+    PoisonMessageError,
+    CoalescingNotAllowedException,
+)
+from .compression import (
+    CONTENT_ENCODING_HEADER,
+    CompressionCodec,
+    ZlibCodec,
+    GzipCodec,
+    LzmaCodec,
+)
+from .claim_check import (
+    CLAIM_CHECK_HEADER,
+    BlobStore,
+    FileSystemBlobStore,
+)
+from .load_shedding import (
+    EXPIRES_AT_HEADER,
+    SENT_AT_HEADER,
+    LoadShedder,
+)
+from .retry import RetryPolicy
+from .concurrency_limit import (
+    AdaptiveConcurrencyLimiter,
+    ConcurrencyLimiterStats,
+)
+from .dependencies import (
+    Depends,
+    DependencyScope,
+)
+from .profiling import CallbackProfiler
+from .topology import (
+    Topology,
+    RouteEdge,
+    StageLoad,
+)
+from .tracing import (
+    TRACE_ID_HEADER,
+    SPAN_ID_HEADER,
+    Span,
+    SpanExporter,
+    InMemorySpanExporter,
+    FileSpanExporter,
+)
+from .poison_cache import (
+    PoisonMessageCache,
+    PoisonCacheStats,
+)
+from .memory_budget import (
+    MemoryBudget,
+    MemoryBudgetStats,
+    ByteReservation,
+)
+from .scheduling import (
+    DeviceWaitStats,
+    PriorityInputDevice,
+    PriorityPipelineService,
+)
+from .numpy_types import (
+    NDArray,
+    conarray,
+    encode_ndarray_base64,
+)
+from .staged_pipeline import StagedPipelineService
+from .async_service import AsyncPipelineService
+from .traffic_capture import (
+    TrafficRecorder,
+    RecordedMessage,
+    ReplayStats,
+    read_traffic,
+    replay_traffic,
 )
 from .fastmessage_handler import FastMessage
 from .method_validator import MethodValidator
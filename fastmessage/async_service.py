@@ -0,0 +1,284 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+from pydantic import ValidationError
+
+from fastmessage.callable_wrapper import CallableWrapper
+from fastmessage.common import _logger
+from fastmessage.memory_budget import ByteReservation
+from fastmessage.tracing import Span
+from messageflux import InputDevice, ReadResult
+from messageflux.base_service import BaseService
+from messageflux.iodevices.base import InputDeviceManager, OutputDeviceManager, AggregatedInputDevice
+from messageflux.pipeline_service import PipelineResult
+
+if TYPE_CHECKING:
+    from fastmessage.fastmessage_handler import FastMessage
+
+
+class AsyncPipelineService(BaseService):
+    """
+    an asyncio native service: the messages are read, dispatched to their callbacks and their results are sent
+    as coroutines on a single event loop, so many messages can be handled concurrently.
+
+    async callbacks are awaited directly on the event loop, and sync callbacks are offloaded to a thread pool.
+    the (blocking) device operations (reading, sending and committing) run on a single dedicated thread,
+    since most devices can't be used from several threads concurrently.
+    if the FastMessage object has a memory budget, the reading stops while the budget is exceeded
+    """
+
+    def __init__(self, *,
+                 fastmessage_handler: 'FastMessage',
+                 input_device_manager: InputDeviceManager,
+                 input_device_names: Union[List[str], str],
+                 output_device_manager: Optional[OutputDeviceManager] = None,
+                 max_concurrency: int = 1000,
+                 sync_workers: Optional[int] = None,
+                 use_transactions: bool = True,
+                 read_timeout: float = 5,
+                 poll_interval: float = 0.01,
+                 **kwargs):
+        """
+
+        :param fastmessage_handler: the FastMessage object to handle the messages with
+        :param input_device_manager: the input device manager to read messages from
+        :param input_device_names: the input device names to read messages from
+        :param output_device_manager: Optional. the output device manager to send the results to
+        :param max_concurrency: the maximum number of messages that are handled concurrently
+        :param sync_workers: the number of threads for running sync callbacks (None uses the executor default)
+        :param use_transactions: whether to use transactions when reading from the input devices
+        (each message is committed after its results are sent, or rolled back if its handling failed)
+        :param read_timeout: the time (in seconds) to wait for a message, when no message is being handled
+        :param poll_interval: the time (in seconds) to wait between reads, while there are no new messages,
+        and other messages are being handled
+        :param **kwargs: passed to BaseService __init__ as is
+        """
+        super().__init__(**kwargs)
+        self._fastmessage_handler = fastmessage_handler
+        self._input_device_manager = input_device_manager
+        if isinstance(input_device_names, str):
+            input_device_names = [input_device_names]
+        self._input_device_names = input_device_names
+        self._output_device_manager = output_device_manager
+        self._max_concurrency = max(1, max_concurrency)
+        self._sync_workers = sync_workers
+        self._use_transactions = use_transactions
+        self._read_timeout = max(read_timeout, 0)
+        self._poll_interval = max(poll_interval, 0)
+        self._aggregate_input_device: Optional[AggregatedInputDevice] = None
+        self._io_executor: Optional[ThreadPoolExecutor] = None
+        self._callback_executor: Optional[ThreadPoolExecutor] = None
+
+    def _prepare_service(self):
+        self._input_device_manager.connect()
+        self._aggregate_input_device = self._fastmessage_handler._get_aggregate_device(self._input_device_manager,
+                                                                                       self._input_device_names)
+        if self._output_device_manager is not None:
+            self._output_device_manager.connect()
+        self._fastmessage_handler.prepare()
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-io')
+        self._callback_executor = ThreadPoolExecutor(max_workers=self._sync_workers,
+                                                     thread_name_prefix=f'{self.name}-callback')
+
+    def _run_service(self, cancellation_token: threading.Event):
+        event_loop = asyncio.new_event_loop()
+        try:
+            event_loop.run_until_complete(self._serve(cancellation_token))
+        finally:
+            try:
+                # tears down the dependencies of this event loop, while it can still run their teardowns
+                dependency_resolver = self._fastmessage_handler._dependency_resolver
+                event_loop.run_until_complete(dependency_resolver.close_event_loop_async())
+                event_loop.run_until_complete(event_loop.shutdown_asyncgens())
+            finally:
+                event_loop.close()
+
+    def _read_message(self,
+                      cancellation_token: threading.Event,
+                      timeout: float) -> Optional[Tuple[InputDevice, ReadResult]]:
+        assert self._aggregate_input_device is not None
+        read_result = self._aggregate_input_device.read_message(cancellation_token=cancellation_token,
+                                                                timeout=timeout,
+                                                                with_transaction=self._use_transactions)
+        if read_result is None:
+            return None
+        last_read_device = self._aggregate_input_device.last_read_device
+        assert last_read_device is not None
+        return last_read_device, read_result
+
+    async def _serve(self, cancellation_token: threading.Event):
+        event_loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        tasks: Set[asyncio.Task] = set()
+        memory_budget = self._fastmessage_handler.memory_budget
+        try:
+            while not cancellation_token.is_set():
+                await semaphore.acquire()
+                if memory_budget is not None and not memory_budget.has_capacity():
+                    semaphore.release()
+                    try:  # stop reading until enough messages are done
+                        await asyncio.wait_for(memory_budget.wait_for_capacity_async(),
+                                               max(self._read_timeout, self._poll_interval))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                try:
+                    read_message = await event_loop.run_in_executor(self._io_executor,
+                                                                    self._read_message,
+                                                                    cancellation_token,
+                                                                    0 if tasks else self._read_timeout)
+                except Exception:
+                    semaphore.release()
+                    _logger.exception('Error reading message')
+                    await asyncio.sleep(self._poll_interval)
+                    continue
+
+                if read_message is None:
+                    semaphore.release()
+                    if tasks:  # wait for some message to finish (or for the next poll)
+                        await asyncio.wait(tasks, timeout=self._poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                input_device, read_result = read_message
+                reservation = None if memory_budget is None else memory_budget.reserve(read_result)
+                task = asyncio.ensure_future(self._handle_and_release(input_device,
+                                                                      read_result,
+                                                                      semaphore,
+                                                                      reservation))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+
+    async def _handle_and_release(self,
+                                  input_device: InputDevice,
+                                  read_result: ReadResult,
+                                  semaphore: asyncio.Semaphore,
+                                  reservation: Optional[ByteReservation] = None):
+        event_loop = asyncio.get_running_loop()
+        try:
+            try:
+                results = await self._handle_message(input_device, read_result)
+                memory_budget = self._fastmessage_handler.memory_budget
+                if memory_budget is not None:
+                    memory_budget.add_outputs(read_result, results)
+            except Exception:
+                _logger.exception(f"Error handling message from device '{input_device.name}'")
+                if self._use_transactions:
+                    await event_loop.run_in_executor(self._io_executor, read_result.rollback)
+                return
+
+            await event_loop.run_in_executor(self._io_executor, self._send_and_commit, read_result, results)
+        except Exception:
+            _logger.exception(f"Error sending the results of a message from device '{input_device.name}'")
+        finally:
+            if reservation is not None:
+                reservation.release()
+            semaphore.release()
+
+    async def _handle_message(self, input_device: InputDevice, read_result: ReadResult) -> List[PipelineResult]:
+        fastmessage_handler = self._fastmessage_handler
+        callback_wrapper = fastmessage_handler.get_callback_wrapper(input_device.name)
+        if fastmessage_handler._traffic_recorder is not None:
+            fastmessage_handler._traffic_recorder.record(input_device.name, read_result)
+
+        span = callback_wrapper.start_span(read_result)
+        try:
+            try:
+                kwargs = callback_wrapper.decode(input_device=input_device, message_bundle=read_result)
+            except Exception as ex:
+                callback_wrapper.finish_span(span, ex)
+                raise
+
+            if kwargs is None:
+                callback_wrapper.finish_span(span)
+                return self._to_list(callback_wrapper.get_shed_result(read_result))
+
+            if not callback_wrapper.is_async:
+                # the span is finished by '_run_sync_callback' (or by the results, if the callback succeeded)
+                return await asyncio.get_running_loop().run_in_executor(self._callback_executor,
+                                                                        self._run_sync_callback,
+                                                                        callback_wrapper,
+                                                                        kwargs,
+                                                                        read_result,
+                                                                        span)
+
+            try:
+                callback_return, message_scope = await callback_wrapper.execute_async(kwargs=kwargs,
+                                                                                      message_bundle=read_result)
+            except Exception as ex:
+                callback_wrapper.finish_span(span, ex)
+                raise
+
+            try:
+                return self._to_list(callback_wrapper.get_results(callback_return=callback_return, span=span))
+            finally:
+                if message_scope is not None:
+                    await message_scope.close_async()
+        except ValidationError as ve:
+            return self._to_list(fastmessage_handler._handle_validation_error(input_device, read_result, ve))
+
+    @staticmethod
+    def _run_sync_callback(callback_wrapper: CallableWrapper,
+                           kwargs: dict,
+                           read_result: ReadResult,
+                           span: Optional[Span]) -> List[PipelineResult]:
+        try:
+            callback_return, message_scope = callback_wrapper.execute(kwargs=kwargs, message_bundle=read_result)
+        except Exception as ex:
+            callback_wrapper.finish_span(span, ex)
+            raise
+
+        # the results are iterated here, since generator callbacks run while their results are iterated
+        return AsyncPipelineService._to_list(callback_wrapper.get_results(callback_return=callback_return,
+                                                                          message_scope=message_scope,
+                                                                          span=span))
+
+    @staticmethod
+    def _to_list(results: Optional[Union[PipelineResult, Iterable[PipelineResult]]]) -> List[PipelineResult]:
+        if results is None:
+            return []
+        if isinstance(results, PipelineResult):
+            return [results]
+        return list(results)
+
+    def _send_and_commit(self, read_result: ReadResult, results: List[PipelineResult]):
+        try:
+            for pipeline_result in results:
+                if self._output_device_manager is None:
+                    _logger.warning("pipeline handler returned a result to output to device: "
+                                    f"'{pipeline_result.output_device_name}', "
+                                    f"but no output_device_manager was given")
+                    continue
+
+                output_device = self._output_device_manager.get_output_device(pipeline_result.output_device_name)
+                output_device.send_message(message=pipeline_result.message_bundle.message,
+                                           device_headers=pipeline_result.message_bundle.device_headers)
+        except Exception:
+            if self._use_transactions:
+                read_result.rollback()
+            raise
+
+        if self._use_transactions:
+            read_result.commit()
+
+    def _finalize_service(self, exception: Optional[Exception] = None):
+        try:
+            for executor in (self._io_executor, self._callback_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self._io_executor = None
+            self._callback_executor = None
+        finally:
+            try:
+                self._input_device_manager.disconnect()
+            finally:
+                try:
+                    if self._output_device_manager is not None:
+                        self._output_device_manager.disconnect()
+                finally:
+                    self._fastmessage_handler.shutdown()
@@ -1,19 +1,35 @@
+import asyncio
+import collections.abc
 import inspect
-import json
+import time
 from asyncio import AbstractEventLoop
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Optional, Dict, Any, Union, Iterable, Generator, AsyncGenerator, TYPE_CHECKING, Callable, Type
+from typing import Optional, Dict, Any, Union, Iterable, Generator, AsyncGenerator, TYPE_CHECKING, Callable, Type, \
+    Tuple, Iterator, Awaitable
 
-import itertools
-from pydantic import BaseModel, create_model, Extra
+from pydantic import BaseModel, create_model, Extra, ValidationError
 from pydantic.config import get_config
-from pydantic.typing import get_all_type_hints
+from pydantic.typing import get_all_type_hints, get_origin, get_args
 
-from fastmessage.common import CustomOutput, InputDeviceName, MultipleReturnValues, OtherMethodOutput
+from fastmessage.common import CustomOutput, InputDeviceName, MultipleReturnValues, OtherMethodOutput, LazyBody, \
+    PreSerializedOutput
 from fastmessage.common import _CALLABLE_TYPE, get_callable_name, _logger
-from fastmessage.exceptions import NotAllowedParamKindException, SpecialDefaultValueException
+from fastmessage.coalescing import SingleFlight, get_coalescing_key
+from fastmessage.concurrency_limit import AdaptiveConcurrencyLimiter
+from fastmessage.dependencies import Depends, MessageScope, DependencyScope
+from fastmessage.exceptions import NotAllowedParamKindException, SpecialDefaultValueException, \
+    CallbackTimeoutException, PoisonMessageError, CoalescingNotAllowedException
+from fastmessage.load_shedding import LoadShedder, SENT_AT_HEADER
 from fastmessage.method_validator import MethodValidator
+from fastmessage.output_encoding import encode_output, get_output_encoder
+from fastmessage.profiling import CallbackProfiler
+from fastmessage.retry import RetryPolicy
+from fastmessage.scheduling import WaitTimeRecorder
+from fastmessage.schema_samples import build_schema_sample
+from fastmessage.selective_decoding import SelectiveJSONDecoder, SELECTIVE_DECODING_AVAILABLE
+from fastmessage.topology import RouteCounter
+from fastmessage.tracing import Span
 from messageflux import InputDevice
 from messageflux.iodevices.base.common import MessageBundle, Message
 from messageflux.pipeline_service import PipelineResult
@@ -22,6 +38,51 @@ if TYPE_CHECKING:
     from fastmessage.fastmessage_handler import FastMessage
 
 
+# isinstance checks against the typing aliases are slow, so the abc classes are used on the hot path
+_NESTED_RESULT_TYPES = (MultipleReturnValues, collections.abc.Generator)
+_OUTPUT_WRAPPER_TYPES = (CustomOutput, OtherMethodOutput)
+# return annotation types that are not serialized by an output encoder
+_NOT_ENCODED_TYPES = (type(None), CustomOutput, OtherMethodOutput, MultipleReturnValues, PreSerializedOutput,
+                      Message, MessageBundle)
+
+
+class _CallbackTimeoutError(asyncio.TimeoutError):
+    """
+    raised by '_wait_for' when the timeout of the callback has passed (unlike a TimeoutError the callback raised itself)
+    """
+    pass
+
+
+async def _wait_for(awaitable: Awaitable[Any], timeout: float) -> Any:
+    # like asyncio.wait_for, but tells our timeout apart from a TimeoutError that the awaitable raised,
+    # by whether the task was cancelled by us (comparing the loop time to the deadline is not reliable,
+    # since its resolution is ~15ms on windows)
+    task = asyncio.ensure_future(awaitable)
+    try:
+        await asyncio.wait((task,), timeout=max(timeout, 0))
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if task.cancelled():
+            raise _CallbackTimeoutError()
+
+    return task.result()
+
+
+def _materialize_generator(callback_return: Any) -> Any:
+    # a generator can be iterated only once, so it can't be shared by coalesced calls as is
+    if isinstance(callback_return, collections.abc.Generator):
+        return MultipleReturnValues(callback_return)
+    return callback_return
+
+
 class _CallableType(Enum):
     SYNC = auto()
     ASYNC = auto()
@@ -38,8 +99,24 @@ class _ParamInfo:
 class _CallableAnalysis:
     params: Dict[str, _ParamInfo]
     special_params: Dict[str, _ParamInfo]
+    dependencies: Dict[str, Depends]
     has_kwargs: bool
     callable_type: _CallableType
+    return_annotation: Any = Any
+
+    @property
+    def needs_body(self) -> bool:
+        """
+        True if the callable has params that are read from the message body (so the body has to be parsed)
+        """
+        return bool(self.params) or self.has_kwargs
+
+    @property
+    def supports_selective_decoding(self) -> bool:
+        """
+        True if the params can be decoded from the top level keys of the message body
+        """
+        return bool(self.params) and not self.has_kwargs and '__root__' not in self.params
 
 
 class CallableWrapper:
@@ -51,7 +128,18 @@ class CallableWrapper:
                  fastmessage_handler: 'FastMessage',
                  wrapped_callable: _CALLABLE_TYPE,
                  input_device_name: str,
-                 output_device_name: Optional[str] = None):
+                 output_device_name: Optional[str] = None,
+                 selective_decoding: bool = False,
+                 ttl: Optional[float] = None,
+                 latency_slo: Optional[float] = None,
+                 expired_output_device: Optional[str] = None,
+                 timeout: Optional[float] = None,
+                 dead_letter_device: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 priority: int = 0,
+                 weight: int = 1,
+                 coalesce: bool = False):
         self._fastmessage_handler = fastmessage_handler
         self._callable = wrapped_callable
         self._input_device_name = input_device_name
@@ -61,11 +149,38 @@ class CallableWrapper:
         self._callable_analysis = self._analyze_callable(self._callable)
         self._model: Type[BaseModel] = self._create_model(model_name=self._get_model_name(),
                                                           callable_analysis=self._callable_analysis)
+        self._selective_decoder: Optional[SelectiveJSONDecoder] = None
+        if selective_decoding and self._callable_analysis.supports_selective_decoding:
+            if SELECTIVE_DECODING_AVAILABLE:
+                self._selective_decoder = SelectiveJSONDecoder(self._callable_analysis.params.keys())
+            else:
+                _logger.warning(f"selective decoding for input device '{self._input_device_name}' requires "
+                                f"'pysimdjson' to be installed. falling back to regular decoding")
+
+        self._load_shedder = LoadShedder(ttl=ttl, latency_slo=latency_slo)
+        self._expired_output_device = expired_output_device
+        self._timeout = timeout
+        self._dead_letter_device = dead_letter_device
+        if timeout is not None and self._callable_analysis.callable_type == _CallableType.SYNC:
+            _logger.warning(f"callback for input device '{self._input_device_name}' is not async. "
+                            f"its timeout will be ignored")
+        self._retry_policy = retry_policy
+        self._concurrency_limiter = concurrency_limiter
+        self._profiler: Optional[CallbackProfiler] = None
+        self._route_counter = RouteCounter()
+        self._priority = priority
+        self._weight = max(1, weight)
+        self._wait_recorder = WaitTimeRecorder(input_device_name)
+        self._single_flight: Optional[SingleFlight] = None
+        if coalesce:
+            self._validate_coalescing()
+            self._single_flight = SingleFlight()
 
     @staticmethod
     def _analyze_callable(wrapped_callable: _CALLABLE_TYPE) -> _CallableAnalysis:
         params = dict()
         special_params = dict()
+        dependencies = dict()
         type_hints = get_all_type_hints(wrapped_callable)
         has_kwargs = False
         for param_name, param in inspect.signature(wrapped_callable).parameters.items():
@@ -82,13 +197,18 @@ class CallableWrapper:
 
             param_info = _ParamInfo(annotation=annotation, default=default)
 
-            if param_info.annotation in (MessageBundle, Optional[MessageBundle],
-                                         Message, Optional[Message],
-                                         InputDeviceName, Optional[InputDeviceName],
-                                         MethodValidator, Optional[MethodValidator]):
+            if isinstance(param_info.default, Depends):
+                dependencies[param_name] = param_info.default
+
+            elif param_info.annotation in (MessageBundle, Optional[MessageBundle],
+                                           Message, Optional[Message],
+                                           InputDeviceName, Optional[InputDeviceName],
+                                           MethodValidator, Optional[MethodValidator]) \
+                    or get_origin(param_info.annotation) is LazyBody:
                 if param_info.default is not ...:
                     raise SpecialDefaultValueException(
-                        f"param '{param_name}' is of special type '{param.annotation.__name__}' "
+                        f"param '{param_name}' is of special type "
+                        f"'{getattr(param.annotation, '__name__', repr(param.annotation))}' "
                         f"but has a default value")
                 special_params[param_name] = param_info
 
@@ -103,8 +223,10 @@ class CallableWrapper:
 
         return _CallableAnalysis(params=params,
                                  special_params=special_params,
+                                 dependencies=dependencies,
                                  has_kwargs=has_kwargs,
-                                 callable_type=callable_type)
+                                 callable_type=callable_type,
+                                 return_annotation=type_hints.get('return', Any))
 
     @staticmethod
     def _create_model(model_name: str, callable_analysis: _CallableAnalysis) -> Type[BaseModel]:
@@ -146,17 +268,172 @@ class CallableWrapper:
         """
         return self._output_device_name
 
+    @property
+    def load_shedder(self) -> LoadShedder:
+        """
+        the load shedder that decides which messages for this callable are dropped before they are handled
+        """
+        return self._load_shedder
+
+    @property
+    def concurrency_limiter(self) -> Optional[AdaptiveConcurrencyLimiter]:
+        """
+        the limiter of the number of messages that this callable handles at the same time (if there is one)
+        """
+        return self._concurrency_limiter
+
+    @property
+    def priority(self) -> int:
+        """
+        the priority of the input device of this callable (higher priority devices are read first)
+        """
+        return self._priority
+
+    @property
+    def weight(self) -> int:
+        """
+        the weight of the input device of this callable, among the input devices with the same priority
+        """
+        return self._weight
+
+    @property
+    def wait_recorder(self) -> WaitTimeRecorder:
+        """
+        records the time that the messages for this callable waited in the queue (when they are decoded)
+        """
+        return self._wait_recorder
+
+    @property
+    def single_flight(self) -> Optional[SingleFlight]:
+        """
+        coalesces the concurrent calls with the same arguments (if the callable is mapped with 'coalesce')
+        """
+        return self._single_flight
+
+    def _validate_coalescing(self):
+        if self._callable_analysis.callable_type == _CallableType.ASYNC_GENERATOR \
+                or inspect.isgeneratorfunction(self._callable):
+            raise CoalescingNotAllowedException(f"callback for input device '{self._input_device_name}' is a "
+                                                f"generator, so it can't be coalesced")
+
+        for param_name, param_info in self._callable_analysis.special_params.items():
+            if param_info.annotation in (MessageBundle, Optional[MessageBundle], Message, Optional[Message]) \
+                    or get_origin(param_info.annotation) is LazyBody:
+                raise CoalescingNotAllowedException(f"param '{param_name}' of the callback for input device "
+                                                    f"'{self._input_device_name}' is different for each message, "
+                                                    f"so the callback can't be coalesced")
+
+        if self._dead_letter_device is not None:
+            raise CoalescingNotAllowedException(f"callback for input device '{self._input_device_name}' has a "
+                                                f"dead letter device, so it can't be coalesced")
+
+    @property
+    def is_async(self) -> bool:
+        """
+        True if the callable is an async function (or an async generator)
+        """
+        return self._callable_analysis.callable_type != _CallableType.SYNC
+
+    @property
+    def route_counter(self) -> RouteCounter:
+        """
+        counts the handled messages, and the outputs that were sent to each output device (for the topology)
+        """
+        return self._route_counter
+
+    @property
+    def profiler(self) -> Optional[CallbackProfiler]:
+        """
+        the profiler that samples the calls of this callable (None if profiling is disabled)
+        """
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler: Optional[CallbackProfiler]):
+        self._profiler = profiler
+
+    def warm_up(self, samples: Iterable[bytes] = (), synthetic: bool = False) -> int:
+        """
+        initializes everything that is otherwise initialized lazily when the first messages are handled:
+        the output encoders of the return annotation, the process scoped dependencies, and the decoder of this thread.
+        the samples are only decoded and validated (the callable is not called, and they don't reach the poison cache)
+
+        :param samples: sample message bodies (uncompressed json) to decode and validate
+        :param synthetic: if True, a synthetic message body that is built from the schema of the model is decoded too
+        :return: the number of samples that passed validation
+        """
+        for output_type in self._get_output_types():
+            get_output_encoder(output_type)
+
+        self._warm_up_dependencies()
+        if not self._callable_analysis.needs_body:
+            return 0
+
+        self.warm_up_decoder()
+        samples = list(samples)
+        if synthetic:
+            samples.append(encode_output(build_schema_sample(self._model.schema())))
+
+        valid_samples = 0
+        for sample in samples:
+            try:
+                self._parse_body(sample)
+                valid_samples += 1
+            except ValidationError:
+                _logger.debug(f"warm up sample for input device '{self._input_device_name}' is not valid")
+        return valid_samples
+
+    def warm_up_decoder(self):
+        """
+        creates the decoder of the calling thread (the decoders are per thread), for services that decode the messages
+        on other threads than the one that called 'warm_up'
+        """
+        if self._selective_decoder is not None:
+            self._selective_decoder.decode(b'{}')
+
+    def _get_output_types(self) -> Iterator[type]:
+        stack = [self._callable_analysis.return_annotation]
+        while stack:
+            annotation = stack.pop()
+            if isinstance(annotation, type) and annotation is not Any:  # Any is a class since python 3.11
+                if not issubclass(annotation, _NOT_ENCODED_TYPES):
+                    yield annotation
+            stack.extend(get_args(annotation))
+
+    def _warm_up_dependencies(self):
+        dependency_resolver = self._fastmessage_handler._dependency_resolver
+        for param_name, depends in self._callable_analysis.dependencies.items():
+            # async providers are resolved on the event loop that handles the messages, so they can't be created here
+            if depends.scope is not DependencyScope.PROCESS or inspect.iscoroutinefunction(depends.provider) \
+                    or inspect.isasyncgenfunction(depends.provider):
+                continue
+
+            message_scope = MessageScope()
+            try:
+                dependency_resolver.resolve(depends, message_scope)
+            except Exception:
+                _logger.exception(f"Error warming up dependency '{param_name}' for input device "
+                                  f"'{self._input_device_name}'")
+            finally:
+                message_scope.close()
+
     def _get_model_name(self) -> str:
         callable_name = get_callable_name(self._callable)
         return f"model_{callable_name}_{self._input_device_name}"
 
     @staticmethod
-    def _iter_over_async(async_generator: AsyncGenerator, loop: AbstractEventLoop):
+    def _iter_over_async(async_generator: AsyncGenerator,
+                         loop: AbstractEventLoop,
+                         timeout: Optional[float] = None):
         ait = async_generator.__aiter__()
+        deadline = None if timeout is None else loop.time() + timeout
 
         async def get_next():
             try:
-                obj = await ait.__anext__()
+                if deadline is None:
+                    obj = await ait.__anext__()
+                else:
+                    obj = await _wait_for(ait.__anext__(), deadline - loop.time())
                 return False, obj
             except StopAsyncIteration:
                 return True, None
@@ -167,9 +444,115 @@ class CallableWrapper:
                 break
             yield obj
 
+    def _iter_with_timeout_handling(self, results: Iterable, message_bundle: MessageBundle):
+        try:
+            yield from results
+        except _CallbackTimeoutError:
+            yield self._handle_timeout(message_bundle)
+
+    def _handle_timeout(self, message_bundle: MessageBundle) -> CustomOutput:
+        if self._dead_letter_device is None:
+            raise CallbackTimeoutException(f"callback for input device '{self._input_device_name}' "
+                                           f"timed out after {self._timeout} seconds")
+
+        _logger.warning(f"callback for input device '{self._input_device_name}' timed out after {self._timeout} "
+                        f"seconds. sending the message to '{self._dead_letter_device}'")
+        return CustomOutput(output_device=self._dead_letter_device, value=message_bundle)
+
+    def _get_body(self, message_bundle: MessageBundle) -> bytes:
+        message = message_bundle.message
+        data = self._fastmessage_handler._claim_check.resolve(message)
+        return self._fastmessage_handler._message_compressor.decompress(data, message.headers)
+
+    def _parse_body(self, body: bytes) -> BaseModel:
+        if self._selective_decoder is not None:
+            try:
+                data = self._selective_decoder.decode(body)
+            except ValueError:
+                pass  # parse_raw will raise the right ValidationError for this body
+            else:
+                return self._model.parse_obj(data)
+
+        return self._model.parse_raw(body)
+
+    def _run_callable(self, kwargs: Dict[str, Any], message_bundle: MessageBundle) -> Any:
+        callable_type = self._callable_analysis.callable_type
+        if callable_type == _CallableType.SYNC:
+            if self._retry_policy is None:
+                return self._callable(**kwargs)
+            return self._retry_policy.run(self._callable, kwargs)
+
+        event_loop = self._fastmessage_handler.event_loop
+        if callable_type == _CallableType.ASYNC:
+            if self._retry_policy is None:
+                coroutine = self._callable(**kwargs)
+            else:
+                coroutine = self._retry_policy.run_async(self._callable, kwargs)
+
+        if self._timeout is None:
+            if callable_type == _CallableType.ASYNC:
+                return event_loop.run_until_complete(coroutine)
+            return self._iter_over_async(self._callable(**kwargs), event_loop)
+
+        if callable_type == _CallableType.ASYNC:
+            try:
+                return event_loop.run_until_complete(_wait_for(coroutine, self._timeout))
+            except _CallbackTimeoutError:
+                return self._handle_timeout(message_bundle)
+
+        return self._iter_with_timeout_handling(self._iter_over_async(self._callable(**kwargs),
+                                                                      event_loop,
+                                                                      self._timeout),
+                                                message_bundle)
+
     def __call__(self,
                  input_device: InputDevice,
                  message_bundle: MessageBundle) -> Optional[Union[PipelineResult, Iterable[PipelineResult]]]:
+        span = self.start_span(message_bundle)
+        try:
+            kwargs = self.decode(input_device=input_device, message_bundle=message_bundle)
+            if kwargs is None:
+                self.finish_span(span)
+                return self.get_shed_result(message_bundle)
+
+            callback_return, message_scope = self.execute(kwargs=kwargs, message_bundle=message_bundle)
+        except Exception as ex:
+            self.finish_span(span, ex)
+            raise
+
+        return self.get_results(callback_return=callback_return, message_scope=message_scope, span=span)
+
+    def start_span(self, message_bundle: MessageBundle) -> Optional[Span]:
+        """
+        starts the tracing span for handling a message (continuing the trace from the message headers)
+
+        :param message_bundle: the message that is handled
+        :return: the span (or None if the tracing is disabled)
+        """
+        return self._fastmessage_handler._tracer.start_span(self._input_device_name, message_bundle.message.headers)
+
+    def finish_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        """
+        finishes the tracing span of a message that is done being handled
+
+        :param span: the span (from 'start_span')
+        :param error: the error that the handling failed with (if it failed)
+        """
+        if span is not None:
+            self._fastmessage_handler._tracer.finish_span(span, error)
+
+    def decode(self, input_device: InputDevice, message_bundle: MessageBundle) -> Optional[Dict[str, Any]]:
+        """
+        the first stage of handling a message: decodes and validates the message into the kwargs for the callable
+
+        :param input_device: the input device the message was read from
+        :param message_bundle: the message to decode
+        :return: the kwargs for the callable (without its dependencies), or None if the message was shed
+        """
+        self._wait_recorder.record(message_bundle)
+        if self._load_shedder.should_shed(message_bundle.message.headers):
+            _logger.debug(f"message for input device '{self._input_device_name}' was shed")
+            return None
 
         kwargs: Dict[str, Any] = {}
         for param_name, param_info in self._callable_analysis.special_params.items():
@@ -181,51 +564,370 @@ class CallableWrapper:
                 kwargs[param_name] = message_bundle.message
             elif param_info.annotation is MethodValidator:
                 kwargs[param_name] = self._method_validator
+            elif get_origin(param_info.annotation) is LazyBody:
+                lazy_model, = get_args(param_info.annotation)
+                kwargs[param_name] = LazyBody(lazy_model, lambda: self._get_body(message_bundle))
+
+        if self._callable_analysis.needs_body:
+            poison_message_cache = self._fastmessage_handler._poison_message_cache
+            if poison_message_cache is None:
+                model = self._parse_body(self._get_body(message_bundle))
+            else:
+                poison_key = poison_message_cache.get_key(self._input_device_name, message_bundle.message)
+                validation_error = poison_message_cache.get(poison_key)
+                if validation_error is not None:
+                    _logger.debug(f"known bad message for input device '{self._input_device_name}' was rejected")
+                    raise PoisonMessageError(validation_error.raw_errors, validation_error.model)
+                try:
+                    model = self._parse_body(self._get_body(message_bundle))
+                except ValidationError as ve:
+                    poison_message_cache.add(poison_key, ve)
+                    raise
+            kwargs.update(dict(model))
+
+        return kwargs
+
+    def get_shed_result(self, message_bundle: MessageBundle) -> Optional[PipelineResult]:
+        """
+        returns the result for a message that was shed by 'decode'
 
-        model: BaseModel = self._model.parse_raw(message_bundle.message.bytes)
-        kwargs.update(dict(model))
+        :param message_bundle: the message that was shed
+        :return: the result that sends the message to the expired output device (if there is one)
+        """
+        if self._expired_output_device is None:
+            return None
+        return PipelineResult(output_device_name=self._expired_output_device, message_bundle=message_bundle)
+
+    def execute(self, kwargs: Dict[str, Any], message_bundle: MessageBundle) -> Tuple[Any, Optional[MessageScope]]:
+        """
+        the second stage of handling a message: resolves the dependencies and runs the callable
 
+        :param kwargs: the kwargs that were returned from 'decode'
+        :param message_bundle: the message that is handled
+        :return: the return value of the callable, and the message scope of its dependencies
+        (that has to be passed to 'get_results')
+        """
+        single_flight = self._single_flight
+        if single_flight is not None:
+            coalescing_key = self._get_coalescing_key(kwargs)
+            if coalescing_key is not None:
+                callback_return = single_flight.run(coalescing_key,
+                                                    self._execute_and_close_scope,
+                                                    kwargs,
+                                                    message_bundle)
+                self._route_counter.record_message()
+                return callback_return, None
+
+        callback_return, message_scope = self._execute(kwargs, message_bundle)
+        self._route_counter.record_message()
+        return callback_return, message_scope
+
+    def _execute_and_close_scope(self, kwargs: Dict[str, Any], message_bundle: MessageBundle) -> Any:
+        # coalesced callables aren't generators, so their dependencies aren't needed after they return
+        # (unless they return a generator, which is iterated here, before the scope is closed)
+        callback_return, message_scope = self._execute(kwargs, message_bundle)
+        try:
+            return _materialize_generator(callback_return)
+        finally:
+            if message_scope is not None:
+                message_scope.close()
+
+    def _execute(self, kwargs: Dict[str, Any], message_bundle: MessageBundle) -> Tuple[Any, Optional[MessageScope]]:
+        concurrency_limiter = self._concurrency_limiter
+        if concurrency_limiter is not None:
+            concurrency_limiter.acquire()
+        start_time = time.perf_counter()
+        try:
+            message_scope = self._resolve_dependencies(kwargs)
+            try:
+                start_time = time.perf_counter()
+                profiler = self._profiler
+                if profiler is not None and profiler.should_sample():
+                    callback_return = profiler.profile_call(self._run_callable, kwargs, message_bundle)
+                else:
+                    callback_return = self._run_callable(kwargs, message_bundle)
+                self._load_shedder.record_latency(time.perf_counter() - start_time)
+            except BaseException:
+                if message_scope is not None:
+                    message_scope.close()
+                raise
+        except BaseException as ex:
+            self._release_concurrency_limiter(start_time, ex)
+            raise
+
+        if concurrency_limiter is not None and isinstance(callback_return, collections.abc.Generator):
+            # generator callbacks run while their results are iterated, so they hold their slot until then
+            return self._release_after_iteration(callback_return, start_time), message_scope
+
+        self._release_concurrency_limiter(start_time)
+        return callback_return, message_scope
+
+    def _release_after_iteration(self, callback_return: Generator, start_time: float):
+        try:
+            yield from callback_return
+        except BaseException as ex:
+            self._release_concurrency_limiter(start_time, ex)
+            raise
+
+        self._release_concurrency_limiter(start_time)
+
+    async def execute_async(self,
+                            kwargs: Dict[str, Any],
+                            message_bundle: MessageBundle) -> Tuple[Any, Optional[MessageScope]]:
+        """
+        like 'execute', but for async callables, that are awaited on the running event loop
+        (async generators are iterated to the end, and their items are returned as MultipleReturnValues).
+        the returned message scope must be closed with 'MessageScope.close_async'
+
+        :param kwargs: the kwargs that were returned from 'decode'
+        :param message_bundle: the message that is handled
+        :return: the return value of the callable, and the message scope of its dependencies
+        """
+        single_flight = self._single_flight
+        if single_flight is not None:
+            coalescing_key = self._get_coalescing_key(kwargs)
+            if coalescing_key is not None:
+                callback_return = await single_flight.run_async(coalescing_key,
+                                                                self._execute_and_close_scope_async,
+                                                                kwargs,
+                                                                message_bundle)
+                self._route_counter.record_message()
+                return callback_return, None
+
+        callback_return, message_scope = await self._execute_async(kwargs, message_bundle)
+        self._route_counter.record_message()
+        return callback_return, message_scope
+
+    async def _execute_and_close_scope_async(self, kwargs: Dict[str, Any], message_bundle: MessageBundle) -> Any:
+        callback_return, message_scope = await self._execute_async(kwargs, message_bundle)
+        try:
+            return _materialize_generator(callback_return)
+        finally:
+            if message_scope is not None:
+                await message_scope.close_async()
+
+    async def _execute_async(self,
+                             kwargs: Dict[str, Any],
+                             message_bundle: MessageBundle) -> Tuple[Any, Optional[MessageScope]]:
+        concurrency_limiter = self._concurrency_limiter
+        if concurrency_limiter is not None:
+            await concurrency_limiter.acquire_async()
+        start_time = time.perf_counter()
+        try:
+            message_scope = await self._resolve_dependencies_async(kwargs)
+            try:
+                start_time = time.perf_counter()
+                profiler = self._profiler
+                if profiler is not None and not profiler.should_sample():
+                    profiler = None
+                callback_return = await self._run_callable_async(kwargs, message_bundle, profiler)
+                self._load_shedder.record_latency(time.perf_counter() - start_time)
+            except BaseException:
+                if message_scope is not None:
+                    await message_scope.close_async()
+                raise
+        except BaseException as ex:
+            self._release_concurrency_limiter(start_time, ex)
+            raise
+
+        self._release_concurrency_limiter(start_time)
+        return callback_return, message_scope
+
+    def _get_coalescing_key(self, kwargs: Dict[str, Any]) -> Optional[str]:
+        special_params = self._callable_analysis.special_params
+        coalescing_key = get_coalescing_key({param_name: value for param_name, value in kwargs.items()
+                                             if param_name not in special_params})
+        if coalescing_key is None:
+            _logger.debug(f"the arguments of the callback for input device '{self._input_device_name}' "
+                          f"can't be serialized. the call is not coalesced")
+        return coalescing_key
+
+    def _release_concurrency_limiter(self, start_time: float, error: Optional[BaseException] = None):
+        concurrency_limiter = self._concurrency_limiter
+        if concurrency_limiter is None:
+            return
+        if error is None:
+            concurrency_limiter.release(latency=time.perf_counter() - start_time)
+        else:  # only timeouts are a sign of overload. other errors don't adapt the limit
+            concurrency_limiter.release(dropped=isinstance(error, (CallbackTimeoutException, asyncio.TimeoutError)))
+
+    async def _run_callable_async(self,
+                                  kwargs: Dict[str, Any],
+                                  message_bundle: MessageBundle,
+                                  profiler: Optional[CallbackProfiler] = None) -> Any:
+        # the profiler wraps the coroutine (and not the await), so it profiles only the steps of this callback,
+        # even when it runs in a separate task (for the timeout) and the event loop runs other messages in between
         if self._callable_analysis.callable_type == _CallableType.ASYNC:
-            callback_return = self._fastmessage_handler.event_loop.run_until_complete(self._callable(**kwargs))
+            if self._retry_policy is None:
+                coroutine = self._callable(**kwargs)
+            else:
+                coroutine = self._retry_policy.run_async(self._callable, kwargs)
+            if profiler is not None:
+                coroutine = profiler.profile_coroutine(coroutine)
+
+            if self._timeout is None:
+                return await coroutine
+            try:
+                return await _wait_for(coroutine, self._timeout)
+            except _CallbackTimeoutError:
+                return self._handle_timeout(message_bundle)
+
+        items = MultipleReturnValues()
 
-        elif self._callable_analysis.callable_type == _CallableType.ASYNC_GENERATOR:
-            callback_return = self._iter_over_async(self._callable(**kwargs), self._fastmessage_handler.event_loop)
+        async def _collect_items():
+            async for item in self._callable(**kwargs):
+                items.append(item)
 
+        collect_items = _collect_items()
+        if profiler is not None:
+            collect_items = profiler.profile_coroutine(collect_items)
+        if self._timeout is None:
+            await collect_items
         else:
-            callback_return = self._callable(**kwargs)
+            try:
+                await _wait_for(collect_items, self._timeout)
+            except _CallbackTimeoutError:
+                items.append(self._handle_timeout(message_bundle))
+        return items
+
+    def get_results(self,
+                    callback_return: Any,
+                    message_scope: Optional[MessageScope] = None,
+                    span: Optional[Span] = None) -> Optional[Iterable[PipelineResult]]:
+        """
+        the last stage of handling a message: serializes the return value of the callable into pipeline results.
+        notice that if the callable is a generator, it runs while the results are iterated
 
-        if callback_return is None:
+        :param callback_return: the return value of the callable (from 'execute')
+        :param message_scope: the message scope of the dependencies (from 'execute'), that is closed after the results
+        :param span: the tracing span of the message (from 'start_span'), that is finished after the results
+        :return: the pipeline results to send
+        """
+        error: Optional[BaseException] = None
+        try:
+            if callback_return is None:
+                return None
+
+            results = self._get_pipeline_results(value=callback_return,
+                                                 default_output_device=self._output_device_name,
+                                                 span=span)
+            if span is not None or (message_scope is not None and isinstance(callback_return, Generator)):
+                # the results are serialized (and generators run) while they are iterated, so wait for them
+                results = self._close_after_iteration(results, message_scope, span)
+                message_scope = None
+                span = None
+
+            return results
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            if message_scope is not None:
+                message_scope.close()
+            self.finish_span(span, error)
+
+    def _resolve_dependencies(self, kwargs: Dict[str, Any]) -> Optional[MessageScope]:
+        if not self._callable_analysis.dependencies:
             return None
 
-        return self._get_pipeline_results(value=callback_return,
-                                          default_output_device=self._output_device_name)
+        dependency_resolver = self._fastmessage_handler._dependency_resolver
+        message_scope = MessageScope()
+        try:
+            for param_name, depends in self._callable_analysis.dependencies.items():
+                kwargs[param_name] = dependency_resolver.resolve(depends, message_scope)
+        except BaseException:
+            message_scope.close()
+            raise
 
-    def _get_pipeline_results(self,
-                              value: Any,
-                              default_output_device: Optional[str]) -> Iterable[PipelineResult]:
+        return message_scope
 
-        if isinstance(value, (MultipleReturnValues, Generator)):
-            return itertools.chain.from_iterable(map(lambda item: self._get_pipeline_results(item,
-                                                                                             default_output_device),
-                                                     value))
+    async def _resolve_dependencies_async(self, kwargs: Dict[str, Any]) -> Optional[MessageScope]:
+        if not self._callable_analysis.dependencies:
+            return None
 
-        elif isinstance(value, CustomOutput):
-            return self._get_pipeline_results(value=value.value,
-                                              default_output_device=value.output_device)
-        elif isinstance(value, OtherMethodOutput):
-            custom_output = self._method_validator.validate_and_return(value.method, **value.kwargs)
+        dependency_resolver = self._fastmessage_handler._dependency_resolver
+        message_scope = MessageScope()
+        try:
+            for param_name, depends in self._callable_analysis.dependencies.items():
+                kwargs[param_name] = await dependency_resolver.resolve_async(depends, message_scope)
+        except BaseException:
+            await message_scope.close_async()
+            raise
+
+        return message_scope
+
+    def _close_after_iteration(self,
+                               results: Iterable[PipelineResult],
+                               message_scope: Optional[MessageScope],
+                               span: Optional[Span]):
+        error: Optional[BaseException] = None
+        try:
+            yield from results
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            if message_scope is not None:
+                message_scope.close()
+            self.finish_span(span, error)
 
-            return self._get_pipeline_results(value=custom_output.value,
-                                              default_output_device=custom_output.output_device)
-        else:
-            pipeline_result = self._get_single_pipeline_result(value=value,
-                                                               output_device=default_output_device)
-            if pipeline_result is not None:
-                return [pipeline_result]
-
-        return []
+    def _get_pipeline_results(self,
+                              value: Any,
+                              default_output_device: Optional[str],
+                              span: Optional[Span] = None) -> Iterable[PipelineResult]:
+        value, output_device = self._resolve_output_device(value, default_output_device)
+        if isinstance(value, _NESTED_RESULT_TYPES):
+            return self._iter_pipeline_results(value, output_device, span)
+
+        pipeline_result = self._get_single_pipeline_result(value=value, output_device=output_device, span=span)
+        if pipeline_result is None:
+            return []
+        return [pipeline_result]
+
+    def _resolve_output_device(self, value: Any, output_device: Optional[str]) -> Tuple[Any, Optional[str]]:
+        # unwraps (possibly nested) CustomOutput and OtherMethodOutput values, into the value and its output device
+        while True:
+            if isinstance(value, CustomOutput):
+                output_device = value.output_device
+                value = value.value
+            elif isinstance(value, OtherMethodOutput):
+                custom_output = self._method_validator.validate_and_return(value.method, **value.kwargs)
+                output_device = custom_output.output_device
+                value = custom_output.value
+            else:
+                return value, output_device
+
+    def _iter_pipeline_results(self,
+                               values: Iterable[Any],
+                               default_output_device: Optional[str],
+                               span: Optional[Span]) -> Iterator[PipelineResult]:
+        # flattens nested MultipleReturnValues and generators using an explicit stack (instead of recursion),
+        # so deeply nested generators don't exhaust the call stack, and the results are streamed one by one
+        resolve_output_device = self._resolve_output_device
+        get_single_pipeline_result = self._get_single_pipeline_result
+        stack = [(iter(values), default_output_device)]
+        while stack:
+            iterator, iterator_output_device = stack[-1]
+            for value in iterator:
+                if isinstance(value, _OUTPUT_WRAPPER_TYPES):
+                    value, output_device = resolve_output_device(value, iterator_output_device)
+                else:
+                    output_device = iterator_output_device
+
+                if isinstance(value, _NESTED_RESULT_TYPES):
+                    stack.append((iter(value), output_device))
+                    break
+
+                pipeline_result = get_single_pipeline_result(value, output_device, span)
+                if pipeline_result is not None:
+                    yield pipeline_result
+            else:
+                stack.pop()
 
-    def _get_single_pipeline_result(self, value: Any, output_device: Optional[str]) -> Optional[PipelineResult]:
+    def _get_single_pipeline_result(self,
+                                    value: Any,
+                                    output_device: Optional[str],
+                                    span: Optional[Span] = None) -> Optional[PipelineResult]:
         if output_device is None:
             _logger.warning(f"callback for input device '{self._input_device_name}' returned value, "
                             f"but is not mapped to output device")
@@ -236,8 +938,20 @@ class CallableWrapper:
         elif isinstance(value, Message):
             output_bundle = MessageBundle(message=value)
         else:
-            json_encoder = getattr(value, '__json_encoder__', BaseModel.__json_encoder__)
-            output_data = json.dumps(value, default=json_encoder).encode()
-            output_bundle = MessageBundle(message=Message(data=output_data))
-
+            if isinstance(value, PreSerializedOutput):
+                output_data = value.data
+            else:
+                output_data = encode_output(value)
+
+            # the sent-at header is used by the next hop for its ttl and wait time measurements
+            output_headers: Dict[str, Any] = {SENT_AT_HEADER: time.time()}
+            if span is not None:
+                span.inject(output_headers)
+            output_data = self._fastmessage_handler._message_compressor.compress(output_device,
+                                                                                 output_data,
+                                                                                 output_headers)
+            output_data = self._fastmessage_handler._claim_check.check_in(output_data, output_headers)
+            output_bundle = MessageBundle(message=Message(data=output_data, headers=output_headers))
+
+        self._route_counter.record_output(output_device)
         return PipelineResult(output_device_name=output_device, message_bundle=output_bundle)
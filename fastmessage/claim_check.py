@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+import uuid
+from abc import ABCMeta, abstractmethod
+from typing import Optional
+
+from fastmessage.exceptions import ClaimCheckException
+from messageflux.iodevices.base.common import Message, MessageHeaders
+
+CLAIM_CHECK_HEADER = 'fastmessage-claim-check'
+
+
+class BlobStore(metaclass=ABCMeta):
+    """
+    a base class for stores that hold oversized message bodies (for claim check)
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """
+        stores the data
+
+        :param data: the data to store
+        :return: the reference to the stored data
+        """
+        pass
+
+    @abstractmethod
+    def get(self, reference: str) -> bytes:
+        """
+        returns stored data
+
+        :param reference: the reference that was returned from 'put'
+        :return: the stored data
+        """
+        pass
+
+    def delete(self, reference: str):
+        """
+        deletes stored data (the default implementation does nothing)
+
+        :param reference: the reference that was returned from 'put'
+        """
+        pass
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    a blob store that holds the data as files in a (possibly shared) directory
+    """
+
+    def __init__(self, root_path: str, retention: Optional[float] = None):
+        """
+
+        :param root_path: the directory to store the files in (created if it doesn't exist)
+        :param retention: optional time (in seconds) to keep each file. older files are deleted by 'cleanup',
+        which is also called by 'put' (at most once every tenth of the retention). None keeps the files forever.
+        notice that the retention should be longer than the time it takes for a message to be handled
+        (including redeliveries), since the files are not deleted when they are read
+        """
+        self._root_path = root_path
+        self._retention = retention
+        self._cleanup_interval = 0.0 if retention is None else retention / 10
+        self._last_cleanup = time.monotonic()
+        self._cleanup_lock = threading.Lock()
+        os.makedirs(self._root_path, exist_ok=True)
+
+    def _get_path(self, reference: str) -> str:
+        if not reference or os.path.basename(reference) != reference or reference.startswith('.'):
+            raise ClaimCheckException(f"invalid claim check reference '{reference}'")
+        return os.path.join(self._root_path, reference)
+
+    def put(self, data: bytes) -> str:
+        reference = uuid.uuid4().hex
+        path = self._get_path(reference)
+        temp_path = os.path.join(self._root_path, f'.{reference}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)  # so readers never see a partially written file
+        self._cleanup_if_needed()
+        return reference
+
+    def get(self, reference: str) -> bytes:
+        try:
+            with open(self._get_path(reference), 'rb') as f:
+                return f.read()
+        except FileNotFoundError as ex:
+            raise ClaimCheckException(f"claim check reference '{reference}' was not found") from ex
+
+    def delete(self, reference: str):
+        try:
+            os.remove(self._get_path(reference))
+        except FileNotFoundError:
+            pass
+
+    def _cleanup_if_needed(self):
+        if self._retention is None:
+            return
+        now = time.monotonic()
+        with self._cleanup_lock:
+            if now - self._last_cleanup < self._cleanup_interval:
+                return
+            self._last_cleanup = now
+        self.cleanup()
+
+    def cleanup(self) -> int:
+        """
+        deletes the files that are older than the retention (does nothing if there's no retention)
+
+        :return: the number of deleted files
+        """
+        if self._retention is None:
+            return 0
+
+        min_mtime = time.time() - self._retention
+        deleted_count = 0
+        with os.scandir(self._root_path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < min_mtime:
+                        os.remove(entry.path)
+                        deleted_count += 1
+                except FileNotFoundError:
+                    pass  # deleted concurrently (e.g. by another process that shares the directory)
+        return deleted_count
+
+
+class ClaimCheck:
+    """
+    a helper class that offloads oversized outputs to a blob store, and resolves the references on input
+    """
+
+    def __init__(self):
+        self._blob_store: Optional[BlobStore] = None
+        self._threshold = 0
+
+    def set_blob_store(self, blob_store: Optional[BlobStore], threshold: int):
+        """
+        sets the blob store to use
+
+        :param blob_store: the blob store to use (None disables the claim check on output)
+        :param threshold: the minimum size (in bytes) of an output to be offloaded to the blob store
+        """
+        self._blob_store = blob_store
+        self._threshold = threshold
+
+    def resolve(self, message: Message) -> bytes:
+        """
+        returns the body of the message, reading it from the blob store if the message has a claim check header
+
+        :param message: the message to return the body for
+        :return: the body of the message
+        """
+        reference = message.headers.get(CLAIM_CHECK_HEADER)
+        if reference is None:
+            return message.bytes
+
+        if self._blob_store is None:
+            raise ClaimCheckException(f"message has claim check reference '{reference}', "
+                                      f"but no blob store was set")
+        return self._blob_store.get(reference)
+
+    def check_in(self, data: bytes, headers: MessageHeaders) -> bytes:
+        """
+        offloads the data to the blob store if it is large enough, and sets the claim check header
+
+        :param data: the output data
+        :param headers: the headers of the output message
+        :return: the data to send (empty if it was offloaded)
+        """
+        if self._blob_store is None or len(data) < self._threshold:
+            return data
+
+        headers[CLAIM_CHECK_HEADER] = self._blob_store.put(data)
+        return b''
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from pydantic import BaseModel
+
+_key_encoder = json.JSONEncoder(default=BaseModel.__json_encoder__, sort_keys=True)
+
+
+def get_coalescing_key(kwargs: Dict[str, Any]) -> Optional[str]:
+    """
+    returns the key of a call by its (validated) arguments
+
+    :param kwargs: the arguments of the call
+    :return: the key of the call (or None if the arguments can't be serialized, so the call can't be coalesced)
+    """
+    try:
+        return _key_encoder.encode(kwargs)
+    except (TypeError, ValueError):
+        return None
+
+
+class SingleFlight:
+    """
+    coalesces concurrent calls with the same key: the first call runs, and the calls with the same key that arrive
+    while it's running wait for it, and get its return value (or its exception).
+    nothing is kept after the call is done, so the next call with that key runs again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    @property
+    def executions(self) -> int:
+        """
+        the number of calls that actually ran
+        """
+        return self._executions
+
+    @property
+    def coalesced(self) -> int:
+        """
+        the number of calls that waited for another call with the same key, instead of running
+        """
+        return self._coalesced
+
+    @property
+    def in_flight(self) -> int:
+        """
+        the number of keys that have a running call
+        """
+        return len(self._calls)
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+
+            future = Future()
+            self._calls[key] = future
+            self._executions += 1
+            return future, True
+
+    def _complete(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: Hashable, func: Callable[..., Any], *args) -> Any:
+        """
+        runs the function, unless a call with the same key is running (then waits for its result)
+
+        :param key: the key of the call
+        :param func: the function to run
+        :return: the return value of the function
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as ex:
+            self._complete(key, future, error=ex)
+            raise
+        self._complete(key, future, result=result)
+        return result
+
+    async def run_async(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """
+        awaits the async function, unless a call with the same key is running (then waits for its result)
+
+        :param key: the key of the call
+        :param func: the async function to run
+        :return: the return value of the function
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            # shielded, so a cancelled waiter doesn't cancel the result for the others
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await func(*args)
+        except BaseException as ex:
+            self._complete(key, future, error=ex)
+            raise
+        self._complete(key, future, result=result)
+        return result
@@ -1,12 +1,16 @@
 import logging
 from dataclasses import dataclass
-from typing import Callable, Any, TypeVar, Union
+from typing import Callable, Any, TypeVar, Union, Generic, Type, Optional
+
+from pydantic import BaseModel
 
 from fastmessage.exceptions import UnnamedCallableException
+from fastmessage.output_encoding import encode_output
 
 _logger = logging.getLogger('fastmessage')
 
 _CALLABLE_TYPE = TypeVar('_CALLABLE_TYPE', bound=Callable[..., Any])
+_MODEL_TYPE = TypeVar('_MODEL_TYPE', bound=BaseModel)
 
 
 def get_callable_name(named_callable: _CALLABLE_TYPE) -> str:
@@ -30,6 +34,40 @@ class InputDeviceName(str):
     pass
 
 
+class LazyBody(Generic[_MODEL_TYPE]):
+    """
+    a place holder class for the message body, that is parsed into the model only when it is first accessed.
+    annotate a param with LazyBody[SomeModel] to receive it
+    """
+    __slots__ = '_model', '_body_loader', '_value'
+
+    def __init__(self, model: Type[_MODEL_TYPE], body_loader: Callable[[], bytes]):
+        """
+
+        :param model: the model to parse the body into
+        :param body_loader: a callable that returns the raw body of the message
+        """
+        self._model = model
+        self._body_loader = body_loader
+        self._value: Optional[_MODEL_TYPE] = None
+
+    @property
+    def is_parsed(self) -> bool:
+        """
+        True if the body was already parsed
+        """
+        return self._value is not None
+
+    @property
+    def value(self) -> _MODEL_TYPE:
+        """
+        the parsed body (parses it on first access). raises ValidationError if the body doesn't match the model
+        """
+        if self._value is None:
+            self._value = self._model.parse_raw(self._body_loader())
+        return self._value
+
+
 class MultipleReturnValues(list):
     """
     a value that indicates that multiple output values should be returned
@@ -46,6 +84,21 @@ class CustomOutput:
     value: Any
 
 
+class PreSerializedOutput:
+    """
+    an output value that is serialized only once, when it is created.
+    useful for constant outputs that are returned many times
+    """
+    __slots__ = 'data'
+
+    def __init__(self, value: Any):
+        """
+
+        :param value: the value to serialize
+        """
+        self.data: bytes = encode_output(value)
+
+
 class OtherMethodOutput:
     """
     a result that contains the other method to send the result to
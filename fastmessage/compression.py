@@ -0,0 +1,237 @@
+import gzip
+import lzma
+import zlib
+from abc import ABCMeta, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from fastmessage.exceptions import DecompressionException, UnknownCompressionCodecException
+from messageflux.iodevices.base.common import MessageHeaders
+
+CONTENT_ENCODING_HEADER = 'content-encoding'
+IDENTITY_ENCODING = 'identity'
+DEFAULT_MAX_DECOMPRESSED_SIZE = 100 * 1024 * 1024
+
+
+def _decompress_streams(create_decompressor: Callable[[], Any], data: bytes, max_size: int) -> bytes:
+    """
+    decompresses all the (concatenated) compressed streams in the data, without ever holding more than max_size + 1
+    decompressed bytes
+    """
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        decompressor = create_decompressor()
+        chunk = decompressor.decompress(data, max_size - size + 1)
+        size += len(chunk)
+        if size > max_size:
+            raise DecompressionException(f'decompressed data is larger than {max_size} bytes')
+        if not decompressor.eof:
+            raise DecompressionException('compressed data ended before the end of the stream')
+        chunks.append(chunk)
+        data = decompressor.unused_data.lstrip(b'\x00')  # streams may be padded with zeros
+        if not data:
+            return b''.join(chunks)
+
+
+class CompressionCodec(metaclass=ABCMeta):
+    """
+    a base class for codecs that compress and decompress message bodies
+    """
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """
+        compresses the data
+
+        :param data: the data to compress
+        :return: the compressed data
+        """
+        pass
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        """
+        decompresses the data
+
+        :param data: the compressed data
+        :return: the decompressed data
+        """
+        pass
+
+    def decompress_limited(self, data: bytes, max_size: int) -> bytes:
+        """
+        decompresses the data, and makes sure it's not larger than max_size.
+        the default implementation checks the size after decompressing it, codecs should override this in order
+        to stop decompressing as soon as the limit is reached
+
+        :param data: the compressed data
+        :param max_size: the maximum size (in bytes) of the decompressed data
+        :return: the decompressed data
+        """
+        result = self.decompress(data)
+        if len(result) > max_size:
+            raise DecompressionException(f'decompressed data is larger than {max_size} bytes')
+        return result
+
+
+class ZlibCodec(CompressionCodec):
+    """
+    a codec that uses zlib
+    """
+
+    def __init__(self, level: int = -1):
+        """
+
+        :param level: the compression level (0-9, -1 is the default level)
+        """
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+    def decompress_limited(self, data: bytes, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size + 1)
+        if len(result) > max_size:
+            raise DecompressionException(f'decompressed data is larger than {max_size} bytes')
+        if not decompressor.eof:
+            raise DecompressionException('compressed data ended before the end of the stream')
+        return result
+
+
+class GzipCodec(CompressionCodec):
+    """
+    a codec that uses gzip
+    """
+
+    def __init__(self, level: int = 9):
+        """
+
+        :param level: the compression level (0-9)
+        """
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, self._level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+    def decompress_limited(self, data: bytes, max_size: int) -> bytes:
+        return _decompress_streams(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), data, max_size)
+
+
+class LzmaCodec(CompressionCodec):
+    """
+    a codec that uses lzma
+    """
+
+    def __init__(self, preset: Optional[int] = None):
+        """
+
+        :param preset: the compression preset (0-9, None is the default preset)
+        """
+        self._preset = preset
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self._preset)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+    def decompress_limited(self, data: bytes, max_size: int) -> bytes:
+        return _decompress_streams(lzma.LZMADecompressor, data, max_size)
+
+
+@dataclass
+class _OutputCompression:
+    codec_name: str
+    codec: CompressionCodec
+    threshold: int
+
+
+class MessageCompressor:
+    """
+    a helper class that holds the compression codecs, and the compression settings for each output device
+    """
+
+    def __init__(self, max_decompressed_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE):
+        """
+
+        :param max_decompressed_size: the maximum size (in bytes) of a decompressed input message
+        """
+        self.max_decompressed_size = max_decompressed_size
+        self._codecs: Dict[str, CompressionCodec] = {
+            'zlib': ZlibCodec(),
+            'gzip': GzipCodec(),
+            'lzma': LzmaCodec(),
+        }
+        self._output_compression: Dict[str, _OutputCompression] = {}
+
+    def register_codec(self, name: str, codec: CompressionCodec):
+        """
+        registers a compression codec (replaces an existing codec with the same name)
+
+        :param name: the name of the codec (this is the value of the 'content-encoding' header)
+        :param codec: the codec to register
+        """
+        self._codecs[name] = codec
+
+    def _get_codec(self, name: str) -> CompressionCodec:
+        codec = self._codecs.get(name)
+        if codec is None:
+            raise UnknownCompressionCodecException(f"compression codec '{name}' is not registered")
+        return codec
+
+    def set_output_compression(self, output_device: str, codec_name: str = 'gzip', threshold: int = 1024):
+        """
+        makes the outputs to some output device compressed (if they are large enough)
+
+        :param output_device: the output device to compress the outputs for
+        :param codec_name: the name of the codec to use
+        :param threshold: the minimum size (in bytes) of an output to be compressed
+        """
+        self._output_compression[output_device] = _OutputCompression(codec_name=codec_name,
+                                                                     codec=self._get_codec(codec_name),
+                                                                     threshold=threshold)
+
+    def decompress(self, data: bytes, headers: MessageHeaders) -> bytes:
+        """
+        decompresses the body of a message according to its 'content-encoding' header
+
+        :param data: the body of the message
+        :param headers: the headers of the message
+        :return: the (decompressed) body
+        """
+        codec_name = headers.get(CONTENT_ENCODING_HEADER)
+        if codec_name is None or codec_name == IDENTITY_ENCODING:
+            return data
+
+        codec = self._get_codec(codec_name)
+        try:
+            return codec.decompress_limited(data, self.max_decompressed_size)
+        except DecompressionException:
+            raise
+        except Exception as ex:
+            raise DecompressionException(f"failed to decompress message with codec '{codec_name}'") from ex
+
+    def compress(self, output_device: str, data: bytes, headers: MessageHeaders) -> bytes:
+        """
+        compresses the data, if compression is set for the output device, and the data is large enough.
+        sets the 'content-encoding' header if the data was compressed
+
+        :param output_device: the output device that the data is sent to
+        :param data: the data to compress
+        :param headers: the headers of the output message
+        :return: the data to send (compressed or not)
+        """
+        output_compression = self._output_compression.get(output_device)
+        if output_compression is None or len(data) < output_compression.threshold:
+            return data
+
+        headers[CONTENT_ENCODING_HEADER] = output_compression.codec_name
+        return output_compression.codec.compress(data)
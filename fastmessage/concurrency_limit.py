@@ -0,0 +1,268 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional, Union
+
+
+@dataclass
+class ConcurrencyLimiterStats:
+    """
+    a snapshot of the state of an adaptive concurrency limiter
+    """
+    limit: int
+    in_flight: int
+    waiting: int
+    admitted_count: int
+    queued_count: int
+    average_wait_time: float
+    max_wait_time: float
+    baseline_latency: Optional[float]
+    average_latency: Optional[float]
+
+
+class _ThreadWaiter:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def grant(self):
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+
+
+class _AsyncWaiter:
+    def __init__(self):
+        self._event_loop = asyncio.get_running_loop()
+        self.future: asyncio.Future = self._event_loop.create_future()
+
+    def grant(self):
+        # the slot may be released on another thread (sync callbacks run on a thread pool)
+        self._event_loop.call_soon_threadsafe(self._set_result)
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    limits the number of messages that a callback handles at the same time, and adapts the limit to the observed
+    callback latency (AIMD): while the latency is normal, the limit grows by about one for every 'limit' completed
+    calls, and when the latency exceeds the target (or a call times out), the limit is multiplied by 'backoff_ratio'.
+    this way the concurrency converges near the capacity of the resources that the callback depends on.
+
+    the waiting messages are admitted in FIFO order, both for threads ('acquire') and for coroutines ('acquire_async')
+    """
+
+    def __init__(self,
+                 initial_limit: int = 10,
+                 min_limit: int = 1,
+                 max_limit: int = 1000,
+                 latency_target: Optional[float] = None,
+                 latency_tolerance: float = 2.0,
+                 backoff_ratio: float = 0.9,
+                 latency_smoothing: float = 0.1,
+                 baseline_window: float = 60):
+        """
+
+        :param initial_limit: the concurrency limit to start with
+        :param min_limit: the minimum concurrency limit
+        :param max_limit: the maximum concurrency limit
+        :param latency_target: optional callback latency (in seconds) above which the limit is decreased.
+        if not given, the target is 'latency_tolerance' times the baseline latency
+        (the minimum latency that was observed lately, which is the latency without load)
+        :param latency_tolerance: the ratio between the baseline latency and the latency that is considered overload
+        (used when 'latency_target' is not given)
+        :param backoff_ratio: the ratio to multiply the limit by, when overload is detected
+        :param latency_smoothing: the weight of each new latency sample in the (exponential) average latency
+        :param baseline_window: the time (in seconds) it takes the baseline latency to forget a minimum latency.
+        the baseline is the minimum of the current and the previous windows (instead of the all time minimum),
+        so it follows a lasting increase of the latency without load (e.g. after the resources were changed)
+        """
+        self._min_limit = max(1, min_limit)
+        self._max_limit = max(self._min_limit, max_limit)
+        self._limit = float(min(max(initial_limit, self._min_limit), self._max_limit))
+        self._latency_target = latency_target
+        self._latency_tolerance = latency_tolerance
+        self._backoff_ratio = backoff_ratio
+        self._latency_smoothing = latency_smoothing
+        self._baseline_window = baseline_window
+        self._window_start_time = 0.0
+        self._window_min_latency: Optional[float] = None
+        self._previous_window_min_latency: Optional[float] = None
+        self._lock = threading.Lock()
+        self._waiters: Deque[Union[_ThreadWaiter, _AsyncWaiter]] = deque()
+        self._in_flight = 0
+        self._last_decrease_time = 0.0
+        self._baseline_latency: Optional[float] = None
+        self._average_latency: Optional[float] = None
+        self._admitted_count = 0
+        self._queued_count = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    @property
+    def limit(self) -> int:
+        """
+        the current concurrency limit
+        """
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        the number of calls that were admitted and not released yet
+        """
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        """
+        the number of calls that are waiting to be admitted
+        """
+        return len(self._waiters)
+
+    def get_stats(self) -> ConcurrencyLimiterStats:
+        """
+        returns a snapshot of the limit, the in flight calls and the queueing stats
+        """
+        with self._lock:
+            queued_count = self._queued_count
+            return ConcurrencyLimiterStats(limit=int(self._limit),
+                                           in_flight=self._in_flight,
+                                           waiting=len(self._waiters),
+                                           admitted_count=self._admitted_count,
+                                           queued_count=queued_count,
+                                           average_wait_time=self._total_wait_time / queued_count
+                                           if queued_count else 0.0,
+                                           max_wait_time=self._max_wait_time,
+                                           baseline_latency=self._baseline_latency,
+                                           average_latency=self._average_latency)
+
+    def reset_baseline(self):
+        """
+        forgets the baseline latency (e.g. after the resources that the callback depends on were changed)
+        """
+        with self._lock:
+            self._baseline_latency = None
+            self._window_min_latency = None
+            self._previous_window_min_latency = None
+
+    def _try_admit(self) -> bool:
+        # must be called with the lock held
+        if not self._waiters and self._in_flight < int(self._limit):
+            self._in_flight += 1
+            self._admitted_count += 1
+            return True
+        return False
+
+    def _record_wait(self, wait_time: float):
+        with self._lock:
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+    def _grant_waiters(self):
+        # must be called with the lock held
+        while self._waiters and self._in_flight < int(self._limit):
+            waiter = self._waiters.popleft()
+            self._in_flight += 1
+            self._admitted_count += 1
+            waiter.grant()
+
+    def acquire(self):
+        """
+        blocks until the call is admitted (must be followed by 'release')
+        """
+        with self._lock:
+            if self._try_admit():
+                return
+            waiter = _ThreadWaiter()
+            self._waiters.append(waiter)
+            self._queued_count += 1
+
+        start_time = time.perf_counter()
+        waiter.wait()
+        self._record_wait(time.perf_counter() - start_time)
+
+    async def acquire_async(self):
+        """
+        waits (asynchronously) until the call is admitted (must be followed by 'release')
+        """
+        with self._lock:
+            if self._try_admit():
+                return
+            waiter = _AsyncWaiter()
+            self._waiters.append(waiter)
+            self._queued_count += 1
+
+        start_time = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:  # the slot was already granted to this waiter
+                    granted = True
+            if granted:
+                self.release()
+            raise
+        self._record_wait(time.perf_counter() - start_time)
+
+    def release(self, latency: Optional[float] = None, dropped: bool = False):
+        """
+        releases an admitted call, and adapts the limit to its outcome
+
+        :param latency: the latency (in seconds) of the call (None doesn't adapt the limit, e.g. if the call failed)
+        :param dropped: True if the call was dropped because of overload (e.g. it timed out)
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if dropped or latency is not None:
+                self._adapt_limit(latency, dropped)
+            self._grant_waiters()
+
+    def _adapt_limit(self, latency: Optional[float], dropped: bool):
+        # must be called with the lock held
+        now = time.perf_counter()
+        if latency is not None:
+            self._record_latency(latency)
+
+        if dropped or (latency is not None and latency > self._get_latency_target()):
+            # decrease only once for the calls that were in flight together, so a single overload spike
+            # (that all of them observe) doesn't collapse the limit
+            if latency is None or now - latency >= self._last_decrease_time:
+                self._limit = max(float(self._min_limit), self._limit * self._backoff_ratio)
+                self._last_decrease_time = now
+        elif self._in_flight * 2 >= int(self._limit):
+            # the limit is only increased while it's actually used, so it won't grow without bound when idle
+            self._limit = min(float(self._max_limit), self._limit + 1 / self._limit)
+
+    def _record_latency(self, latency: float):
+        if self._average_latency is None:
+            self._average_latency = latency
+        else:
+            self._average_latency += self._latency_smoothing * (latency - self._average_latency)
+
+        now = time.perf_counter()
+        if now - self._window_start_time >= self._baseline_window:
+            self._previous_window_min_latency = self._window_min_latency
+            self._window_min_latency = None
+            self._window_start_time = now
+        if self._window_min_latency is None or latency < self._window_min_latency:
+            self._window_min_latency = latency
+
+        if self._previous_window_min_latency is None:
+            self._baseline_latency = self._window_min_latency
+        else:
+            self._baseline_latency = min(self._window_min_latency, self._previous_window_min_latency)
+
+    def _get_latency_target(self) -> float:
+        if self._latency_target is not None:
+            return self._latency_target
+        assert self._baseline_latency is not None
+        return self._baseline_latency * self._latency_tolerance
@@ -0,0 +1,369 @@
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import weakref
+from asyncio import AbstractEventLoop
+from enum import Enum, auto
+from functools import partial
+from typing import Callable, Any, Dict, List, Iterator, AsyncIterator, TYPE_CHECKING, Tuple, MutableMapping, Optional
+
+from fastmessage.common import _logger
+
+if TYPE_CHECKING:
+    from fastmessage.fastmessage_handler import FastMessage
+
+_TEARDOWN_TYPE = Callable[[], Any]  # teardowns of values that were resolved asynchronously return an awaitable
+_LOOP_TEARDOWN_TIMEOUT = 30  # seconds to wait for the teardowns on an event loop that runs on another thread
+
+
+class DependencyScope(Enum):
+    """
+    the scope (lifetime) of a dependency value
+    """
+    PROCESS = auto()
+    """a single value is created for the whole process, and torn down on FastMessage.shutdown"""
+
+    THREAD = auto()
+    """a value is created for each worker thread, and torn down on FastMessage.shutdown"""
+
+    EVENT_LOOP = auto()
+    """a value is created for each event loop (use this for async resources), and torn down on FastMessage.shutdown"""
+
+    MESSAGE = auto()
+    """a value is created for each message, and torn down after the message is handled"""
+
+
+class Depends:
+    """
+    use this as the default value of a callback param, to inject a value that is created by a provider.
+
+    the provider can be a function, an async function, a generator or an async generator
+    (for generators, the yielded value is injected, and the code after the 'yield' is the teardown).
+    the provider can have params with Depends default values of its own
+    """
+
+    def __init__(self, provider: Callable[..., Any], scope: DependencyScope = DependencyScope.MESSAGE):
+        """
+
+        :param provider: the callable that creates the value
+        :param scope: the scope (lifetime) of the created value
+        """
+        self.provider = provider
+        self.scope = scope
+
+
+class MessageScope:
+    """
+    holds the dependency values that were created for a single message, and their teardowns
+    """
+
+    def __init__(self):
+        self.values: Dict[Callable, Any] = {}
+        self.teardowns: List[_TEARDOWN_TYPE] = []
+
+    def close(self):
+        """
+        tears down the dependency values of this message (in reverse creation order)
+        """
+        _run_teardowns(self.teardowns)
+        self.values.clear()
+
+    async def close_async(self):
+        """
+        tears down the dependency values of this message (in reverse creation order),
+        awaiting the teardowns of the values that were created by 'DependencyResolver.resolve_async'
+        """
+        await _run_teardowns_async(self.teardowns)
+        self.values.clear()
+
+
+def _run_teardowns(teardowns: List[_TEARDOWN_TYPE]):
+    while teardowns:
+        teardown = teardowns.pop()
+        try:
+            teardown()
+        except Exception:
+            _logger.exception('Error tearing down dependency')
+
+
+async def _run_teardowns_async(teardowns: List[_TEARDOWN_TYPE]):
+    while teardowns:
+        teardown = teardowns.pop()
+        try:
+            result = teardown()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            _logger.exception('Error tearing down dependency')
+
+
+def _get_running_loop() -> Optional[AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _run_teardowns_on_loop(loop: AbstractEventLoop, teardowns: List[_TEARDOWN_TYPE]):
+    # async generators must be closed on the event loop they were created on
+    if loop.is_closed():
+        _logger.warning(f'{len(teardowns)} dependencies were not torn down, since their event loop is closed')
+        return
+
+    coroutine = _run_teardowns_async(teardowns)
+    running_loop = _get_running_loop()
+    if running_loop is loop:
+        loop.create_task(coroutine)  # can't wait for it without blocking the loop
+    elif loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout=_LOOP_TEARDOWN_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            _logger.warning(f'timed out waiting for the dependencies of event loop {loop} to be torn down')
+    elif running_loop is None:
+        loop.run_until_complete(coroutine)
+    else:  # another event loop runs on this thread, so this one can't run here
+        coroutine.close()
+        _logger.warning(f'{len(teardowns)} dependencies were not torn down, since shutdown was called '
+                        f'from a running event loop')
+
+
+def _close_generator(generator: Iterator):
+    try:
+        next(generator)
+    except StopIteration:
+        return
+    _logger.warning(f'dependency provider {generator} yielded more than once')
+
+
+def _close_async_generator(async_generator: AsyncIterator, loop: AbstractEventLoop):
+    try:
+        loop.run_until_complete(async_generator.__anext__())
+    except StopAsyncIteration:
+        return
+    _logger.warning(f'dependency provider {async_generator} yielded more than once')
+
+
+async def _close_async_generator_async(async_generator: AsyncIterator):
+    try:
+        await async_generator.__anext__()
+    except StopAsyncIteration:
+        return
+    _logger.warning(f'dependency provider {async_generator} yielded more than once')
+
+
+def get_dependencies(func: Callable) -> Dict[str, Depends]:
+    """
+    returns the params of a callable, that have Depends default value
+
+    :param func: the callable to inspect
+    :return: a dict of param name to its Depends
+    """
+    return {param_name: param.default
+            for param_name, param in inspect.signature(func).parameters.items()
+            if isinstance(param.default, Depends)}
+
+
+class DependencyResolver:
+    """
+    creates and caches the dependency values according to their scopes, and tears them down
+    """
+
+    def __init__(self, fastmessage_handler: 'FastMessage'):
+        self._fastmessage_handler = fastmessage_handler
+        self._lock = threading.RLock()
+        self._process_values: Dict[Callable, Any] = {}
+        self._thread_local = threading.local()
+        self._generation = 0  # increased on close, to invalidate the values of all the threads
+        # keyed weakly, so the values don't keep the event loops that were closed (and dropped) alive
+        self._event_loop_values: MutableMapping[AbstractEventLoop, Dict[Callable, Any]] = weakref.WeakKeyDictionary()
+        # the teardowns of the (non message scoped) values that were created by async generators, by the event loop
+        # they must be torn down on, with the cache that holds each value
+        self._loop_teardowns: MutableMapping[AbstractEventLoop,
+                                             List[Tuple[Dict[Callable, Any], Callable, _TEARDOWN_TYPE]]] = \
+            weakref.WeakKeyDictionary()
+        self._sub_dependencies: Dict[Callable, Dict[str, Depends]] = {}
+        self._teardowns: List[_TEARDOWN_TYPE] = []
+        # a lock for each provider of shared (process or event loop scoped) values, so each value is created once,
+        # without blocking the resolution of other values while it's created
+        self._creation_locks: Dict[Callable, threading.Lock] = {}
+
+    def _get_sub_dependencies(self, provider: Callable) -> Dict[str, Depends]:
+        sub_dependencies = self._sub_dependencies.get(provider)
+        if sub_dependencies is None:
+            sub_dependencies = get_dependencies(provider)
+            self._sub_dependencies[provider] = sub_dependencies
+        return sub_dependencies
+
+    def _add_loop_teardown(self,
+                           loop: AbstractEventLoop,
+                           cache: Dict[Callable, Any],
+                           provider: Callable,
+                           async_generator: AsyncIterator):
+        with self._lock:
+            loop_teardowns = self._loop_teardowns.setdefault(loop, [])
+            loop_teardowns.append((cache, provider, partial(_close_async_generator_async, async_generator)))
+
+    def _create(self, provider: Callable, message_scope: MessageScope, cache: Dict[Callable, Any]) -> Any:
+        kwargs = {param_name: self.resolve(depends, message_scope)
+                  for param_name, depends in self._get_sub_dependencies(provider).items()}
+
+        teardowns = message_scope.teardowns if cache is message_scope.values else self._teardowns
+        if inspect.isasyncgenfunction(provider):
+            loop = self._fastmessage_handler.event_loop
+            async_generator = provider(**kwargs)
+            value = loop.run_until_complete(async_generator.__anext__())
+            if teardowns is message_scope.teardowns:
+                teardowns.append(partial(_close_async_generator, async_generator, loop))
+            else:
+                self._add_loop_teardown(loop, cache, provider, async_generator)
+        elif inspect.isgeneratorfunction(provider):
+            generator = provider(**kwargs)
+            value = next(generator)
+            teardowns.append(partial(_close_generator, generator))
+        elif inspect.iscoroutinefunction(provider):
+            value = self._fastmessage_handler.event_loop.run_until_complete(provider(**kwargs))
+        else:
+            value = provider(**kwargs)
+
+        return value
+
+    def _get_or_create(self, cache: Dict[Callable, Any], provider: Callable, message_scope: MessageScope) -> Any:
+        try:
+            return cache[provider]
+        except KeyError:
+            pass
+
+        value = self._create(provider, message_scope, cache)
+        cache[provider] = value
+        return value
+
+    def _get_thread_values(self) -> Dict[Callable, Any]:
+        if getattr(self._thread_local, 'generation', None) != self._generation:
+            self._thread_local.generation = self._generation
+            self._thread_local.values = {}
+        return self._thread_local.values
+
+    def _get_event_loop_values(self, loop: AbstractEventLoop) -> Dict[Callable, Any]:
+        values = self._event_loop_values.get(loop)
+        if values is None:
+            values = {}
+            self._event_loop_values[loop] = values
+        return values
+
+    def resolve(self, depends: Depends, message_scope: MessageScope) -> Any:
+        """
+        returns the value for a dependency (creating it if needed)
+
+        :param depends: the dependency to resolve
+        :param message_scope: the scope of the current message
+        :return: the dependency value
+        """
+        if depends.scope is DependencyScope.MESSAGE:
+            return self._get_or_create(message_scope.values, depends.provider, message_scope)
+        if depends.scope is DependencyScope.THREAD:
+            return self._get_or_create(self._get_thread_values(), depends.provider, message_scope)
+
+        with self._lock:
+            if depends.scope is DependencyScope.PROCESS:
+                cache = self._process_values
+            else:
+                cache = self._get_event_loop_values(self._fastmessage_handler.event_loop)
+            try:
+                return cache[depends.provider]
+            except KeyError:
+                creation_lock = self._creation_locks.setdefault(depends.provider, threading.Lock())
+
+        with creation_lock:
+            return self._get_or_create(cache, depends.provider, message_scope)
+
+    async def _create_async(self,
+                            provider: Callable,
+                            message_scope: MessageScope,
+                            cache: Dict[Callable, Any]) -> Any:
+        kwargs = {param_name: await self.resolve_async(depends, message_scope)
+                  for param_name, depends in self._get_sub_dependencies(provider).items()}
+
+        teardowns = message_scope.teardowns if cache is message_scope.values else self._teardowns
+        if inspect.isasyncgenfunction(provider):
+            async_generator = provider(**kwargs)
+            value = await async_generator.__anext__()
+            if teardowns is message_scope.teardowns:
+                teardowns.append(partial(_close_async_generator_async, async_generator))
+            else:
+                self._add_loop_teardown(asyncio.get_running_loop(), cache, provider, async_generator)
+        elif inspect.isgeneratorfunction(provider):
+            generator = provider(**kwargs)
+            value = next(generator)
+            teardowns.append(partial(_close_generator, generator))
+        elif inspect.iscoroutinefunction(provider):
+            value = await provider(**kwargs)
+        else:
+            value = provider(**kwargs)
+
+        return value
+
+    async def resolve_async(self, depends: Depends, message_scope: MessageScope) -> Any:
+        """
+        returns the value for a dependency (creating it if needed), awaiting async providers on the running event loop.
+        message scoped values that are created this way must be torn down with 'MessageScope.close_async'
+
+        :param depends: the dependency to resolve
+        :param message_scope: the scope of the current message
+        :return: the dependency value
+        """
+        if depends.scope is DependencyScope.MESSAGE:
+            cache = message_scope.values
+        else:
+            with self._lock:
+                if depends.scope is DependencyScope.PROCESS:
+                    cache = self._process_values
+                elif depends.scope is DependencyScope.THREAD:
+                    cache = self._get_thread_values()
+                else:
+                    cache = self._get_event_loop_values(asyncio.get_running_loop())
+
+        try:
+            return cache[depends.provider]
+        except KeyError:
+            pass
+
+        # the lock can't be held while awaiting, so if the value was created concurrently, the first one is used
+        # (and both are torn down)
+        value = await self._create_async(depends.provider, message_scope, cache)
+        return cache.setdefault(depends.provider, value)
+
+    async def close_event_loop_async(self):
+        """
+        tears down the values that must be torn down on the running event loop (the event loop scoped values,
+        and the values that were created by async generators on it). this is called by the owner of the event loop,
+        before it closes it
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._event_loop_values.pop(loop, None)
+            loop_teardowns = self._loop_teardowns.pop(loop, [])
+            for cache, provider, _ in loop_teardowns:
+                cache.pop(provider, None)  # so it's created again (on another event loop) if it's needed
+
+        await _run_teardowns_async([teardown for _, _, teardown in loop_teardowns])
+
+    def close(self):
+        """
+        tears down all the process, thread and event loop scoped dependency values.
+        the values that were created by async generators are torn down on the event loop they were created on
+        (waiting for it if it runs on another thread). the other teardowns run on the calling thread, including the
+        teardowns of thread scoped values
+        """
+        with self._lock:
+            loop_teardowns = list(self._loop_teardowns.items())
+            self._loop_teardowns.clear()
+            teardowns = list(self._teardowns)
+            self._teardowns.clear()
+            self._process_values.clear()
+            self._generation += 1
+            self._event_loop_values.clear()
+
+        for loop, teardowns_of_loop in loop_teardowns:
+            _run_teardowns_on_loop(loop, [teardown for _, _, teardown in teardowns_of_loop])
+        _run_teardowns(teardowns)
@@ -1,3 +1,6 @@
+from pydantic import ValidationError
+
+
 class FastMessageException(Exception):
     pass
 
@@ -24,3 +27,31 @@ class SpecialDefaultValueException(FastMessageException):
 
 class UnnamedCallableException(FastMessageException):
     pass
+
+
+class UnknownCompressionCodecException(FastMessageException):
+    pass
+
+
+class DecompressionException(FastMessageException):
+    pass
+
+
+class ClaimCheckException(FastMessageException):
+    pass
+
+
+class CallbackTimeoutException(FastMessageException):
+    pass
+
+
+class CoalescingNotAllowedException(FastMessageException):
+    pass
+
+
+class PoisonMessageError(ValidationError, FastMessageException):
+    """
+    raised for a known bad message (a copy of a message that already failed validation), without validating it again.
+    it has the same errors as the original ValidationError
+    """
+    pass
@@ -1,14 +1,31 @@
 import asyncio
+import threading
+import time
+import weakref
 from asyncio import AbstractEventLoop
 from typing import Optional, Callable, Dict, List, Union, Iterable
 
 from pydantic import ValidationError
 
+from fastmessage.async_service import AsyncPipelineService
 from fastmessage.callable_wrapper import CallableWrapper
-from fastmessage.common import _CALLABLE_TYPE, get_callable_name
-from fastmessage.exceptions import DuplicateCallbackException, MissingCallbackException
+from fastmessage.claim_check import ClaimCheck, BlobStore
+from fastmessage.common import _CALLABLE_TYPE, get_callable_name, _logger
+from fastmessage.compression import MessageCompressor, CompressionCodec
+from fastmessage.concurrency_limit import AdaptiveConcurrencyLimiter
+from fastmessage.dependencies import DependencyResolver
+from fastmessage.exceptions import DuplicateCallbackException, MissingCallbackException, PoisonMessageError
+from fastmessage.memory_budget import MemoryBudget
+from fastmessage.poison_cache import PoisonMessageCache
+from fastmessage.profiling import CallbackProfiler
+from fastmessage.retry import RetryPolicy
+from fastmessage.scheduling import PriorityInputDevice, PriorityPipelineService, DeviceWaitStats
+from fastmessage.staged_pipeline import StagedPipelineService
+from fastmessage.topology import Topology, build_topology
+from fastmessage.tracing import Tracer, SpanExporter
+from fastmessage.traffic_capture import TrafficRecorder
 from messageflux import InputDevice
-from messageflux.iodevices.base import InputDeviceManager, OutputDeviceManager
+from messageflux.iodevices.base import InputDeviceManager, OutputDeviceManager, AggregatedInputDevice
 from messageflux.iodevices.base.common import MessageBundle
 from messageflux.pipeline_service import PipelineHandlerBase, PipelineResult, PipelineService
 
@@ -20,6 +37,39 @@ class _DefaultClass(str):
 _DEFAULT = _DefaultClass()
 
 
+def _is_event_loop_running() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _close_event_loops(event_loops: List[AbstractEventLoop]) -> List[AbstractEventLoop]:
+    # this may be called by the garbage collector while some event loop is running on this thread.
+    # returns the event loops that are still running (on other threads), and can't be closed yet
+    can_run_event_loop = not _is_event_loop_running()
+    running_event_loops = []
+    for event_loop in event_loops:
+        if event_loop.is_closed():
+            continue
+        if event_loop.is_running():
+            running_event_loops.append(event_loop)
+            continue
+
+        try:
+            if can_run_event_loop:
+                event_loop.run_until_complete(event_loop.shutdown_asyncgens())
+        except Exception:
+            _logger.exception('Error shutting down event loop')
+        try:
+            event_loop.close()
+        except Exception:
+            _logger.exception('Error closing event loop')
+
+    return running_event_loops
+
+
 class FastMessage(PipelineHandlerBase):
     def __init__(self,
                  default_output_device: Optional[str] = None,
@@ -37,17 +87,108 @@ class FastMessage(PipelineHandlerBase):
         self._validation_error_handler = validation_error_handler
         self._wrappers: Dict[str, CallableWrapper] = {}
         self._callable_to_input_device: Dict[Callable, str] = {}
-        self._event_loop_cache: Optional[AbstractEventLoop] = None
+        self._thread_local = threading.local()
+        self._event_loops: List[AbstractEventLoop] = []
+        self._event_loops_lock = threading.Lock()
+        weakref.finalize(self, _close_event_loops, self._event_loops)  # in case shutdown is never called
+        self._message_compressor = MessageCompressor()
+        self._claim_check = ClaimCheck()
+        self._dependency_resolver = DependencyResolver(self)
+        self._traffic_recorder: Optional[TrafficRecorder] = None
+        self._tracer = Tracer()
+        self._memory_budget: Optional[MemoryBudget] = None
+        self._poison_message_cache: Optional[PoisonMessageCache] = None
+        self._ready = threading.Event()
+        self._warm_up_lock = threading.Lock()
+        self._services_lock = threading.Lock()
+        self._prepared_services = 0
 
     @property
     def event_loop(self) -> AbstractEventLoop:
         """
-        the event loop used for running async functions (lazy initialized)
+        the event loop used for running async functions on the current thread (lazy initialized).
+        each worker thread has its own event loop, so async callbacks can run on several threads concurrently
         """
-        if self._event_loop_cache is None:
-            self._event_loop_cache = asyncio.new_event_loop()
+        event_loop: Optional[AbstractEventLoop] = getattr(self._thread_local, 'event_loop', None)
+        if event_loop is None or event_loop.is_closed():
+            event_loop = asyncio.new_event_loop()
+            self._thread_local.event_loop = event_loop
+            with self._event_loops_lock:
+                self._event_loops.append(event_loop)
 
-        return self._event_loop_cache
+        return event_loop
+
+    @property
+    def memory_budget(self) -> Optional[MemoryBudget]:
+        """
+        the budget for the bytes that are held by the messages that are being handled (if there is one)
+        """
+        return self._memory_budget
+
+    @property
+    def poison_message_cache(self) -> Optional[PoisonMessageCache]:
+        """
+        the cache of the messages that failed validation (if there is one)
+        """
+        return self._poison_message_cache
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        True if all the registered callbacks were warmed up (by 'warm_up', or when a service started)
+        """
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        waits until all the registered callbacks are warmed up
+
+        :param timeout: the maximum time (in seconds) to wait (None waits forever)
+        :return: True if they are warmed up, False if the timeout has passed
+        """
+        return self._ready.wait(timeout)
+
+    def warm_up(self, samples: Optional[Dict[str, Iterable[bytes]]] = None, synthetic: bool = False):
+        """
+        initializes everything that is otherwise initialized lazily when the first messages are handled
+        (the output encoders, the process scoped dependencies, the decoders and the event loop of this thread),
+        so the first messages are not slower than the rest. the callbacks themselves are not called.
+        this is called by the services when they start (if it wasn't called before), so they read messages only
+        after it's done
+
+        :param samples: optional sample message bodies (uncompressed json) by input device name, to decode and validate
+        :param synthetic: if True, a synthetic message body that is built from the schema of each callback's model
+        is decoded and validated too
+        """
+        with self._warm_up_lock:
+            start_time = time.perf_counter()
+            samples = samples or {}
+            for input_device, callback_wrapper in list(self._wrappers.items()):
+                device_samples = list(samples.get(input_device, ()))
+                valid_samples = callback_wrapper.warm_up(samples=device_samples, synthetic=synthetic)
+                if valid_samples < len(device_samples):
+                    _logger.warning(f"{len(device_samples) - valid_samples} of the warm up samples for input device "
+                                    f"'{input_device}' are not valid")
+
+            self._warm_up_thread()
+            self._ready.set()
+            _logger.info(f'warm up finished in {time.perf_counter() - start_time:.3f} seconds')
+
+    def _warm_up_thread(self):
+        if any(callback_wrapper.is_async for callback_wrapper in self._wrappers.values()):
+            _ = self.event_loop  # sync services run the async callbacks on the event loop of their thread
+
+    def prepare(self):
+        """
+        called by the services when they start (before they read any message). warms up the callbacks, unless
+        they were already warmed up
+        """
+        with self._services_lock:
+            self._prepared_services += 1
+        if self.is_ready:
+            self._warm_up_thread()
+        else:
+            self.warm_up()
 
     @property
     def input_devices(self) -> List[str]:
@@ -56,6 +197,18 @@ class FastMessage(PipelineHandlerBase):
         """
         return list(self._wrappers.keys())
 
+    def get_callback_wrapper(self, input_device: str) -> CallableWrapper:
+        """
+        returns the wrapper of the callback that is registered on an input device
+
+        :param input_device: the input device name
+        :return: the CallableWrapper for that input device (raises MissingCallbackException if there isn't one)
+        """
+        callback_wrapper = self._wrappers.get(input_device)
+        if callback_wrapper is None:
+            raise MissingCallbackException(f"No callback registered for device '{input_device}'")
+        return callback_wrapper
+
     def register_validation_error_handler(self,
                                           handler: Callable[
                                               [InputDevice, MessageBundle, ValidationError],
@@ -67,10 +220,192 @@ class FastMessage(PipelineHandlerBase):
         """
         self._validation_error_handler = handler
 
+    def register_compression_codec(self, name: str, codec: CompressionCodec):
+        """
+        registers a compression codec, for decompressing input messages and compressing outputs.
+        'zlib', 'gzip' and 'lzma' codecs are registered by default
+
+        :param name: the name of the codec (this is the value of the 'content-encoding' header)
+        :param codec: the codec to register
+        """
+        self._message_compressor.register_codec(name=name, codec=codec)
+
+    def set_output_compression(self, output_device: str, codec_name: str = 'gzip', threshold: int = 1024):
+        """
+        makes the outputs that are sent to some output device compressed (if they are large enough).
+        input messages are always decompressed according to their 'content-encoding' header
+
+        :param output_device: the output device to compress the outputs for
+        :param codec_name: the name of the (registered) codec to use
+        :param threshold: the minimum size (in bytes) of an output to be compressed
+        """
+        self._message_compressor.set_output_compression(output_device=output_device,
+                                                        codec_name=codec_name,
+                                                        threshold=threshold)
+
+    def set_max_decompressed_size(self, max_size: int):
+        """
+        sets the maximum size of a decompressed input message. larger messages raise DecompressionException
+        (the default is 100MB)
+
+        :param max_size: the maximum size (in bytes) of a decompressed input message
+        """
+        self._message_compressor.max_decompressed_size = max_size
+
+    def set_claim_check_store(self, blob_store: Optional[BlobStore], threshold: int = 1024 * 1024):
+        """
+        sets a blob store for claim check: outputs larger than the threshold are written to the blob store,
+        and only a reference to them is sent. input messages with such reference are read from the blob store
+
+        :param blob_store: the blob store to use (None disables the claim check on output)
+        :param threshold: the minimum size (in bytes) of an output to be written to the blob store
+        """
+        self._claim_check.set_blob_store(blob_store=blob_store, threshold=threshold)
+
+    def set_traffic_recorder(self, traffic_recorder: Optional[TrafficRecorder]):
+        """
+        sets a traffic recorder, that records all the handled messages (for replaying them later with 'replay_traffic')
+
+        :param traffic_recorder: the recorder to use (None stops the recording)
+        """
+        self._traffic_recorder = traffic_recorder
+
+    def set_span_exporter(self, span_exporter: Optional[SpanExporter]):
+        """
+        enables tracing: each handled message gets a span (with its queue wait and processing time) that is exported
+        to the span exporter, and the trace context is propagated in the headers of the outputs to the next hops
+
+        :param span_exporter: the exporter for the spans (None disables the tracing)
+        """
+        self._tracer.exporter = span_exporter
+
+    def set_memory_budget(self, memory_budget: Optional[MemoryBudget]):
+        """
+        sets a budget for the bytes that are held by the messages that are being handled (their bodies, validated models
+        and pending outputs). the services stop reading new messages while the budget is exceeded.
+        the same budget can be shared by several FastMessage objects (and services) in the same process.
+        notice that it applies to the services that are created after it's set
+
+        :param memory_budget: the budget to use (None removes the budget)
+        """
+        self._memory_budget = memory_budget
+
+    def set_poison_message_cache(self, poison_message_cache: Optional[PoisonMessageCache]):
+        """
+        sets a cache of the messages that failed validation, so redelivered copies of them are rejected without being
+        parsed and validated again (with PoisonMessageError, that has the same errors as the original ValidationError)
+
+        :param poison_message_cache: the cache to use (None removes the cache)
+        """
+        self._poison_message_cache = poison_message_cache
+
+    def enable_profiling(self, input_devices: Optional[Union[List[str], str]] = None, sample_rate: int = 100):
+        """
+        starts profiling the callbacks of some input devices (one in every 'sample_rate' calls is profiled).
+        the stats of each callback are aggregated in memory, and can be read using 'get_profiler'
+
+        :param input_devices: the input devices to profile the callbacks of (defaults to all the registered mappings)
+        :param sample_rate: profile one in every 'sample_rate' calls
+        """
+        if input_devices is None:
+            input_devices = self.input_devices
+        elif isinstance(input_devices, str):
+            input_devices = [input_devices]
+
+        for input_device in input_devices:
+            self.get_callback_wrapper(input_device).profiler = CallbackProfiler(sample_rate=sample_rate)
+
+    def disable_profiling(self, input_devices: Optional[Union[List[str], str]] = None):
+        """
+        stops profiling the callbacks of some input devices (and discards their stats)
+
+        :param input_devices: the input devices to stop profiling (defaults to all the registered mappings)
+        """
+        if input_devices is None:
+            input_devices = self.input_devices
+        elif isinstance(input_devices, str):
+            input_devices = [input_devices]
+
+        for input_device in input_devices:
+            self.get_callback_wrapper(input_device).profiler = None
+
+    def get_profiler(self, input_device: str) -> Optional[CallbackProfiler]:
+        """
+        returns the profiler of the callback that is registered on an input device
+
+        :param input_device: the input device name
+        :return: the profiler of the callback (None if it's not profiled)
+        """
+        return self.get_callback_wrapper(input_device).profiler
+
+    def get_topology(self) -> Topology:
+        """
+        returns the routing graph of the callbacks, that combines the registered output devices with the routes that
+        were observed at runtime (with their fan-out ratios), and the measured cost of each callback.
+        the topology can be used for computing the expected load on each queue (see 'Topology.capacity_report')
+        """
+        static_routes = {input_device: {wrapper.output_device_name} if wrapper.output_device_name is not None else set()
+                         for input_device, wrapper in self._wrappers.items()}
+        route_counters = {input_device: wrapper.route_counter for input_device, wrapper in self._wrappers.items()}
+        costs = {input_device: wrapper.load_shedder.average_latency for input_device, wrapper in self._wrappers.items()
+                 if wrapper.load_shedder.average_latency is not None}
+        return build_topology(static_routes=static_routes, route_counters=route_counters, costs=costs)
+
+    def get_wait_stats(self, input_devices: Optional[Union[List[str], str]] = None) -> Dict[str, DeviceWaitStats]:
+        """
+        returns the time that the messages of some input devices waited in the queue before they were handled
+        (recorded by all the services, for the messages that have the 'fastmessage-sent-at' header)
+
+        :param input_devices: the input devices to return the stats of (defaults to all the registered mappings)
+        :return: the wait time stats of each input device
+        """
+        if input_devices is None:
+            input_devices = self.input_devices
+        elif isinstance(input_devices, str):
+            input_devices = [input_devices]
+
+        return {input_device: self.get_callback_wrapper(input_device).wait_recorder.get_stats()
+                for input_device in input_devices}
+
+    def _uses_priority_scheduling(self, input_device_names: List[str]) -> bool:
+        wrappers = [self._wrappers[name] for name in input_device_names if name in self._wrappers]
+        return any(wrapper.priority != 0 or wrapper.weight != 1 for wrapper in wrappers)
+
+    def _get_aggregate_device(self,
+                              input_device_manager: InputDeviceManager,
+                              input_device_names: List[str]) -> AggregatedInputDevice:
+        if not self._uses_priority_scheduling(input_device_names):
+            return input_device_manager.get_aggregate_device(input_device_names)
+
+        priorities: Dict[str, int] = {}
+        weights: Dict[str, int] = {}
+        for name in input_device_names:
+            callback_wrapper = self._wrappers.get(name)
+            if callback_wrapper is not None:
+                priorities[name] = callback_wrapper.priority
+                weights[name] = callback_wrapper.weight
+
+        return PriorityInputDevice(manager=input_device_manager,
+                                   inner_devices=[input_device_manager.get_input_device(name)
+                                                  for name in input_device_names],
+                                   priorities=priorities,
+                                   weights=weights)
+
     def register_callback(self,
                           callback: _CALLABLE_TYPE,
                           input_device: str = _DEFAULT,
-                          output_device: Optional[str] = _DEFAULT):
+                          output_device: Optional[str] = _DEFAULT,
+                          selective_decoding: bool = False,
+                          ttl: Optional[float] = None,
+                          latency_slo: Optional[float] = None,
+                          expired_output_device: Optional[str] = None,
+                          timeout: Optional[float] = None,
+                          dead_letter_device: Optional[str] = None,
+                          retry_policy: Optional[RetryPolicy] = None,
+                          concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                          priority: int = 0,
+                          weight: int = 1,
+                          coalesce: bool = False):
         """
         registers a callback to a device
 
@@ -79,6 +414,28 @@ class FastMessage(PipelineHandlerBase):
         :param output_device:  optional output device to route the return value of the callback to.
         None means no output routing.
         if callback returns None, no routing will be made even if 'output_device' is not None
+        :param selective_decoding: if True, only the top level keys that the callback needs are decoded from the
+        message body, and the values of all the other keys are skipped (useful for wide messages)
+        :param ttl: optional time (in seconds) since a message was sent (by its 'fastmessage-sent-at' header),
+        after which it is expired, and dropped without being handled.
+        messages are also expired after the deadline in their 'fastmessage-expires-at' header (if they have one)
+        :param latency_slo: optional callback latency SLO (in seconds). while the average callback latency exceeds it,
+        messages are dropped randomly, in proportion to the excess latency
+        :param expired_output_device: optional output device to send the dropped messages to (instead of dropping them)
+        :param timeout: optional timeout (in seconds) for async callbacks (and async generators). overdue callbacks
+        are cancelled, and CallbackTimeoutException is raised (unless 'dead_letter_device' is given)
+        :param dead_letter_device: optional output device to send the messages that their callback timed out to
+        :param retry_policy: optional policy for retrying the callback in process, when it raises an exception.
+        (generator callbacks are not retried)
+        :param concurrency_limiter: optional limiter of the number of messages that the callback handles at the same
+        time (when messages are handled concurrently), that adapts the limit to the observed callback latency
+        :param priority: the priority of the input device. the service reads from a device only when all the devices
+        with higher priority are empty
+        :param weight: the weight of the input device, among the devices with the same priority.
+        while they all have messages, a device with weight 3 is read 3 times as often as a device with weight 1
+        :param coalesce: if True, concurrent calls with the same (validated) arguments share a single run of the
+        callback, and each of their messages gets its return value (nothing is kept after the run is done).
+        generator callbacks, and callbacks with per message params (like Message or MessageBundle) can't be coalesced
         """
         if input_device is _DEFAULT:
             input_device = get_callable_name(callback)
@@ -90,14 +447,37 @@ class FastMessage(PipelineHandlerBase):
             output_device = self._default_output_device
 
         self._callable_to_input_device[callback] = input_device
+        self._ready.clear()  # the new callback is not warmed up
         self._wrappers[input_device] = CallableWrapper(fastmessage_handler=self,
                                                        wrapped_callable=callback,
                                                        input_device_name=input_device,
-                                                       output_device_name=output_device)
+                                                       output_device_name=output_device,
+                                                       selective_decoding=selective_decoding,
+                                                       ttl=ttl,
+                                                       latency_slo=latency_slo,
+                                                       expired_output_device=expired_output_device,
+                                                       timeout=timeout,
+                                                       dead_letter_device=dead_letter_device,
+                                                       retry_policy=retry_policy,
+                                                       concurrency_limiter=concurrency_limiter,
+                                                       priority=priority,
+                                                       weight=weight,
+                                                       coalesce=coalesce)
 
     def map(self,
             input_device: str = _DEFAULT,
-            output_device: Optional[str] = _DEFAULT) -> Callable[[_CALLABLE_TYPE], _CALLABLE_TYPE]:
+            output_device: Optional[str] = _DEFAULT,
+            selective_decoding: bool = False,
+            ttl: Optional[float] = None,
+            latency_slo: Optional[float] = None,
+            expired_output_device: Optional[str] = None,
+            timeout: Optional[float] = None,
+            dead_letter_device: Optional[str] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+            priority: int = 0,
+            weight: int = 1,
+            coalesce: bool = False) -> Callable[[_CALLABLE_TYPE], _CALLABLE_TYPE]:
         """
         this is the decorator method
 
@@ -105,12 +485,45 @@ class FastMessage(PipelineHandlerBase):
         :param output_device: optional output device to route the return value of the callback to.
         if callback returns None, no routing will be made even if 'output_device' is not None
         None means no output routing
+        :param selective_decoding: if True, only the top level keys that the callback needs are decoded from the
+        message body, and the values of all the other keys are skipped (useful for wide messages)
+        :param ttl: optional time (in seconds) since a message was sent (by its 'fastmessage-sent-at' header),
+        after which it is expired, and dropped without being handled.
+        messages are also expired after the deadline in their 'fastmessage-expires-at' header (if they have one)
+        :param latency_slo: optional callback latency SLO (in seconds). while the average callback latency exceeds it,
+        messages are dropped randomly, in proportion to the excess latency
+        :param expired_output_device: optional output device to send the dropped messages to (instead of dropping them)
+        :param timeout: optional timeout (in seconds) for async callbacks (and async generators). overdue callbacks
+        are cancelled, and CallbackTimeoutException is raised (unless 'dead_letter_device' is given)
+        :param dead_letter_device: optional output device to send the messages that their callback timed out to
+        :param retry_policy: optional policy for retrying the callback in process, when it raises an exception.
+        (generator callbacks are not retried)
+        :param concurrency_limiter: optional limiter of the number of messages that the callback handles at the same
+        time (when messages are handled concurrently), that adapts the limit to the observed callback latency
+        :param priority: the priority of the input device. the service reads from a device only when all the devices
+        with higher priority are empty
+        :param weight: the weight of the input device, among the devices with the same priority.
+        while they all have messages, a device with weight 3 is read 3 times as often as a device with weight 1
+        :param coalesce: if True, concurrent calls with the same (validated) arguments share a single run of the
+        callback, and each of their messages gets its return value (nothing is kept after the run is done).
+        generator callbacks, and callbacks with per message params (like Message or MessageBundle) can't be coalesced
         """
 
         def _register_callback_decorator(callback: _CALLABLE_TYPE) -> _CALLABLE_TYPE:
             self.register_callback(callback=callback,
                                    input_device=input_device,
-                                   output_device=output_device)
+                                   output_device=output_device,
+                                   selective_decoding=selective_decoding,
+                                   ttl=ttl,
+                                   latency_slo=latency_slo,
+                                   expired_output_device=expired_output_device,
+                                   timeout=timeout,
+                                   dead_letter_device=dead_letter_device,
+                                   retry_policy=retry_policy,
+                                   concurrency_limiter=concurrency_limiter,
+                                   priority=priority,
+                                   weight=weight,
+                                   coalesce=coalesce)
             return callback
 
         return _register_callback_decorator
@@ -118,34 +531,65 @@ class FastMessage(PipelineHandlerBase):
     def handle_message(self,
                        input_device: InputDevice,
                        message_bundle: MessageBundle) -> Optional[Union[PipelineResult, Iterable[PipelineResult]]]:
-        callback_wrapper = self._wrappers.get(input_device.name)
-        if callback_wrapper is None:
-            raise MissingCallbackException(f"No callback registered for device '{input_device.name}'")
+        callback_wrapper = self.get_callback_wrapper(input_device.name)
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record(input_device.name, message_bundle)
         try:
             return callback_wrapper(input_device=input_device, message_bundle=message_bundle)
         except ValidationError as ve:
-            if self._validation_error_handler is None:
-                raise
+            return self._handle_validation_error(input_device, message_bundle, ve)
+
+    def _handle_validation_error(self,
+                                 input_device: InputDevice,
+                                 message_bundle: MessageBundle,
+                                 validation_error: ValidationError) -> Optional[Union[PipelineResult,
+                                                                                      Iterable[PipelineResult]]]:
+        poison_message_cache = self._poison_message_cache
+        if isinstance(validation_error, PoisonMessageError) and poison_message_cache is not None \
+                and poison_message_cache.dead_letter_device is not None:
+            return PipelineResult(output_device_name=poison_message_cache.dead_letter_device,
+                                  message_bundle=message_bundle)
 
-            return self._validation_error_handler(input_device, message_bundle, ve)
+        if self._validation_error_handler is None:
+            raise validation_error
+
+        return self._validation_error_handler(input_device, message_bundle, validation_error)
 
     def create_service(self, *,
                        input_device_manager: InputDeviceManager,
                        input_device_names: Optional[Union[List[str], str]] = None,
                        output_device_manager: Optional[OutputDeviceManager] = None,
+                       staged: bool = False,
                        **kwargs) -> PipelineService:
         """
-        creates a PipelineService, with this FastMessage object as its handler
+        creates a service (PipelineService by default), with this FastMessage object as its handler.
+        if some callback has a priority or a weight, the service reads from the input devices by them,
+        and if there's a memory budget, the service stops reading while it's exceeded
 
         :param input_device_manager: the input device manager to read items from
         :param input_device_names: Optional. the list of input device names to read from
         (defaults to all the registered mappings)
         :param output_device_manager: Optional. the output device manager to use
-        :param **kwargs: passed to PipelineService __init__ as is
-        :return: the created PipelineService
+        :param staged: if True, creates a StagedPipelineService, that decodes the next messages and serializes the
+        results of the previous messages (on other threads), while the callback of the current message runs
+        :param **kwargs: passed to the service __init__ as is
+        :return: the created service
         """
-        if input_device_names is None:
-            input_device_names = self.input_devices
+        input_device_names = self._get_input_device_names(input_device_names)
+        self._warn_about_serial_coalescing(input_device_names)
+        if staged:
+            return StagedPipelineService(input_device_manager=input_device_manager,
+                                         input_device_names=input_device_names,
+                                         fastmessage_handler=self,
+                                         output_device_manager=output_device_manager,
+                                         **kwargs)
+
+        if self._memory_budget is not None or self._uses_priority_scheduling(input_device_names):
+            return PriorityPipelineService(input_device_manager=input_device_manager,
+                                           input_device_names=input_device_names,
+                                           fastmessage_handler=self,
+                                           output_device_manager=output_device_manager,
+                                           **kwargs)
 
         return PipelineService(input_device_manager=input_device_manager,
                                input_device_names=input_device_names,
@@ -153,7 +597,66 @@ class FastMessage(PipelineHandlerBase):
                                output_device_manager=output_device_manager,
                                **kwargs)
 
+    def create_async_service(self, *,
+                             input_device_manager: InputDeviceManager,
+                             input_device_names: Optional[Union[List[str], str]] = None,
+                             output_device_manager: Optional[OutputDeviceManager] = None,
+                             **kwargs) -> AsyncPipelineService:
+        """
+        creates an AsyncPipelineService, with this FastMessage object as its handler, that handles many messages
+        concurrently as coroutines on a single event loop (sync callbacks are offloaded to a thread pool)
+
+        :param input_device_manager: the input device manager to read items from
+        :param input_device_names: Optional. the list of input device names to read from
+        (defaults to all the registered mappings)
+        :param output_device_manager: Optional. the output device manager to use
+        :param **kwargs: passed to the service __init__ as is
+        :return: the created service
+        """
+        return AsyncPipelineService(input_device_manager=input_device_manager,
+                                    input_device_names=self._get_input_device_names(input_device_names),
+                                    fastmessage_handler=self,
+                                    output_device_manager=output_device_manager,
+                                    **kwargs)
+
+    def _warn_about_serial_coalescing(self, input_device_names: List[str]):
+        coalescing_devices = [name for name in input_device_names
+                              if name in self._wrappers and self._wrappers[name].single_flight is not None]
+        if coalescing_devices:
+            _logger.warning(f"the callbacks for input devices {coalescing_devices} are coalesced, but this service "
+                            f"handles one message at a time, so their calls are coalesced only with the calls of "
+                            f"other services that run on other threads (use 'create_async_service' instead)")
+
+    def _get_input_device_names(self, input_device_names: Optional[Union[List[str], str]]) -> List[str]:
+        if input_device_names is None:
+            return self.input_devices
+        if isinstance(input_device_names, str):
+            return [input_device_names]
+        return input_device_names
+
     def shutdown(self):
-        if self._event_loop_cache is not None:
-            self._event_loop_cache.close()
-            self._event_loop_cache = None
+        """
+        called by the services when they stop. tears down the dependencies and closes the event loops of the threads,
+        once the last service that was prepared stops (so the other services that share this object keep their state).
+        event loops that are still running on other threads are left open (and closed by the next shutdown)
+        """
+        with self._services_lock:
+            if self._prepared_services > 0:
+                self._prepared_services -= 1
+                if self._prepared_services > 0:
+                    return
+
+        self._ready.clear()  # the dependencies are torn down
+        try:
+            self._dependency_resolver.close()
+        finally:
+            with self._event_loops_lock:
+                event_loops = list(self._event_loops)
+                self._event_loops.clear()
+
+            running_event_loops = _close_event_loops(event_loops)
+            if running_event_loops:
+                _logger.warning(f'{len(running_event_loops)} event loops are still running on other threads, '
+                                f'so they were not closed')
+                with self._event_loops_lock:
+                    self._event_loops.extend(running_event_loops)
@@ -0,0 +1,121 @@
+import random
+import time
+from typing import Optional, Any
+
+from messageflux.iodevices.base.common import MessageHeaders
+
+EXPIRES_AT_HEADER = 'fastmessage-expires-at'
+"""a header with an absolute deadline (epoch seconds) after which the message should not be handled"""
+
+SENT_AT_HEADER = 'fastmessage-sent-at'
+"""a header with the time (epoch seconds) that the message was sent at"""
+
+
+def _get_float_header(headers: MessageHeaders, header_name: str) -> Optional[float]:
+    value: Any = headers.get(header_name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LoadShedder:
+    """
+    decides which messages for a callback should be shed (dropped before they are parsed and handled).
+    a message is shed if it has expired (by the expiry header, or by the ttl since it was sent),
+    or (in adaptive mode) randomly, in proportion to how much the observed callback latency exceeds the SLO
+    """
+
+    def __init__(self,
+                 ttl: Optional[float] = None,
+                 latency_slo: Optional[float] = None,
+                 latency_smoothing: float = 0.1):
+        """
+
+        :param ttl: optional time (in seconds) since the message was sent (by the 'fastmessage-sent-at' header),
+        after which it is considered expired
+        :param latency_slo: optional callback latency SLO (in seconds). if given, messages are shed randomly
+        while the average callback latency exceeds it (adaptive mode)
+        :param latency_smoothing: the weight of each new latency sample in the (exponential) average latency
+        """
+        self._ttl = ttl
+        self._latency_slo = latency_slo
+        self._latency_smoothing = latency_smoothing
+        self._average_latency: Optional[float] = None
+        self._expired_count = 0
+        self._shed_by_latency_count = 0
+
+    @property
+    def average_latency(self) -> Optional[float]:
+        """
+        the (exponential) average of the observed callback latency, in seconds
+        """
+        return self._average_latency
+
+    @property
+    def expired_count(self) -> int:
+        """
+        the number of messages that were shed because they expired
+        """
+        return self._expired_count
+
+    @property
+    def shed_by_latency_count(self) -> int:
+        """
+        the number of messages that were shed because the callback latency exceeded the SLO
+        """
+        return self._shed_by_latency_count
+
+    def is_expired(self, headers: MessageHeaders, now: Optional[float] = None) -> bool:
+        """
+        checks if a message has expired
+
+        :param headers: the headers of the message
+        :param now: the current time (epoch seconds). defaults to time.time()
+        :return: True if the message has expired
+        """
+        if now is None:
+            now = time.time()
+
+        expires_at = _get_float_header(headers, EXPIRES_AT_HEADER)
+        if expires_at is not None and now > expires_at:
+            return True
+
+        if self._ttl is not None:
+            sent_at = _get_float_header(headers, SENT_AT_HEADER)
+            if sent_at is not None and now - sent_at > self._ttl:
+                return True
+
+        return False
+
+    def should_shed(self, headers: MessageHeaders) -> bool:
+        """
+        checks if a message should be shed (and counts it)
+
+        :param headers: the headers of the message
+        :return: True if the message should be shed
+        """
+        if self.is_expired(headers):
+            self._expired_count += 1
+            return True
+
+        average_latency = self._average_latency
+        if self._latency_slo is not None and average_latency is not None and average_latency > self._latency_slo:
+            if random.random() > self._latency_slo / average_latency:
+                self._shed_by_latency_count += 1
+                return True
+
+        return False
+
+    def record_latency(self, latency: float):
+        """
+        records the latency of a single callback run
+
+        :param latency: the latency (in seconds)
+        """
+        if self._average_latency is None:
+            self._average_latency = latency
+        else:
+            self._average_latency += self._latency_smoothing * (latency - self._average_latency)
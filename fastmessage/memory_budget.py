@@ -0,0 +1,319 @@
+import asyncio
+import io
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from messageflux import InputDevice, ReadResult
+from messageflux.iodevices.base import AggregatedInputDevice
+from messageflux.iodevices.base.common import Message, MessageBundle
+from messageflux.pipeline_service import PipelineResult
+
+
+@dataclass
+class MemoryBudgetStats:
+    """
+    a snapshot of the bytes that are held by the messages that are being handled
+    """
+    max_bytes: int
+    in_flight_bytes: int
+    input_bytes: int
+    model_bytes: int
+    output_bytes: int
+    peak_bytes: int
+    in_flight_messages: int
+    pause_count: int
+    paused_time: float
+
+
+def _get_message_size(message: Message) -> int:
+    # measures the stream without copying it (unlike 'Message.bytes')
+    stream = message.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer().nbytes - stream.tell()
+    current_pos = stream.tell()
+    size = stream.seek(0, io.SEEK_END) - current_pos
+    stream.seek(current_pos)
+    return size
+
+
+class ByteReservation:
+    """
+    the bytes that are held for a single message (its body, its validated model and its pending outputs).
+    they are all released together, when the message is done
+    """
+
+    def __init__(self, memory_budget: 'MemoryBudget', message_bundle: MessageBundle):
+        self._memory_budget = memory_budget
+        self._message_bundle = message_bundle
+        self.input_bytes = 0
+        self.model_bytes = 0
+        self.output_bytes = 0
+        self.released = False
+
+    @property
+    def total_bytes(self) -> int:
+        """
+        the total bytes that are held for the message
+        """
+        return self.input_bytes + self.model_bytes + self.output_bytes
+
+    def release(self):
+        """
+        releases all the bytes of the message
+        """
+        self._memory_budget._release(self)
+
+
+class MemoryBudget:
+    """
+    a budget for the bytes that are held by the messages that are being handled (their bodies, their validated models
+    and their pending outputs). the services stop reading new messages while the budget is exceeded,
+    and resume once enough messages are done.
+
+    a single message is always admitted when nothing else is in flight, even if it's larger than the budget.
+    the size of the validated model is estimated from the size of the body (by 'model_size_ratio'),
+    since measuring the actual objects would cost more than validating them
+    """
+
+    _POLL_INTERVAL: float = 0.1
+
+    def __init__(self, max_bytes: int, model_size_ratio: float = 1.0):
+        """
+
+        :param max_bytes: the maximum number of bytes to hold, before pausing the reading
+        :param model_size_ratio: the estimated size of the validated model of a message, relative to its body size
+        """
+        self._max_bytes = max(1, max_bytes)
+        self._model_size_ratio = max(0.0, model_size_ratio)
+        self._condition = threading.Condition()
+        self._reservations: Dict[int, ByteReservation] = {}
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._input_bytes = 0
+        self._model_bytes = 0
+        self._output_bytes = 0
+        self._peak_bytes = 0
+        self._pause_count = 0
+        self._paused_time = 0.0
+
+    @property
+    def max_bytes(self) -> int:
+        """
+        the maximum number of bytes to hold, before pausing the reading
+        """
+        return self._max_bytes
+
+    @property
+    def in_flight_bytes(self) -> int:
+        """
+        the number of bytes that are currently held
+        """
+        return self._input_bytes + self._model_bytes + self._output_bytes
+
+    def has_capacity(self) -> bool:
+        """
+        returns True if new messages can be read
+        """
+        return self.in_flight_bytes < self._max_bytes
+
+    def get_stats(self) -> MemoryBudgetStats:
+        """
+        returns a snapshot of the held bytes (by kind), and of the pauses in reading
+        """
+        with self._condition:
+            return MemoryBudgetStats(max_bytes=self._max_bytes,
+                                     in_flight_bytes=self.in_flight_bytes,
+                                     input_bytes=self._input_bytes,
+                                     model_bytes=self._model_bytes,
+                                     output_bytes=self._output_bytes,
+                                     peak_bytes=self._peak_bytes,
+                                     in_flight_messages=len(self._reservations),
+                                     pause_count=self._pause_count,
+                                     paused_time=self._paused_time)
+
+    def wait_for_capacity(self,
+                          cancellation_token: Optional[threading.Event] = None,
+                          timeout: Optional[float] = None) -> bool:
+        """
+        blocks until new messages can be read
+
+        :param cancellation_token: optional token that stops the waiting when it's set
+        :param timeout: optional maximum time (in seconds) to wait
+        :return: True if new messages can be read, False if the wait timed out (or was cancelled)
+        """
+        with self._condition:
+            if self.has_capacity():
+                return True
+            if timeout is not None and timeout <= 0:
+                return False
+
+            start_time = time.perf_counter()
+            end_time = None if timeout is None else start_time + timeout
+            self._pause_count += 1
+            try:
+                while not self.has_capacity():
+                    wait_time = self._POLL_INTERVAL
+                    if end_time is not None:
+                        wait_time = min(wait_time, end_time - time.perf_counter())
+                    if wait_time <= 0 or (cancellation_token is not None and cancellation_token.is_set()):
+                        return False
+                    self._condition.wait(wait_time)
+                return True
+            finally:
+                self._paused_time += time.perf_counter() - start_time
+
+    async def wait_for_capacity_async(self):
+        """
+        waits (asynchronously) until new messages can be read
+        """
+        with self._condition:
+            if self.has_capacity():
+                return
+            self._pause_count += 1
+
+        start_time = time.perf_counter()
+        event_loop = asyncio.get_running_loop()
+        try:
+            while True:
+                with self._condition:
+                    if self.has_capacity():
+                        return
+                    waiter = (event_loop, event_loop.create_future())
+                    self._async_waiters.append(waiter)
+                try:
+                    await waiter[1]
+                finally:
+                    with self._condition:
+                        if waiter in self._async_waiters:
+                            self._async_waiters.remove(waiter)
+        finally:
+            with self._condition:
+                self._paused_time += time.perf_counter() - start_time
+
+    def reserve(self, message_bundle: MessageBundle) -> ByteReservation:
+        """
+        accounts for a message that was read (its body, and the estimated size of its validated model)
+
+        :param message_bundle: the message that was read
+        :return: the reservation of the message (that has to be released when the message is done)
+        """
+        input_bytes = _get_message_size(message_bundle.message)
+        reservation = ByteReservation(self, message_bundle)
+        with self._condition:
+            self._reservations[id(message_bundle)] = reservation
+        self._add(reservation, input_bytes=input_bytes, model_bytes=int(input_bytes * self._model_size_ratio))
+        return reservation
+
+    def get_reservation(self, message_bundle: MessageBundle) -> Optional[ByteReservation]:
+        """
+        returns the reservation of a message that is being handled (if it was reserved)
+
+        :param message_bundle: the message
+        """
+        return self._reservations.get(id(message_bundle))
+
+    def add_outputs(self, message_bundle: MessageBundle, results: Iterable[PipelineResult]):
+        """
+        accounts for the outputs of a message, that are pending to be sent (until the message is done)
+
+        :param message_bundle: the message that the outputs are for
+        :param results: the pending outputs
+        """
+        reservation = self.get_reservation(message_bundle)
+        if reservation is not None:
+            self._add(reservation, output_bytes=sum(_get_message_size(result.message_bundle.message)
+                                                    for result in results))
+
+    def _add(self, reservation: ByteReservation, input_bytes: int = 0, model_bytes: int = 0, output_bytes: int = 0):
+        with self._condition:
+            if reservation.released:
+                return
+            reservation.input_bytes += input_bytes
+            reservation.model_bytes += model_bytes
+            reservation.output_bytes += output_bytes
+            self._input_bytes += input_bytes
+            self._model_bytes += model_bytes
+            self._output_bytes += output_bytes
+            self._peak_bytes = max(self._peak_bytes, self.in_flight_bytes)
+
+    def _release(self, reservation: ByteReservation):
+        with self._condition:
+            if reservation.released:
+                return
+            reservation.released = True
+            self._reservations.pop(id(reservation._message_bundle), None)
+            self._input_bytes -= reservation.input_bytes
+            self._model_bytes -= reservation.model_bytes
+            self._output_bytes -= reservation.output_bytes
+            if self.has_capacity():
+                self._condition.notify_all()
+                for event_loop, future in self._async_waiters:
+                    event_loop.call_soon_threadsafe(self._wake_up, future)
+
+    @staticmethod
+    def _wake_up(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+
+class BudgetedInputDevice(AggregatedInputDevice):
+    """
+    an aggregated input device that stops reading while the memory budget is exceeded,
+    and reserves the bytes of each message that it reads
+    """
+
+    def __init__(self, aggregate_device: AggregatedInputDevice, memory_budget: MemoryBudget):
+        """
+
+        :param aggregate_device: the aggregated input device to read from
+        :param memory_budget: the memory budget
+        """
+        super().__init__(manager=aggregate_device.manager, inner_devices=[])
+        self._aggregate_device = aggregate_device
+        self._memory_budget = memory_budget
+        self._reservations: List[ByteReservation] = []
+
+    @property
+    def last_read_device(self) -> Optional[InputDevice]:
+        return self._aggregate_device.last_read_device
+
+    def _read_message(self,
+                      cancellation_token: threading.Event,
+                      timeout: Optional[float] = None,
+                      with_transaction: bool = True) -> Optional[ReadResult]:
+        memory_budget = self._memory_budget
+        if not memory_budget.has_capacity() and self._holds_all_in_flight_bytes():
+            # only the messages of this device hold the budget, and they are released after the current batch,
+            # so waiting for capacity would never succeed (the batch ends here instead)
+            return None
+
+        start_time = time.perf_counter()
+        if not memory_budget.wait_for_capacity(cancellation_token, timeout):
+            return None
+
+        if timeout is not None:
+            timeout = max(0.0, timeout - (time.perf_counter() - start_time))
+        read_result = self._aggregate_device.read_message(cancellation_token=cancellation_token,
+                                                          timeout=timeout,
+                                                          with_transaction=with_transaction)
+        if read_result is not None:
+            self._reservations.append(memory_budget.reserve(read_result))
+        return read_result
+
+    def _holds_all_in_flight_bytes(self) -> bool:
+        held_bytes = sum(reservation.total_bytes for reservation in self._reservations if not reservation.released)
+        return held_bytes >= self._memory_budget.in_flight_bytes
+
+    def release_reservations(self):
+        """
+        releases the bytes of all the messages that this device has read
+        """
+        reservations = self._reservations
+        self._reservations = []
+        for reservation in reservations:
+            reservation.release()
+
+    def close(self):
+        self.release_reservations()
+        self._aggregate_device.close()
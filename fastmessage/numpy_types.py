@@ -0,0 +1,174 @@
+import base64
+import binascii
+from typing import Any, Callable, Dict, Iterator, Optional, Type
+
+from fastmessage.output_encoding import encode_output, register_output_encoder
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:  # pragma: no cover
+    NUMPY_AVAILABLE = False
+
+_JSON_SCHEMA_TYPES = {'b': 'boolean', 'i': 'integer', 'u': 'integer', 'f': 'number'}
+
+
+class NDArray:
+    """
+    a param type for numeric arrays, that validates the whole array at once into a contiguous numpy array
+    (instead of validating each item into a python list, like List[float] does).
+
+    the value can be a json array (nested for more than one dimension), or a base64 string of the raw
+    (little-endian) array data, which is decoded without building a python object for each item.
+    use NDArray[dtype] for a specific dtype (float64 by default), or 'conarray' to check the values and the shape.
+
+    this type requires 'numpy' (install fastmessage[numpy]).
+    """
+    dtype: Any = 'float64'
+    ge: Optional[float] = None
+    le: Optional[float] = None
+    ndim: Optional[int] = None
+    max_items: Optional[int] = None
+
+    def __class_getitem__(cls, dtype: Any) -> Type['NDArray']:
+        return conarray(dtype)
+
+    @classmethod
+    def __get_validators__(cls) -> Iterator[Callable[..., Any]]:
+        if not NUMPY_AVAILABLE:
+            raise ImportError("NDArray requires 'numpy' to be installed")
+        yield cls.validate
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: Dict[str, Any]):
+        items: Dict[str, Any] = {'type': _JSON_SCHEMA_TYPES[np.dtype(cls.dtype).kind]}
+        if cls.ge is not None:
+            items['minimum'] = cls.ge
+        if cls.le is not None:
+            items['maximum'] = cls.le
+
+        array_schema = items
+        for _ in range(cls.ndim or 1):
+            array_schema = {'type': 'array', 'items': array_schema}
+        if cls.max_items is not None and (cls.ndim or 1) == 1:
+            array_schema['maxItems'] = cls.max_items
+
+        field_schema.update(anyOf=[array_schema, {'type': 'string', 'format': 'base64'}])
+
+    @classmethod
+    def validate(cls, value: Any) -> 'np.ndarray':
+        """
+        validates a value into a numpy array of this type
+
+        :param value: a json array, a base64 string (or bytes) of the raw array data, or a numpy array
+        :return: the contiguous numpy array
+        raises TypeError or ValueError if the value is not a valid array of this type
+        """
+        dtype = np.dtype(cls.dtype)
+        if isinstance(value, (str, bytes)):
+            array = _decode_binary(value, dtype)
+        else:
+            array = _convert_array(value, dtype)
+
+        if cls.ndim is not None and array.ndim != cls.ndim:
+            raise ValueError(f'array has {array.ndim} dimensions, but {cls.ndim} are required')
+        if cls.max_items is not None and array.size > cls.max_items:
+            raise ValueError(f'array has {array.size} items, but at most {cls.max_items} are allowed')
+        if (cls.ge is not None or cls.le is not None) and dtype.kind == 'f' and not np.isfinite(array).all():
+            # nan is never less than 'ge' or greater than 'le', so it would pass the range checks below
+            raise ValueError('ensure all values are finite')
+        if cls.ge is not None and (array < cls.ge).any():
+            raise ValueError(f'ensure all values are greater than or equal to {cls.ge}')
+        if cls.le is not None and (array > cls.le).any():
+            raise ValueError(f'ensure all values are less than or equal to {cls.le}')
+
+        return array
+
+
+def _decode_binary(value: Any, dtype: 'np.dtype') -> 'np.ndarray':
+    try:
+        data = base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ValueError('array data is not valid base64')
+    if len(data) % dtype.itemsize:
+        raise ValueError(f"array data size ({len(data)} bytes) is not a multiple of the '{dtype}' item size")
+
+    # the bytearray makes the array writable (numpy arrays over bytes are read only)
+    return np.frombuffer(bytearray(data), dtype=dtype.newbyteorder('<')).astype(dtype, copy=False)
+
+
+def _convert_array(value: Any, dtype: 'np.dtype') -> 'np.ndarray':
+    array = np.asarray(value)
+    if array.dtype == dtype:
+        return np.ascontiguousarray(array)
+    if array.size == 0:
+        return np.ascontiguousarray(array, dtype=dtype)
+    if not np.can_cast(array.dtype, dtype, casting='same_kind'):
+        raise TypeError(f"array of '{array.dtype}' values can't be converted to '{dtype}'")
+    if dtype.kind in 'iu' and not np.can_cast(array.dtype, dtype):
+        info = np.iinfo(dtype)
+        if array.min() < info.min or array.max() > info.max:
+            raise ValueError(f"array values are out of the range of '{dtype}'")
+
+    return np.ascontiguousarray(array, dtype=dtype)
+
+
+def conarray(dtype: Any = 'float64',
+             *,
+             ge: Optional[float] = None,
+             le: Optional[float] = None,
+             ndim: Optional[int] = None,
+             max_items: Optional[int] = None) -> Type[NDArray]:
+    """
+    returns an NDArray param type with constraints
+
+    :param dtype: the dtype of the array (bool, integer or float)
+    :param ge: the minimum allowed value
+    :param le: the maximum allowed value
+    :param ndim: the required number of dimensions (the binary form is always one dimensional)
+    :param max_items: the maximum number of items in the array
+    :return: the param type
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("NDArray requires 'numpy' to be installed")
+
+    numpy_dtype = np.dtype(dtype)
+    if numpy_dtype.kind not in _JSON_SCHEMA_TYPES:
+        raise TypeError(f"NDArray supports only bool, integer and float dtypes (not '{numpy_dtype}')")
+
+    namespace = dict(dtype=numpy_dtype, ge=ge, le=le, ndim=ndim, max_items=max_items)
+    return type(f'NDArray[{numpy_dtype}]', (NDArray,), namespace)
+
+
+def _encode_ndarray(value: 'np.ndarray') -> bytes:
+    return encode_output(value.tolist())
+
+
+def encode_ndarray_base64(value: 'np.ndarray') -> bytes:
+    """
+    an output encoder that serializes a numpy array into a json string of the base64 of its raw (little-endian) data,
+    which is the binary form that NDArray params accept. this is much faster than a json array for large arrays,
+    but the receiver has to know the dtype (and the shape, since the data is flattened).
+    arrays that aren't bool, integer or float are serialized to a json array as usual.
+
+    to use it for all the returned arrays: register_output_encoder(np.ndarray, encode_ndarray_base64)
+
+    :param value: the numpy array
+    :return: the serialized bytes
+    """
+    if value.dtype.kind not in _JSON_SCHEMA_TYPES:
+        return _encode_ndarray(value)
+    data = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<')).tobytes()
+    return b'"' + base64.b64encode(data) + b'"'
+
+
+def _encode_numpy_scalar(value: 'np.generic') -> bytes:
+    return encode_output(value.item())
+
+
+if NUMPY_AVAILABLE:
+    register_output_encoder(np.ndarray, _encode_ndarray)
+    for _scalar_type in (np.bool_, np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64,
+                         np.float16, np.float32, np.float64):
+        register_output_encoder(_scalar_type, _encode_numpy_scalar)
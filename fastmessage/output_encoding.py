@@ -0,0 +1,137 @@
+import dataclasses
+import datetime
+import json
+from typing import Any, Callable, Dict, Optional, Type
+
+from pydantic import BaseModel, Extra
+from pydantic.fields import ModelField, SHAPE_LIST, SHAPE_SINGLETON
+from pydantic.utils import lenient_issubclass
+
+OutputEncoder = Callable[[Any], bytes]
+
+_default_json_encoder = json.JSONEncoder(default=BaseModel.__json_encoder__)
+_output_encoders: Dict[type, OutputEncoder] = {}
+_model_converters: Dict[Type[BaseModel], Optional[Callable[[BaseModel], Dict[str, Any]]]] = {}
+
+
+def _encode_generic(value: Any) -> bytes:
+    return _default_json_encoder.encode(value).encode()
+
+
+def _encode_dataclass(value: Any) -> bytes:
+    return _default_json_encoder.encode(dataclasses.asdict(value)).encode()
+
+
+def _convert_model(value: Any) -> Any:
+    if not isinstance(value, BaseModel):
+        return value  # left for the json encoder's default hook
+    converter = _get_model_converter(type(value))
+    if converter is None:
+        return value.dict()
+    return converter(value)
+
+
+def _convert_datetime(value: Any) -> Any:
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()  # same as pydantic's json encoder
+    return value
+
+
+def _create_field_converter(field: ModelField) -> Optional[Callable[[Any], Any]]:
+    if field.shape == SHAPE_SINGLETON:
+        if lenient_issubclass(field.type_, BaseModel):
+            return _convert_model
+        if lenient_issubclass(field.type_, (datetime.date, datetime.time)):
+            return _convert_datetime
+    elif field.shape == SHAPE_LIST and lenient_issubclass(field.type_, BaseModel):
+        return lambda values: [_convert_model(v) for v in values] if isinstance(values, list) else values
+
+    return None  # values of this field are either native json, or left for the json encoder's default hook
+
+
+def _create_model_converter(model_type: Type[BaseModel]) -> Optional[Callable[[BaseModel], Dict[str, Any]]]:
+    config = model_type.__config__
+    if config.json_encoders or config.extra == Extra.allow \
+            or model_type.__exclude_fields__ or model_type.__include_fields__:
+        return None  # the field values can't be converted without model.dict()
+
+    field_converters = [(name, _create_field_converter(field)) for name, field in model_type.__fields__.items()]
+
+    def _convert(value: BaseModel) -> Dict[str, Any]:
+        values = value.__dict__
+        try:
+            return {name: values[name] if converter is None else converter(values[name])
+                    for name, converter in field_converters}
+        except KeyError:  # the model was constructed without some of its fields
+            return value.dict()
+
+    return _convert
+
+
+def _get_model_converter(model_type: Type[BaseModel]) -> Optional[Callable[[BaseModel], Dict[str, Any]]]:
+    try:
+        return _model_converters[model_type]
+    except KeyError:
+        converter = _model_converters[model_type] = _create_model_converter(model_type)
+        return converter
+
+
+def _create_model_encoder(model_type: Type[BaseModel]) -> OutputEncoder:
+    json_encoder = json.JSONEncoder(default=model_type.__json_encoder__)
+    converter = _get_model_converter(model_type)
+    if converter is None:
+        def _encode_model(value: BaseModel) -> bytes:
+            return json_encoder.encode(value.dict()).encode()
+
+        return _encode_model
+
+    def _encode_converted_model(value: BaseModel) -> bytes:
+        if type(value) is not model_type:
+            return json_encoder.encode(value.dict()).encode()
+        return json_encoder.encode(converter(value)).encode()
+
+    return _encode_converted_model
+
+
+def _create_output_encoder(value_type: type) -> OutputEncoder:
+    if issubclass(value_type, BaseModel):
+        return _create_model_encoder(value_type)
+    if dataclasses.is_dataclass(value_type):
+        return _encode_dataclass
+
+    return _encode_generic  # primitives, dicts, lists and (named) tuples are handled natively by the json encoder
+
+
+def register_output_encoder(value_type: type, encoder: OutputEncoder):
+    """
+    registers a custom encoder for output values of some type (replacing the cached encoder for that type)
+
+    :param value_type: the type of the output values to use this encoder for (exact type, not subclasses)
+    :param encoder: a callable that receives the output value and returns its serialized bytes
+    """
+    _output_encoders[value_type] = encoder
+
+
+def get_output_encoder(value_type: type) -> OutputEncoder:
+    """
+    returns the encoder for output values of some type (creates and caches it on first use)
+
+    :param value_type: the type of the output value
+    :return: a callable that receives the output value and returns its serialized bytes
+    """
+    encoder = _output_encoders.get(value_type)
+    if encoder is None:
+        encoder = _create_output_encoder(value_type)
+        _output_encoders[value_type] = encoder
+
+    return encoder
+
+
+def encode_output(value: Any) -> bytes:
+    """
+    serializes an output value to bytes, using the cached encoder for its type
+
+    :param value: the value to serialize
+    :return: the serialized bytes
+    """
+    return get_output_encoder(type(value))(value)
@@ -0,0 +1,144 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from pydantic import ValidationError
+
+from fastmessage.claim_check import CLAIM_CHECK_HEADER
+from fastmessage.compression import CONTENT_ENCODING_HEADER
+from messageflux.iodevices.base.common import Message
+
+_PoisonKey = Tuple[str, str, str, bytes]
+
+
+@dataclass
+class PoisonCacheStats:
+    """
+    the counters of a poison message cache
+    """
+    size: int
+    hits: int
+    misses: int
+    inserts: int
+    evictions: int
+    expirations: int
+
+
+def _get_body_digest(message: Message) -> bytes:
+    stream = message.stream
+    if isinstance(stream, io.BytesIO):
+        with stream.getbuffer() as buffer:  # hashes the body without copying it
+            return hashlib.blake2b(buffer[stream.tell():], digest_size=16).digest()
+    return hashlib.blake2b(message.bytes, digest_size=16).digest()
+
+
+class PoisonMessageCache:
+    """
+    a bounded cache of the messages that failed validation (by their input device and the hash of their body),
+    so redelivered copies of the same bad message are rejected without being parsed and validated again.
+    the entries expire after 'ttl' seconds, and the least recently hit entries are evicted when the cache is full
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 600, dead_letter_device: Optional[str] = None):
+        """
+
+        :param max_size: the maximum number of bad messages to remember
+        :param ttl: the time (in seconds) to remember each bad message (None remembers them until they are evicted)
+        :param dead_letter_device: optional output device to send the known bad messages to. if not given, they
+        are passed to the validation error handler (or raise their ValidationError), like the first copy was
+        """
+        self._max_size = max(1, max_size)
+        self._ttl = ttl
+        self._dead_letter_device = dead_letter_device
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[_PoisonKey, Tuple[float, ValidationError]]' = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._inserts = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def dead_letter_device(self) -> Optional[str]:
+        """
+        the output device to send the known bad messages to (if there is one)
+        """
+        return self._dead_letter_device
+
+    @staticmethod
+    def get_key(input_device_name: str, message: Message) -> _PoisonKey:
+        """
+        returns the cache key of a message
+
+        :param input_device_name: the input device the message was read from
+        :param message: the message
+        :return: the key of the message in the cache
+        """
+        content_encoding = str(message.headers.get(CONTENT_ENCODING_HEADER, ''))
+        # the body of a claim checked message is empty, so its blob reference tells the messages apart
+        claim_check_reference = str(message.headers.get(CLAIM_CHECK_HEADER, ''))
+        return input_device_name, content_encoding, claim_check_reference, _get_body_digest(message)
+
+    def get(self, key: _PoisonKey) -> Optional[ValidationError]:
+        """
+        returns the validation error of a known bad message
+
+        :param key: the key of the message (from 'get_key')
+        :return: the validation error that the message failed with (or None if it's not a known bad message)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            expires_at, validation_error = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return validation_error
+
+    def add(self, key: _PoisonKey, validation_error: ValidationError):
+        """
+        remembers a bad message
+
+        :param key: the key of the message (from 'get_key')
+        :param validation_error: the validation error that the message failed with
+        """
+        expires_at = float('inf') if self._ttl is None else time.monotonic() + self._ttl
+        with self._lock:
+            if key not in self._entries:
+                self._inserts += 1
+            self._entries[key] = (expires_at, validation_error)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_stats(self) -> PoisonCacheStats:
+        """
+        returns the counters of the cache
+        """
+        with self._lock:
+            return PoisonCacheStats(size=len(self._entries),
+                                    hits=self._hits,
+                                    misses=self._misses,
+                                    inserts=self._inserts,
+                                    evictions=self._evictions,
+                                    expirations=self._expirations)
+
+    def clear(self):
+        """
+        forgets all the bad messages
+        """
+        with self._lock:
+            self._entries.clear()
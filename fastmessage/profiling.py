@@ -0,0 +1,171 @@
+import cProfile
+import itertools
+import pstats
+import threading
+from typing import Any, Awaitable, Callable, Coroutine, Generator, Optional
+
+
+class CallbackProfiler:
+    """
+    profiles one in every N calls of a callback (with cProfile), and aggregates the stats of the sampled calls
+    in memory. async callbacks are profiled while the event loop runs them,
+    and generator callbacks are profiled while they are iterated
+    """
+
+    def __init__(self, sample_rate: int = 100):
+        """
+
+        :param sample_rate: profile one in every 'sample_rate' calls
+        """
+        self._sample_rate = max(1, sample_rate)
+        self._call_counter = itertools.count()
+        self._lock = threading.Lock()
+        self._stats: Optional[pstats.Stats] = None
+        self._sampled_calls = 0
+
+    @property
+    def sample_rate(self) -> int:
+        """
+        one in every 'sample_rate' calls is profiled
+        """
+        return self._sample_rate
+
+    @property
+    def sampled_calls(self) -> int:
+        """
+        the number of calls that were profiled so far
+        """
+        return self._sampled_calls
+
+    def should_sample(self) -> bool:
+        """
+        returns True if the current call should be profiled
+        """
+        return next(self._call_counter) % self._sample_rate == 0
+
+    def profile_call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        calls a function under the profiler (if it returns a generator, the generator is profiled while it's iterated)
+
+        :param func: the function to call
+        :return: the return value of the function
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is already active on this thread
+            return func(*args, **kwargs)
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            profile.disable()
+            self._add_profile(profile)
+            raise
+
+        profile.disable()
+        if isinstance(result, Generator):
+            return self._profile_iteration(result, profile)
+
+        self._add_profile(profile)
+        return result
+
+    async def profile_coroutine(self, coroutine: Awaitable[Any]) -> Any:
+        """
+        awaits a coroutine, and profiles it only while it runs (and not while the event loop runs other tasks)
+
+        :param coroutine: the coroutine to await
+        :return: the return value of the coroutine
+        """
+        profile = cProfile.Profile()
+        try:
+            return await _ProfiledAwaitable(coroutine, profile)
+        finally:
+            self._add_profile(profile)
+
+    def _profile_iteration(self, generator: Generator, profile: cProfile.Profile):
+        try:
+            while True:
+                profile.enable()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    profile.disable()
+                yield item
+        finally:
+            self._add_profile(profile)
+
+    def _add_profile(self, profile: cProfile.Profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._sampled_calls += 1
+
+    def get_stats(self) -> Optional[pstats.Stats]:
+        """
+        returns a copy of the aggregated stats of the profiled calls (or None if no call was profiled yet)
+        """
+        with self._lock:
+            if self._stats is None:
+                return None
+            stats = pstats.Stats()
+            stats.add(self._stats)
+            return stats
+
+    def dump_stats(self, path: str):
+        """
+        writes the aggregated stats to a file (that can be loaded with pstats, snakeviz etc.)
+
+        :param path: the path of the file to write
+        """
+        stats = self.get_stats()
+        if stats is None:
+            stats = pstats.Stats()
+        stats.dump_stats(path)
+
+    def reset(self):
+        """
+        clears the aggregated stats
+        """
+        with self._lock:
+            self._stats = None
+            self._sampled_calls = 0
+
+
+class _ProfiledAwaitable:
+    """
+    drives a coroutine step by step (like 'await' does), and enables the profiler only during its steps
+    """
+
+    def __init__(self, coroutine: Awaitable[Any], profile: cProfile.Profile):
+        self._coroutine: Coroutine = coroutine.__await__()  # type: ignore
+        self._profile = profile
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        send_value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            try:
+                self._profile.enable()
+                enabled = True
+            except ValueError:  # another profiler is already active on this thread
+                enabled = False
+            try:
+                if error is None:
+                    yielded = self._coroutine.send(send_value)
+                else:
+                    yielded = self._coroutine.throw(error)
+            except StopIteration as ex:
+                return ex.value
+            finally:
+                if enabled:
+                    self._profile.disable()
+
+            try:
+                send_value, error = (yield yielded), None
+            except BaseException as ex:  # e.g. cancellation, that is thrown into the coroutine
+                send_value, error = None, ex
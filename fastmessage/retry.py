@@ -0,0 +1,87 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Tuple, Type, Callable, Dict, Any, Awaitable
+
+from fastmessage.common import _logger
+
+
+@dataclass
+class RetryPolicy:
+    """
+    a policy for retrying a callback (in process) when it raises a transient exception.
+    the callback is called again with the same (already validated) arguments
+    """
+    exceptions: Tuple[Type[BaseException], ...] = (Exception,)
+    """the exception types to retry on"""
+
+    max_attempts: int = 3
+    """the maximum number of attempts (including the first one)"""
+
+    initial_delay: float = 0.1
+    """the delay (in seconds) before the first retry"""
+
+    max_delay: float = 10
+    """the maximum delay (in seconds) between retries"""
+
+    backoff_factor: float = 2
+    """the factor to multiply the delay by, after each retry"""
+
+    jitter: float = 0.1
+    """the maximum random part of each delay, as a fraction of the delay"""
+
+    def get_delay(self, retry_number: int) -> float:
+        """
+        returns the delay before a retry
+
+        :param retry_number: the number of the retry (starting from 1)
+        :return: the delay in seconds
+        """
+        delay = min(self.max_delay, self.initial_delay * (self.backoff_factor ** (retry_number - 1)))
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _should_retry(self, exception: BaseException, attempt: int) -> bool:
+        return attempt < self.max_attempts and isinstance(exception, self.exceptions)
+
+    def run(self, func: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+        """
+        calls the function, retrying according to this policy
+
+        :param func: the function to call
+        :param kwargs: the arguments to call the function with
+        :return: the return value of the function
+        """
+        attempt = 1
+        while True:
+            try:
+                return func(**kwargs)
+            except BaseException as ex:
+                if not self._should_retry(ex, attempt):
+                    raise
+                delay = self.get_delay(attempt)
+                _logger.warning(f"attempt {attempt} of {func} failed ({ex!r}). retrying in {delay:.3f} seconds")
+                time.sleep(delay)
+                attempt += 1
+
+    async def run_async(self, func: Callable[..., Awaitable[Any]], kwargs: Dict[str, Any]) -> Any:
+        """
+        awaits the async function, retrying according to this policy (sleeping asynchronously between retries)
+
+        :param func: the async function to call
+        :param kwargs: the arguments to call the function with
+        :return: the return value of the function
+        """
+        attempt = 1
+        while True:
+            try:
+                return await func(**kwargs)
+            except asyncio.CancelledError:
+                raise  # a cancellation (e.g. by the callback timeout) is never retried (it's an Exception on py3.7)
+            except BaseException as ex:
+                if not self._should_retry(ex, attempt):
+                    raise
+                delay = self.get_delay(attempt)
+                _logger.warning(f"attempt {attempt} of {func} failed ({ex!r}). retrying in {delay:.3f} seconds")
+                await asyncio.sleep(delay)
+                attempt += 1
@@ -0,0 +1,256 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from fastmessage.common import _logger
+from fastmessage.load_shedding import SENT_AT_HEADER, _get_float_header
+from fastmessage.memory_budget import BudgetedInputDevice
+from messageflux import InputDevice, ReadResult
+from messageflux.iodevices.base import AggregatedInputDevice, InputDeviceManager
+from messageflux.iodevices.base.common import MessageBundle
+from messageflux.pipeline_service import PipelineResult, PipelineService
+
+if TYPE_CHECKING:
+    from fastmessage.fastmessage_handler import FastMessage
+
+
+@dataclass
+class DeviceWaitStats:
+    """
+    the time that the messages of an input device waited in the queue before they were read
+    (measured by their 'fastmessage-sent-at' header)
+    """
+    device_name: str
+    read_count: int
+    measured_count: int
+    average_wait: Optional[float]
+    max_wait: Optional[float]
+    p50_wait: Optional[float]
+    p99_wait: Optional[float]
+
+
+class WaitTimeRecorder:
+    """
+    records the queue wait time of the messages that are handled for an input device
+    """
+
+    def __init__(self, device_name: str, window_size: int = 1000):
+        """
+
+        :param device_name: the input device name
+        :param window_size: the number of recent wait times to compute the percentiles from
+        """
+        self._device_name = device_name
+        self._lock = threading.Lock()
+        self._recent_waits: Deque[float] = deque(maxlen=window_size)
+        self._read_count = 0
+        self._measured_count = 0
+        self._total_wait = 0.0
+        self._max_wait: Optional[float] = None
+
+    def record(self, message_bundle: MessageBundle, now: Optional[float] = None):
+        """
+        records a message that was read from the input device
+
+        :param message_bundle: the message that was read
+        :param now: the time (epoch seconds) the message was read at. defaults to time.time()
+        """
+        sent_at = _get_float_header(message_bundle.message.headers, SENT_AT_HEADER)
+        with self._lock:
+            self._read_count += 1
+            if sent_at is None:
+                return
+            if now is None:
+                now = time.time()
+            wait = max(0.0, now - sent_at)
+            self._measured_count += 1
+            self._total_wait += wait
+            self._recent_waits.append(wait)
+            if self._max_wait is None or wait > self._max_wait:
+                self._max_wait = wait
+
+    def get_stats(self) -> DeviceWaitStats:
+        """
+        returns the wait time stats of the input device
+        """
+        with self._lock:
+            recent_waits = sorted(self._recent_waits)
+            measured_count = self._measured_count
+            return DeviceWaitStats(device_name=self._device_name,
+                                   read_count=self._read_count,
+                                   measured_count=measured_count,
+                                   average_wait=self._total_wait / measured_count if measured_count else None,
+                                   max_wait=self._max_wait,
+                                   p50_wait=self._percentile(recent_waits, 50),
+                                   p99_wait=self._percentile(recent_waits, 99))
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+        if not sorted_values:
+            return None
+        index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+        return sorted_values[index]
+
+    def reset(self):
+        """
+        clears the stats
+        """
+        with self._lock:
+            self._recent_waits.clear()
+            self._read_count = 0
+            self._measured_count = 0
+            self._total_wait = 0.0
+            self._max_wait = None
+
+
+class _ScheduledDevice:
+    __slots__ = ('device', 'weight', 'current_weight')
+
+    def __init__(self, device: InputDevice, weight: int):
+        self.device = device
+        self.weight = weight
+        self.current_weight = 0
+
+
+class PriorityInputDevice(AggregatedInputDevice):
+    """
+    an aggregated input device that reads from its inner devices by priority and weight:
+    a device is read only if all the devices with higher priority are empty (strict priority lanes),
+    and the devices with the same priority are read by smooth weighted round robin
+    (a device with weight 3 is read 3 times as often as a device with weight 1, while both have messages)
+    """
+
+    def __init__(self,
+                 manager: InputDeviceManager,
+                 inner_devices: List[InputDevice],
+                 priorities: Optional[Dict[str, int]] = None,
+                 weights: Optional[Dict[str, int]] = None):
+        """
+
+        :param manager: the input device manager that created this device
+        :param inner_devices: the list of input devices to read from
+        :param priorities: the priority of each input device (by name). higher priority devices are read first.
+        the default priority is 0
+        :param weights: the weight of each input device (by name), among the devices with the same priority.
+        the default weight is 1
+        """
+        super().__init__(manager=manager, inner_devices=inner_devices)
+        priorities = priorities or {}
+        weights = weights or {}
+        lanes: Dict[int, List[_ScheduledDevice]] = {}
+        for inner_device in inner_devices:
+            scheduled_device = _ScheduledDevice(device=inner_device,
+                                                weight=max(1, weights.get(inner_device.name, 1)))
+            lanes.setdefault(priorities.get(inner_device.name, 0), []).append(scheduled_device)
+        self._lanes = [lanes[priority] for priority in sorted(lanes, reverse=True)]
+
+    def _read_message(self,
+                      cancellation_token: threading.Event,
+                      timeout: Optional[float] = None,
+                      with_transaction: bool = True) -> Optional[ReadResult]:
+        end_time = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            for lane in self._lanes:
+                read_result = self._read_from_lane(lane, cancellation_token, with_transaction)
+                if read_result is not None:
+                    return read_result
+
+            if end_time is None:
+                wait_time = self._SLEEP_BETWEEN_ITERATIONS
+            else:
+                wait_time = min(self._SLEEP_BETWEEN_ITERATIONS, end_time - time.perf_counter())
+                if wait_time <= 0:
+                    self._last_read_device = None
+                    return None
+
+            # all the devices were empty, so wait before performing another iteration
+            if cancellation_token.wait(wait_time):
+                self._last_read_device = None
+                return None
+
+    def _read_from_lane(self,
+                        lane: List[_ScheduledDevice],
+                        cancellation_token: threading.Event,
+                        with_transaction: bool) -> Optional[ReadResult]:
+        candidates = list(lane)
+        while candidates:
+            # smooth weighted round robin, among the devices that weren't found empty in this round
+            chosen = max(candidates, key=lambda candidate: candidate.current_weight + candidate.weight)
+            self._last_read_device = chosen.device
+            read_result = chosen.device.read_message(cancellation_token=cancellation_token,
+                                                     timeout=0,
+                                                     with_transaction=with_transaction)
+            if read_result is not None:
+                total_weight = 0
+                for candidate in candidates:
+                    candidate.current_weight += candidate.weight
+                    total_weight += candidate.weight
+                chosen.current_weight -= total_weight
+                return read_result
+
+            candidates.remove(chosen)
+
+        return None
+
+
+class PriorityPipelineService(PipelineService):
+    """
+    a PipelineService that reads from the input devices by the priority and weight of their callbacks
+    (see 'PriorityInputDevice'), so a backlog on a low priority device doesn't delay the messages of higher priority
+    devices. if the FastMessage object has a memory budget, the reading stops while the budget is exceeded
+    (so a batch holds at most about the budget), the outputs of each message are accounted for until it's done,
+    and the bytes of each batch are released once it's done
+    """
+
+    def __init__(self, *, fastmessage_handler: 'FastMessage', **kwargs):
+        """
+
+        :param fastmessage_handler: the FastMessage object to handle the messages with
+        :param **kwargs: passed to PipelineService __init__ as is
+        """
+        super().__init__(pipeline_handler=fastmessage_handler, **kwargs)
+        self._fastmessage_handler = fastmessage_handler
+
+    def _prepare_service(self):
+        super()._prepare_service()
+        aggregate_device = self._fastmessage_handler._get_aggregate_device(self._input_device_manager,
+                                                                           self._input_device_names)
+        memory_budget = self._fastmessage_handler.memory_budget
+        if memory_budget is not None:
+            aggregate_device = BudgetedInputDevice(aggregate_device, memory_budget)
+        self._aggregate_input_device = aggregate_device
+
+    def _server_loop(self, cancellation_token: threading.Event):
+        try:
+            super()._server_loop(cancellation_token)
+        finally:
+            if isinstance(self._aggregate_input_device, BudgetedInputDevice):
+                self._aggregate_input_device.release_reservations()
+
+    def _handle_message_batch(self, batch: List[Tuple[InputDevice, ReadResult]]):
+        memory_budget = self._fastmessage_handler.memory_budget
+        for input_device, read_result in batch:
+            results = self._pipeline_handler.handle_message(input_device, read_result)
+            if results is not None and memory_budget is not None:
+                results = [results] if isinstance(results, PipelineResult) else list(results)
+                memory_budget.add_outputs(read_result, results)
+            self._send_results(results)
+
+    def _send_results(self, results: Optional[Union[PipelineResult, Iterable[PipelineResult]]]):
+        if results is None:
+            return
+        if isinstance(results, PipelineResult):
+            results = [results]
+
+        for pipeline_result in results:
+            if self._output_device_manager is None:
+                _logger.warning("pipeline handler returned a result to output to device: "
+                                f"'{pipeline_result.output_device_name}', "
+                                f"but no output_device_manager was given")
+                continue
+
+            output_device = self._output_device_manager.get_output_device(pipeline_result.output_device_name)
+            output_device.send_message(message=pipeline_result.message_bundle.message,
+                                       device_headers=pipeline_result.message_bundle.device_headers)
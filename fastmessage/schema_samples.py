@@ -0,0 +1,73 @@
+from typing import Any, Dict
+
+_MAX_DEPTH = 10
+_STRING_FORMAT_SAMPLES = {
+    'date-time': '1970-01-01T00:00:00',
+    'date': '1970-01-01',
+    'time': '00:00:00',
+    'uuid': '00000000-0000-0000-0000-000000000000',
+    'email': 'user@example.com',
+    'uri': 'http://example.com',
+    'ipv4': '127.0.0.1',
+    'ipv6': '::1',
+}
+
+
+def build_schema_sample(schema: Dict[str, Any]) -> Any:
+    """
+    builds a synthetic value that matches a (pydantic) json schema, as far as it can be inferred from the schema.
+    the value is not guaranteed to be valid (e.g. patterns and custom validators are not taken into account)
+
+    :param schema: the json schema (e.g. from 'BaseModel.schema()')
+    :return: the synthetic value
+    """
+    return _build_value(schema, schema.get('definitions', {}), 0)
+
+
+def _build_value(schema: Dict[str, Any], definitions: Dict[str, Any], depth: int) -> Any:
+    if depth > _MAX_DEPTH:  # recursive models
+        return None
+
+    ref = schema.get('$ref')
+    if ref is not None:
+        return _build_value(definitions.get(ref.rsplit('/', 1)[-1], {}), definitions, depth + 1)
+    for key in ('allOf', 'anyOf', 'oneOf'):
+        if schema.get(key):
+            return _build_value(schema[key][0], definitions, depth + 1)
+    if 'const' in schema:
+        return schema['const']
+    if schema.get('enum'):
+        return schema['enum'][0]
+
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        return {name: property_schema['default'] if 'default' in property_schema
+                else _build_value(property_schema, definitions, depth + 1)
+                for name, property_schema in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        items = schema.get('items')
+        if isinstance(items, list):  # tuples
+            return [_build_value(item, definitions, depth + 1) for item in items]
+        if items is None or schema.get('maxItems') == 0:
+            return []
+        return [_build_value(items, definitions, depth + 1)] * max(1, schema.get('minItems', 1))
+    if schema_type == 'string':
+        return _STRING_FORMAT_SAMPLES.get(schema.get('format', ''), 'a' * schema.get('minLength', 0))
+    if schema_type in ('integer', 'number'):
+        return _build_number(schema, int if schema_type == 'integer' else float)
+    if schema_type == 'boolean':
+        return False
+
+    return None  # 'null' or any value
+
+
+def _build_number(schema: Dict[str, Any], number_type: type) -> Any:
+    if 'minimum' in schema:
+        return number_type(schema['minimum'])
+    if 'exclusiveMinimum' in schema:
+        return number_type(schema['exclusiveMinimum'] + 1)
+    if 'maximum' in schema and schema['maximum'] < 0:
+        return number_type(schema['maximum'])
+    if 'exclusiveMaximum' in schema and schema['exclusiveMaximum'] <= 0:
+        return number_type(schema['exclusiveMaximum'] - 1)
+    return number_type(0)
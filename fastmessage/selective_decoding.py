@@ -0,0 +1,73 @@
+import threading
+from typing import Any, Dict, Iterable, Union
+
+try:
+    import simdjson
+
+    SELECTIVE_DECODING_AVAILABLE = True
+except ImportError:  # pragma: no cover
+    SELECTIVE_DECODING_AVAILABLE = False
+
+_MISSING = object()
+
+
+class SelectiveJSONDecoder:
+    """
+    a json decoder that decodes only the requested top level keys of a json object,
+    and skips over the values of all the other keys, without building python objects for them.
+
+    this decoder requires 'pysimdjson' (install fastmessage[simdjson]).
+    notice that skipped values are only checked to be well-formed json, and are not built.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        """
+
+        :param keys: the top level keys to decode
+        """
+        if not SELECTIVE_DECODING_AVAILABLE:
+            raise ImportError("SelectiveJSONDecoder requires 'pysimdjson' to be installed")
+
+        self._keys = frozenset(keys)
+        self._local = threading.local()
+
+    @property
+    def keys(self) -> frozenset:
+        """
+        the top level keys that this decoder decodes
+        """
+        return self._keys
+
+    def _get_parser(self) -> 'simdjson.Parser':
+        # a parser can't be shared between threads, so each thread gets its own (reusing its internal buffers)
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = simdjson.Parser()
+            self._local.parser = parser
+        return parser
+
+    def decode(self, document: Union[str, bytes]) -> Dict[str, Any]:
+        """
+        decodes the requested keys from the json document
+
+        :param document: the json document (must be a json object)
+        :return: a dict with the requested keys that were found in the document
+        raises ValueError if the document is not a valid json object
+        """
+        parsed = self._get_parser().parse(document)
+        if not isinstance(parsed, simdjson.Object):
+            raise ValueError('json document is not an object')
+
+        result: Dict[str, Any] = {}
+        for key in self._keys:
+            value = parsed.get(key, _MISSING)
+            if value is _MISSING:
+                continue
+            if isinstance(value, simdjson.Object):
+                value = value.as_dict()
+            elif isinstance(value, simdjson.Array):
+                value = value.as_list()
+            result[key] = value
+
+        del parsed  # the parser can't be reused while objects from the previous document are alive
+        return result
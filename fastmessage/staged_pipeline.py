@@ -0,0 +1,212 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Generator, Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from pydantic import ValidationError
+
+from fastmessage.callable_wrapper import CallableWrapper
+from fastmessage.dependencies import MessageScope
+from fastmessage.scheduling import PriorityPipelineService
+from fastmessage.tracing import Span
+from messageflux import InputDevice
+from messageflux.iodevices.base import ReadResult
+from messageflux.pipeline_service import PipelineResult
+
+if TYPE_CHECKING:
+    from fastmessage.fastmessage_handler import FastMessage
+
+_StageResults = Optional[Union[PipelineResult, Iterable[PipelineResult]]]
+
+
+class StagedPipelineService(PriorityPipelineService):
+    """
+    a PipelineService that handles the messages of each batch in three overlapping stages:
+    while the callback for message N runs (on the service thread), message N+1 is decoded and validated,
+    and the results of message N-1 are serialized and sent (each on its own thread).
+
+    the stages are connected by bounded queues, so the decoding never gets too far ahead of the callbacks,
+    and the callbacks never get too far ahead of the sending.
+    notice that only messages of the same batch are pipelined, so 'max_batch_read_count' should be larger than 1.
+    results of generator callbacks are serialized on the service thread (since the generator runs the callback code)
+    """
+
+    def __init__(self, *,
+                 fastmessage_handler: 'FastMessage',
+                 stage_queue_size: int = 2,
+                 **kwargs):
+        """
+
+        :param fastmessage_handler: the FastMessage object to handle the messages with
+        :param stage_queue_size: the maximum number of messages that wait between two stages
+        :param **kwargs: passed to PriorityPipelineService __init__ as is
+        """
+        super().__init__(fastmessage_handler=fastmessage_handler, **kwargs)
+        self._stage_queue_size = max(1, stage_queue_size)
+        self._decode_executor: Optional[ThreadPoolExecutor] = None
+        self._output_executor: Optional[ThreadPoolExecutor] = None
+
+    def _prepare_service(self):
+        super()._prepare_service()
+        self._decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-decode')
+        self._output_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.name}-output')
+        # the messages are decoded on the decode thread, so its decoders are created there (and not on this thread)
+        self._decode_executor.submit(self._warm_up_decoders).result()
+
+    def _warm_up_decoders(self):
+        for input_device_name in self._input_device_names:
+            callback_wrapper = self._fastmessage_handler._wrappers.get(input_device_name)
+            if callback_wrapper is not None:
+                callback_wrapper.warm_up_decoder()
+
+    def _decode(self,
+                callback_wrapper: CallableWrapper,
+                input_device: InputDevice,
+                read_result: ReadResult,
+                span: Optional[Span]) -> Tuple[Optional[Dict[str, Any]], _StageResults]:
+        try:
+            kwargs = callback_wrapper.decode(input_device=input_device, message_bundle=read_result)
+        except Exception as ex:
+            callback_wrapper.finish_span(span, ex)
+            if not isinstance(ex, ValidationError):
+                raise
+            return None, self._fastmessage_handler._handle_validation_error(input_device, read_result, ex)
+
+        if kwargs is None:
+            callback_wrapper.finish_span(span)
+            return None, callback_wrapper.get_shed_result(read_result)
+
+        return kwargs, None
+
+    def _get_results(self,
+                     callback_wrapper: CallableWrapper,
+                     input_device: InputDevice,
+                     read_result: ReadResult,
+                     callback_return: Any,
+                     message_scope: Optional[MessageScope],
+                     span: Optional[Span]) -> _StageResults:
+        try:
+            results = callback_wrapper.get_results(callback_return=callback_return,
+                                                   message_scope=message_scope,
+                                                   span=span)
+            if results is None:
+                return None
+            results = list(results)
+            memory_budget = self._fastmessage_handler.memory_budget
+            if memory_budget is not None:
+                memory_budget.add_outputs(read_result, results)
+            return results
+        except ValidationError as ve:
+            return self._fastmessage_handler._handle_validation_error(input_device, read_result, ve)
+
+    def _execute(self,
+                 callback_wrapper: CallableWrapper,
+                 input_device: InputDevice,
+                 read_result: ReadResult,
+                 kwargs: Dict[str, Any],
+                 span: Optional[Span]) -> Tuple[Union[_StageResults, Future], Optional[MessageScope]]:
+        # returns the results (or the future of the results), and the message scope that should be closed
+        # (on the service thread) once they are serialized
+        assert self._output_executor is not None
+        try:
+            callback_return, message_scope = callback_wrapper.execute(kwargs=kwargs, message_bundle=read_result)
+        except Exception as ex:
+            callback_wrapper.finish_span(span, ex)
+            if not isinstance(ex, ValidationError):
+                raise
+            return self._fastmessage_handler._handle_validation_error(input_device, read_result, ex), None
+
+        if isinstance(callback_return, Generator):
+            return self._get_results(callback_wrapper,
+                                     input_device,
+                                     read_result,
+                                     callback_return,
+                                     message_scope,
+                                     span), None
+
+        # the message scope is not closed on the output thread, since the teardowns of async generator dependencies
+        # run on the event loop of the service thread (which may be running the next callback)
+        return self._output_executor.submit(self._get_results,
+                                            callback_wrapper,
+                                            input_device,
+                                            read_result,
+                                            callback_return,
+                                            None,
+                                            span), message_scope
+
+    def _send_results(self, stage_results: Union[_StageResults, Future]):
+        results: _StageResults = stage_results.result() if isinstance(stage_results, Future) else stage_results
+        super()._send_results(results)
+
+    def _handle_message_batch(self, batch: List[Tuple[InputDevice, ReadResult]]):
+        assert self._decode_executor is not None
+        assert self._output_executor is not None
+        pending_batch = iter(batch)
+        decoding: Deque[Tuple[CallableWrapper, InputDevice, ReadResult, Optional[Span], Future]] = deque()
+        sending: Deque[Tuple[Future, Optional[MessageScope]]] = deque()
+
+        def _wait_for_sending():
+            send_future, message_scope = sending.popleft()
+            try:
+                send_future.result()
+            finally:
+                if message_scope is not None:
+                    message_scope.close()
+
+        def _decode_next():
+            assert self._decode_executor is not None
+            next_message = next(pending_batch, None)
+            if next_message is not None:
+                input_device, read_result = next_message
+                callback_wrapper = self._fastmessage_handler.get_callback_wrapper(input_device.name)
+                traffic_recorder = self._fastmessage_handler._traffic_recorder
+                if traffic_recorder is not None:
+                    traffic_recorder.record(input_device.name, read_result)
+                span = callback_wrapper.start_span(read_result)
+                decode_future = self._decode_executor.submit(self._decode,
+                                                             callback_wrapper,
+                                                             input_device,
+                                                             read_result,
+                                                             span)
+                decoding.append((callback_wrapper, input_device, read_result, span, decode_future))
+
+        try:
+            for _ in range(self._stage_queue_size):
+                _decode_next()
+
+            while decoding:
+                callback_wrapper, input_device, read_result, span, decode_future = decoding.popleft()
+                _decode_next()
+                kwargs, results = decode_future.result()
+                message_scope: Optional[MessageScope] = None
+                if kwargs is not None:
+                    results, message_scope = self._execute(callback_wrapper, input_device, read_result, kwargs, span)
+
+                try:
+                    while len(sending) >= self._stage_queue_size:
+                        _wait_for_sending()
+                except BaseException:
+                    if message_scope is not None:
+                        message_scope.close()
+                    raise
+                sending.append((self._output_executor.submit(self._send_results, results), message_scope))
+
+            while sending:
+                _wait_for_sending()
+        finally:
+            # on error, don't leave the stages running in the background while the batch is rolled back
+            for *_, decode_future in decoding:
+                decode_future.cancel()
+            wait([decode_future for *_, decode_future in decoding] + [send_future for send_future, _ in sending])
+            for _, message_scope in sending:
+                if message_scope is not None:
+                    message_scope.close()
+
+    def _finalize_service(self, exception: Optional[Exception] = None):
+        try:
+            for executor in (self._decode_executor, self._output_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self._decode_executor = None
+            self._output_executor = None
+        finally:
+            super()._finalize_service(exception=exception)
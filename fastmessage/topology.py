@@ -0,0 +1,220 @@
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+
+class RouteCounter:
+    """
+    counts the messages that a callback handled, and the outputs that it sent to each output device
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handled_count = 0
+        self._output_counts: Dict[str, int] = {}
+
+    @property
+    def handled_count(self) -> int:
+        """
+        the number of messages that the callback handled
+        """
+        return self._handled_count
+
+    @property
+    def output_counts(self) -> Dict[str, int]:
+        """
+        the number of outputs that were sent to each output device
+        """
+        with self._lock:
+            return dict(self._output_counts)
+
+    def record_message(self):
+        """
+        records that the callback handled a message
+        """
+        with self._lock:
+            self._handled_count += 1
+
+    def record_output(self, output_device: str):
+        """
+        records that the callback sent an output to some output device
+
+        :param output_device: the output device name
+        """
+        with self._lock:
+            self._output_counts[output_device] = self._output_counts.get(output_device, 0) + 1
+
+    def reset(self):
+        """
+        clears the counts
+        """
+        with self._lock:
+            self._handled_count = 0
+            self._output_counts.clear()
+
+
+@dataclass
+class RouteEdge:
+    """
+    a route from the input device of a callback to an output device
+    """
+    source: str
+    target: str
+    static: bool
+    observed_count: int
+    fan_out: float
+
+
+@dataclass
+class StageLoad:
+    """
+    the expected load on some device (queue), and on the callback that reads from it (if there is one)
+    """
+    device_name: str
+    message_rate: float
+    cost: Optional[float] = None
+    load: Optional[float] = None
+    required_workers: Optional[int] = None
+
+
+class Topology:
+    """
+    the routing graph of a FastMessage object. the nodes are devices, and the edges are the routes from the input
+    device of each callback to the output devices it sends to (both the registered routes, and the routes that were
+    observed at runtime, like 'OtherMethodOutput' and 'CustomOutput' targets)
+    """
+
+    def __init__(self, edges: List[RouteEdge], handled_counts: Dict[str, int], costs: Dict[str, float]):
+        """
+
+        :param edges: the edges of the graph
+        :param handled_counts: the number of messages that the callback of each input device handled
+        :param costs: the measured cost (in seconds per message) of the callback of each input device
+        """
+        self._edges = edges
+        self._handled_counts = handled_counts
+        self._costs = costs
+
+    @property
+    def edges(self) -> List[RouteEdge]:
+        """
+        the edges of the graph
+        """
+        return list(self._edges)
+
+    @property
+    def callback_devices(self) -> List[str]:
+        """
+        the input devices that have callbacks
+        """
+        return list(self._handled_counts.keys())
+
+    @property
+    def devices(self) -> List[str]:
+        """
+        all the devices in the graph
+        """
+        devices: Dict[str, None] = dict.fromkeys(self._handled_counts)
+        for edge in self._edges:
+            devices.setdefault(edge.target)
+        return list(devices)
+
+    @property
+    def costs(self) -> Dict[str, float]:
+        """
+        the measured cost (in seconds per message) of the callbacks (for those that were measured)
+        """
+        return dict(self._costs)
+
+    def get_edges(self, source: str) -> List[RouteEdge]:
+        """
+        returns the edges from some input device
+
+        :param source: the input device name
+        """
+        return [edge for edge in self._edges if edge.source == source]
+
+    def get_message_rates(self, ingress_rates: Dict[str, float], max_iterations: int = 100) -> Dict[str, float]:
+        """
+        computes the expected message rate of each device, by propagating the ingress rates along the fan-out ratios
+
+        :param ingress_rates: the external message rate (messages per second) into each device
+        :param max_iterations: the maximum number of propagation rounds (for graphs with cycles)
+        :return: the expected message rate of each device
+        """
+        devices = self.devices
+        devices.extend(device for device in ingress_rates if device not in devices)
+        rates = {device: ingress_rates.get(device, 0.0) for device in devices}
+        for _ in range(max_iterations):
+            new_rates = {device: ingress_rates.get(device, 0.0) for device in devices}
+            for edge in self._edges:
+                new_rates[edge.target] += rates[edge.source] * edge.fan_out
+            if all(math.isclose(new_rates[device], rates[device], rel_tol=1e-9) for device in devices):
+                return new_rates
+            rates = new_rates
+
+        return rates
+
+    def capacity_report(self,
+                        ingress_rates: Dict[str, float],
+                        costs: Optional[Dict[str, float]] = None,
+                        target_utilization: float = 0.7) -> Dict[str, StageLoad]:
+        """
+        reports the expected load on each device and callback, for sizing the number of workers for each queue
+
+        :param ingress_rates: the external message rate (messages per second) into each device
+        :param costs: the cost (in seconds per message) of the callbacks. defaults to the measured costs
+        :param target_utilization: the target utilization of each worker (for computing the required workers)
+        :return: the expected load of each device
+        """
+        stage_costs = dict(self._costs)
+        if costs is not None:
+            stage_costs.update(costs)
+
+        report: Dict[str, StageLoad] = {}
+        for device, message_rate in self.get_message_rates(ingress_rates).items():
+            stage_load = StageLoad(device_name=device, message_rate=message_rate)
+            cost = stage_costs.get(device)
+            if cost is not None:
+                stage_load.cost = cost
+                stage_load.load = message_rate * cost
+                stage_load.required_workers = max(1, math.ceil(round(stage_load.load / target_utilization, 9)))
+            report[device] = stage_load
+
+        return report
+
+
+def build_topology(static_routes: Dict[str, Set[str]],
+                   route_counters: Dict[str, RouteCounter],
+                   costs: Dict[str, float]) -> Topology:
+    """
+    builds the routing graph from the registered routes and the observed routes
+
+    :param static_routes: the registered output devices of the callback of each input device
+    :param route_counters: the route counters of the callback of each input device
+    :param costs: the measured cost (in seconds per message) of the callback of each input device
+    :return: the topology
+    """
+    edges: List[RouteEdge] = []
+    handled_counts: Dict[str, int] = {}
+    for source, route_counter in route_counters.items():
+        handled_count = route_counter.handled_count
+        output_counts = route_counter.output_counts
+        handled_counts[source] = handled_count
+        targets = dict.fromkeys(static_routes.get(source, ()))
+        targets.update(dict.fromkeys(output_counts))
+        for target in targets:
+            observed_count = output_counts.get(target, 0)
+            is_static = target in static_routes.get(source, ())
+            if handled_count > 0:
+                fan_out = observed_count / handled_count
+            else:
+                fan_out = 1.0 if is_static else 0.0  # nothing was observed yet, so assume one output per message
+            edges.append(RouteEdge(source=source,
+                                   target=target,
+                                   static=is_static,
+                                   observed_count=observed_count,
+                                   fan_out=fan_out))
+
+    return Topology(edges=edges, handled_counts=handled_counts, costs=costs)
@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+import uuid
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Deque
+
+from fastmessage.load_shedding import SENT_AT_HEADER, _get_float_header
+from messageflux.iodevices.base.common import MessageHeaders
+
+TRACE_ID_HEADER = 'fastmessage-trace-id'
+"""a header with the id of the trace that the message belongs to"""
+
+SPAN_ID_HEADER = 'fastmessage-span-id'
+"""a header with the id of the span (hop) that sent the message"""
+
+
+@dataclass
+class Span:
+    """
+    the timing of handling a single message (a single hop in a trace)
+    """
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    input_device_name: str
+    start_time: float
+    queue_wait: Optional[float] = None
+    processing_time: Optional[float] = None
+    error: Optional[str] = None
+
+    def inject(self, headers: MessageHeaders):
+        """
+        puts the trace context of this span in the headers of an output message (so the next hop continues the trace)
+
+        :param headers: the headers of the output message
+        """
+        headers[TRACE_ID_HEADER] = self.trace_id
+        headers[SPAN_ID_HEADER] = self.span_id
+
+
+class SpanExporter(metaclass=ABCMeta):
+    """
+    an exporter for the finished spans
+    """
+
+    @abstractmethod
+    def export(self, span: Span):
+        """
+        exports a finished span
+
+        :param span: the span to export
+        """
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    """
+    an exporter that keeps the last spans in memory
+    """
+
+    def __init__(self, max_spans: int = 10000):
+        """
+
+        :param max_spans: the maximum number of spans to keep (the oldest spans are discarded)
+        """
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+
+    @property
+    def spans(self) -> List[Span]:
+        """
+        the exported spans
+        """
+        return list(self._spans)
+
+    def export(self, span: Span):
+        self._spans.append(span)
+
+    def clear(self):
+        """
+        discards all the exported spans
+        """
+        self._spans.clear()
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    an exporter that appends the spans to a file, as json lines
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path: the path of the file to append the spans to
+        """
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def export(self, span: Span):
+        line = json.dumps(asdict(span)) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        """
+        closes the file
+        """
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """
+    creates the spans for the handled messages (continuing the trace from the message headers),
+    and exports them when they are finished
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter] = None):
+        """
+
+        :param exporter: the exporter for the finished spans (None disables the tracing)
+        """
+        self.exporter = exporter
+
+    def start_span(self, input_device_name: str, headers: MessageHeaders) -> Optional[Span]:
+        """
+        starts a span for handling a message
+
+        :param input_device_name: the input device the message was read from
+        :param headers: the headers of the message
+        :return: the started span (or None if the tracing is disabled)
+        """
+        if self.exporter is None:
+            return None
+
+        start_time = time.time()
+        sent_at = _get_float_header(headers, SENT_AT_HEADER)
+        trace_id = headers.get(TRACE_ID_HEADER)
+        parent_span_id = headers.get(SPAN_ID_HEADER)
+        return Span(trace_id=str(trace_id) if trace_id else uuid.uuid4().hex,
+                    span_id=uuid.uuid4().hex[:16],
+                    parent_span_id=str(parent_span_id) if parent_span_id else None,
+                    input_device_name=input_device_name,
+                    start_time=start_time,
+                    queue_wait=None if sent_at is None else max(0.0, start_time - sent_at))
+
+    def finish_span(self, span: Span, error: Optional[BaseException] = None):
+        """
+        finishes a span, and exports it
+
+        :param span: the span to finish
+        :param error: the error that the handling failed with (if it failed)
+        """
+        span.processing_time = time.time() - span.start_time
+        if error is not None:
+            span.error = repr(error)
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
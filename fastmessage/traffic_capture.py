@@ -0,0 +1,270 @@
+import argparse
+import importlib
+import json
+import mmap
+import os
+import statistics
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+from messageflux import InputDevice, ReadResult
+from messageflux.iodevices.base.common import MessageBundle, Message
+from messageflux.pipeline_service import PipelineResult
+
+if TYPE_CHECKING:
+    from fastmessage.fastmessage_handler import FastMessage
+
+_FILE_MAGIC = b'FMTRAFFIC1\n'
+# timestamp, input device name length, headers length, data length
+_RECORD_HEADER = struct.Struct('<dIII')
+
+
+@dataclass
+class RecordedMessage:
+    """
+    a message that was read from a traffic capture file
+    """
+    timestamp: float
+    input_device_name: str
+    headers: Dict[str, Any]
+    data: bytes
+
+
+class TrafficRecorder:
+    """
+    records the messages that are handled by FastMessage to a compact append-only file, for replaying them later.
+
+    each record holds the arrival time, the input device name, the headers (as json) and the raw message body.
+    notice that header values that are not json serializable are recorded as strings
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path: the path of the capture file (new records are appended to it)
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_FILE_MAGIC)
+
+    @property
+    def path(self) -> str:
+        """
+        the path of the capture file
+        """
+        return self._path
+
+    def record(self, input_device_name: str, message_bundle: MessageBundle):
+        """
+        appends a message to the capture file
+
+        :param input_device_name: the input device the message was read from
+        :param message_bundle: the message to record
+        """
+        message = message_bundle.message
+        name = input_device_name.encode()
+        headers = json.dumps(message.headers, default=str).encode()
+        data = message.bytes
+        record_header = _RECORD_HEADER.pack(time.time(), len(name), len(headers), len(data))
+        with self._lock:
+            self._file.write(b''.join((record_header, name, headers, data)))
+
+    def flush(self):
+        """
+        flushes the recorded messages to the file
+        """
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """
+        closes the capture file
+        """
+        with self._lock:
+            self._file.close()
+
+
+def read_traffic(path: str) -> Iterator[RecordedMessage]:
+    """
+    reads the recorded messages from a capture file (the file is memory mapped, and not read as a whole)
+
+    :param path: the path of the capture file
+    :return: an iterator over the recorded messages
+    """
+    if os.path.getsize(path) == 0:
+        return
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if mapped[:len(_FILE_MAGIC)] != _FILE_MAGIC:
+            raise ValueError(f"'{path}' is not a traffic capture file")
+
+        offset = len(_FILE_MAGIC)
+        end = len(mapped)
+        while offset + _RECORD_HEADER.size <= end:
+            timestamp, name_length, headers_length, data_length = _RECORD_HEADER.unpack_from(mapped, offset)
+            offset += _RECORD_HEADER.size
+            record_end = offset + name_length + headers_length + data_length
+            if record_end > end:
+                break  # a partially written record (the recorder was not closed properly)
+
+            name = mapped[offset:offset + name_length].decode()
+            offset += name_length
+            headers = json.loads(mapped[offset:offset + headers_length])
+            offset += headers_length
+            data = mapped[offset:record_end]
+            offset = record_end
+            yield RecordedMessage(timestamp=timestamp, input_device_name=name, headers=headers, data=data)
+
+
+@dataclass
+class ReplayStats:
+    """
+    the stats of replaying the messages of some input device
+    """
+    latencies: List[float] = field(default_factory=list)
+    total_time: float = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+    """the number of messages that failed, by the type name of their exception"""
+
+    @property
+    def error_count(self) -> int:
+        """
+        the number of messages that failed (they are not included in the latencies)
+        """
+        return sum(self.errors.values())
+
+    @property
+    def count(self) -> int:
+        """
+        the number of replayed messages
+        """
+        return len(self.latencies)
+
+    @property
+    def throughput(self) -> float:
+        """
+        the number of messages handled per second (of handling time)
+        """
+        return self.count / self.total_time if self.total_time > 0 else 0
+
+    @property
+    def mean_latency(self) -> float:
+        """
+        the mean latency (in seconds) of handling a message
+        """
+        return statistics.mean(self.latencies) if self.latencies else 0
+
+    def percentile(self, percent: float) -> float:
+        """
+        returns a latency percentile (in seconds)
+
+        :param percent: the percentile to return (between 0 and 100)
+        """
+        if not self.latencies:
+            return 0
+        sorted_latencies = sorted(self.latencies)
+        index = min(len(sorted_latencies) - 1, int(len(sorted_latencies) * percent / 100))
+        return sorted_latencies[index]
+
+
+class _ReplayInputDevice(InputDevice):
+    def __init__(self, name: str):
+        super().__init__(None, name)
+
+    def _read_message(self,
+                      cancellation_token: threading.Event,
+                      timeout: Optional[float] = None,
+                      with_transaction: bool = True) -> Optional[ReadResult]:
+        return None
+
+
+def replay_traffic(fastmessage_handler: 'FastMessage',
+                   path: str,
+                   speed: Optional[float] = None) -> Dict[str, ReplayStats]:
+    """
+    replays the recorded messages into a FastMessage object, and measures how long it takes to handle them
+    (including the serialization of the outputs, that are discarded)
+
+    :param fastmessage_handler: the FastMessage object to handle the messages with
+    :param path: the path of the capture file
+    :param speed: None replays the messages as fast as possible.
+    otherwise, the messages are replayed at their recorded pace, multiplied by this speed (1 is the recorded speed)
+    :return: the replay stats for each input device (messages that raise an exception are counted in its errors)
+    """
+    stats: Dict[str, ReplayStats] = {}
+    input_devices: Dict[str, _ReplayInputDevice] = {}
+    first_timestamp: Optional[float] = None
+    replay_start = time.perf_counter()
+    for recorded_message in read_traffic(path):
+        if speed is not None:
+            if first_timestamp is None:
+                first_timestamp = recorded_message.timestamp
+            delay = (recorded_message.timestamp - first_timestamp) / speed - (time.perf_counter() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        input_device = input_devices.get(recorded_message.input_device_name)
+        if input_device is None:
+            input_device = _ReplayInputDevice(recorded_message.input_device_name)
+            input_devices[recorded_message.input_device_name] = input_device
+
+        message_bundle = MessageBundle(message=Message(data=recorded_message.data,
+                                                       headers=recorded_message.headers))
+        device_stats = stats.setdefault(recorded_message.input_device_name, ReplayStats())
+        start_time = time.perf_counter()
+        try:
+            results = fastmessage_handler.handle_message(input_device, message_bundle)
+            if results is not None and not isinstance(results, PipelineResult):
+                for _ in results:
+                    pass
+        except Exception as ex:  # a capture of real traffic may have bad messages, so they are counted and skipped
+            error_type = type(ex).__name__
+            device_stats.errors[error_type] = device_stats.errors.get(error_type, 0) + 1
+            continue
+        latency = time.perf_counter() - start_time
+
+        device_stats.latencies.append(latency)
+        device_stats.total_time += latency
+
+    return stats
+
+
+def _load_fastmessage_handler(spec: str) -> 'FastMessage':
+    module_name, _, attribute = spec.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute or 'fm')
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m fastmessage.traffic_capture',
+                                     description='replays a traffic capture file into a FastMessage object')
+    parser.add_argument('handler', help="the FastMessage object to replay into, as 'module:attribute'")
+    parser.add_argument('path', help='the path of the capture file')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay at the recorded pace, multiplied by this speed (default: as fast as possible)')
+    parsed_args = parser.parse_args(args)
+
+    fastmessage_handler = _load_fastmessage_handler(parsed_args.handler)
+    fastmessage_handler.prepare()
+    try:
+        stats = replay_traffic(fastmessage_handler, parsed_args.path, speed=parsed_args.speed)
+    finally:
+        fastmessage_handler.shutdown()
+
+    for input_device_name, device_stats in sorted(stats.items()):
+        print(f'{input_device_name}: {device_stats.count} messages, {device_stats.throughput:.1f} msg/sec, '
+              f'latency mean={device_stats.mean_latency * 1000:.3f}ms '
+              f'p50={device_stats.percentile(50) * 1000:.3f}ms '
+              f'p99={device_stats.percentile(99) * 1000:.3f}ms')
+        if device_stats.errors:
+            errors = ', '.join(f'{error_type}={count}' for error_type, count in sorted(device_stats.errors.items()))
+            print(f'{input_device_name}: {device_stats.error_count} errors ({errors})')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
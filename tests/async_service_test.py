@@ -0,0 +1,167 @@
+import asyncio
+import json
+import threading
+import time
+
+from fastmessage import FastMessage, Depends, DependencyScope, InMemorySpanExporter
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from tests.common import send_messages, read_outputs, start_async_service
+
+
+def test_async_service_concurrency():
+    fm = FastMessage(default_output_device='output')
+    in_flight = 0
+    max_in_flight = 0
+
+    @fm.map(input_device='input')
+    async def do_something(x: int):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.2)
+        in_flight -= 1
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [json.dumps(dict(x=i)).encode() for i in range(50)])
+    service = start_async_service(fm, device_manager, max_concurrency=20)
+    try:
+        start_time = time.time()
+        results = read_outputs(device_manager, 'output', 50)
+        duration = time.time() - start_time
+    finally:
+        service.stop()
+
+    assert sorted(results) == list(range(50))
+    assert max_in_flight == 20
+    assert duration < 2  # 50 messages of 0.2 seconds each, 20 at a time
+
+
+def test_async_service_sync_callbacks_and_generators():
+    fm = FastMessage(default_output_device='output')
+    callback_threads = set()
+
+    @fm.map(input_device='sync')
+    def do_something(x: int):
+        callback_threads.add(threading.get_ident())
+        time.sleep(0.01)
+        return x
+
+    @fm.map(input_device='generator')
+    def do_something_else(y: int):
+        for i in range(y):
+            yield i
+
+    @fm.map(input_device='async_generator')
+    async def do_something_async(z: int):
+        for i in range(z):
+            await asyncio.sleep(0)
+            yield i * 10
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'sync', [json.dumps(dict(x=i)).encode() for i in range(5)])
+    send_messages(device_manager, 'generator', [b'{"y": 3}'])
+    send_messages(device_manager, 'async_generator', [b'{"z": 2}'])
+    service = start_async_service(fm, device_manager, sync_workers=4)
+    try:
+        results = read_outputs(device_manager, 'output', 10)
+    finally:
+        service.stop()
+
+    assert sorted(results) == [0, 0, 0, 1, 1, 2, 2, 3, 4, 10]
+    assert threading.get_ident() not in callback_threads
+
+
+def test_async_service_validation_error_and_dependencies():
+    fm = FastMessage(default_output_device='output')
+    errors = []
+    fm.register_validation_error_handler(lambda input_device, message_bundle, error: errors.append(error))
+    torn_down = []
+
+    async def get_resource():
+        await asyncio.sleep(0)
+        yield 'resource'
+        await asyncio.sleep(0)
+        torn_down.append(True)
+
+    @fm.map(input_device='input')
+    async def do_something(x: int, resource: str = Depends(get_resource)):
+        return f'{resource}-{x}'
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [b'{"x": 1}', b'{"x": "bad"}', b'{"x": 2}'])
+    service = start_async_service(fm, device_manager)
+    try:
+        results = read_outputs(device_manager, 'output', 2)
+    finally:
+        service.stop()
+
+    assert sorted(results) == ['resource-1', 'resource-2']
+    assert len(errors) == 1
+    assert torn_down == [True, True]
+
+
+def test_async_service_tears_down_dependencies_on_stop():
+    fm = FastMessage(default_output_device='output')
+    torn_down = []
+
+    async def get_session():
+        yield 'session'
+        torn_down.append(('session', asyncio.get_running_loop()))  # torn down on the loop of the service
+
+    def get_client():
+        yield 'client'
+        torn_down.append(('client', None))
+
+    @fm.map(input_device='input')
+    async def do_something(x: int,
+                           session: str = Depends(get_session, scope=DependencyScope.EVENT_LOOP),
+                           client: str = Depends(get_client, scope=DependencyScope.PROCESS)):
+        return f'{session}-{client}-{x}'
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [b'{"x": 1}'])
+    service = fm.create_async_service(input_device_manager=device_manager,
+                                      output_device_manager=device_manager,
+                                      should_stop_on_signal=False,
+                                      read_timeout=0.1)
+    service_thread = threading.Thread(target=service.start, daemon=True)
+    service_thread.start()
+    try:
+        assert read_outputs(device_manager, 'output', 1) == ['session-client-1']
+    finally:
+        service.stop()
+        service_thread.join(5)
+
+    assert [name for name, _ in torn_down] == ['session', 'client']
+    assert torn_down[0][1] is not None
+    assert not fm.is_ready
+
+
+def test_async_service_failed_message_spans():
+    fm = FastMessage(default_output_device='output')
+    exporter = InMemorySpanExporter()
+    fm.set_span_exporter(exporter)
+
+    @fm.map(input_device='sync_input')
+    def do_something(x: int):
+        raise RuntimeError('boom')
+
+    @fm.map(input_device='async_input')
+    async def do_something_async(x: int):
+        raise RuntimeError('boom')
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'sync_input', [b'{"x": 1}'])
+    send_messages(device_manager, 'async_input', [b'{"x": 1}'])
+    service = start_async_service(fm, device_manager, use_transactions=False)
+    try:
+        end_time = time.time() + 5
+        while len(exporter.spans) < 2 and time.time() < end_time:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        service.stop()
+
+    assert len(exporter.spans) == 2  # exactly one span for each failed message
+    assert all('boom' in span.error for span in exporter.spans)
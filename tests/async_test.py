@@ -1,8 +1,13 @@
+import asyncio
 import json
+import threading
+import time
 import uuid
 from typing import List
 
-from fastmessage import FastMessage, InputDeviceName
+import pytest
+
+from fastmessage import FastMessage, InputDeviceName, CallbackTimeoutException, Depends, DependencyScope
 from messageflux.iodevices.base.common import MessageBundle, Message
 from tests.common import FakeInputDevice
 
@@ -52,3 +57,158 @@ def test_return_async_generator():
     assert result[0].message_bundle.message.bytes == b'1'
     assert result[1].message_bundle.message.bytes == b'2'
     assert result[2].message_bundle.message.bytes == b'3'
+
+
+def test_async_timeout():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input1', timeout=0.05)
+    async def do_something1(x: float):
+        await asyncio.sleep(x)
+        return x
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 0}')))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'0.0'
+
+    with pytest.raises(CallbackTimeoutException):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 10}')))
+
+
+def test_async_timeout_dead_letter():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input1', timeout=0.05, dead_letter_device='dead_letter')
+    async def do_something1(x: float):
+        await asyncio.sleep(x)
+        return x
+
+    input_bundle = MessageBundle(Message(b'{"x": 10}'))
+    result = fm.handle_message(FakeInputDevice('input1'), input_bundle)
+    assert result is not None
+    assert result[0].output_device_name == 'dead_letter'
+    assert result[0].message_bundle is input_bundle
+
+
+def test_async_generator_timeout():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input1', timeout=0.05, dead_letter_device='dead_letter')
+    async def do_something1(x: float):
+        yield 1
+        await asyncio.sleep(x)
+        yield 2
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 10}')))
+    assert result is not None
+    result = list(result)
+    assert len(result) == 2
+    assert result[0].output_device_name == 'output'
+    assert result[1].output_device_name == 'dead_letter'
+
+
+def test_inner_timeout_error_is_not_a_callback_timeout():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input1', timeout=10, dead_letter_device='dead_letter')
+    async def do_something1():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{}')))
+
+    @fm.map(input_device='input2', timeout=0.01, dead_letter_device='dead_letter')
+    async def do_something2():
+        time.sleep(0.05)  # blocks the loop past the deadline, so only the task state tells who raised
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        fm.handle_message(FakeInputDevice('input2'), MessageBundle(Message(b'{}')))
+
+
+def test_event_loop_per_thread():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    loops = []
+    results = []
+
+    @fm.map(input_device='input1')
+    async def do_something1(x: int):
+        loops.append(asyncio.get_running_loop())
+        await asyncio.sleep(0.01)
+        return x
+
+    def handle(x: int):
+        result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(f'{{"x": {x}}}'.encode())))
+        results.append(result[0].message_bundle.message.bytes)
+
+    threads = [threading.Thread(target=handle, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [b'0', b'1', b'2', b'3']
+    assert len(set(map(id, loops))) == 4
+
+    fm.shutdown()
+    assert all(loop.is_closed() for loop in loops)
+
+    handle(5)  # a new event loop is created after shutdown
+    assert not fm.event_loop.is_closed()
+    fm.shutdown()
+
+
+def test_shutdown_with_running_event_loop():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    started = threading.Event()
+    release = threading.Event()
+    torn_down = []
+
+    def get_client():
+        yield 'client'
+        torn_down.append(True)
+
+    @fm.map(input_device='input1')
+    async def do_something1(x: int, client: str = Depends(get_client, scope=DependencyScope.PROCESS)):
+        started.set()
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return x
+
+    thread = threading.Thread(target=fm.handle_message,
+                              args=(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}'))))
+    thread.start()
+    assert started.wait(5)
+    running_loop = fm._event_loops[0]
+    try:
+        fm.shutdown()  # the loop of the other thread is still running, but the rest is torn down
+        assert torn_down == [True]
+        assert not running_loop.is_closed()
+    finally:
+        release.set()
+        thread.join()
+
+    fm.shutdown()
+    assert running_loop.is_closed()
+
+
+def test_shutdown_waits_for_last_service():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    torn_down = []
+
+    def get_client():
+        yield 'client'
+        torn_down.append(True)
+
+    @fm.map(input_device='input1')
+    def do_something1(x: int, client: str = Depends(get_client, scope=DependencyScope.PROCESS)):
+        return x
+
+    fm.prepare()  # two services that share this object
+    fm.prepare()
+    fm.shutdown()
+    assert torn_down == []  # the other service still uses the dependencies
+    assert fm.is_ready
+    fm.shutdown()
+    assert torn_down == [True]
+    assert not fm.is_ready
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from fastmessage import FastMessage, FileSystemBlobStore, CLAIM_CHECK_HEADER, ClaimCheckException, \
+    CONTENT_ENCODING_HEADER, PoisonMessageCache
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+def test_file_system_blob_store(tmp_path: Path):
+    blob_store = FileSystemBlobStore(str(tmp_path))
+    reference = blob_store.put(b'some data')
+    assert blob_store.get(reference) == b'some data'
+    assert blob_store.get(blob_store.put(b'')) == b''
+
+    blob_store.delete(reference)
+    with pytest.raises(ClaimCheckException):
+        blob_store.get(reference)
+
+    with pytest.raises(ClaimCheckException):
+        blob_store.get('../some_file')
+
+
+def test_file_system_blob_store_retention(tmp_path: Path):
+    blob_store = FileSystemBlobStore(str(tmp_path), retention=60)
+    old_reference = blob_store.put(b'old data')
+    new_reference = blob_store.put(b'new data')
+    old_time = time.time() - 120
+    os.utime(tmp_path / old_reference, (old_time, old_time))
+
+    assert blob_store.cleanup() == 1
+    assert blob_store.get(new_reference) == b'new data'
+    with pytest.raises(ClaimCheckException):
+        blob_store.get(old_reference)
+
+    assert FileSystemBlobStore(str(tmp_path)).cleanup() == 0  # no retention
+
+
+def test_claim_check_round_trip(tmp_path: Path):
+    fm: FastMessage = FastMessage()
+    fm.set_claim_check_store(FileSystemBlobStore(str(tmp_path)), threshold=100)
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return dict(data='a' * x)
+
+    @fm.map(input_device='output', output_device='final')
+    def do_something2(data: str):
+        return len(data)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 10}')))
+    assert result is not None
+    assert CLAIM_CHECK_HEADER not in result[0].message_bundle.message.headers
+    assert json.loads(result[0].message_bundle.message.bytes) == dict(data='a' * 10)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1000}')))
+    assert result is not None
+    checked_message = result[0].message_bundle.message
+    assert checked_message.bytes == b''
+    assert CLAIM_CHECK_HEADER in checked_message.headers
+
+    result = fm.handle_message(FakeInputDevice('output'), MessageBundle(checked_message))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1000'
+
+
+def test_claim_check_with_poison_cache(tmp_path: Path):
+    errors = []
+    fm: FastMessage = FastMessage(validation_error_handler=lambda input_device, message_bundle, error:
+                                  errors.append(error))
+    blob_store = FileSystemBlobStore(str(tmp_path))
+    fm.set_claim_check_store(blob_store, threshold=100)
+    fm.set_poison_message_cache(PoisonMessageCache())
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    bad_message = Message(b'', headers={CLAIM_CHECK_HEADER: blob_store.put(b'{"x": "bad"}')})
+    good_message = Message(b'', headers={CLAIM_CHECK_HEADER: blob_store.put(b'{"x": 1}')})
+    fm.handle_message(FakeInputDevice('input1'), MessageBundle(bad_message))
+    assert len(errors) == 1
+
+    # both bodies are empty, but the good message is not mistaken for the known bad one
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(good_message))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1'
+    assert len(errors) == 1
+
+
+def test_claim_check_with_compression(tmp_path: Path):
+    fm: FastMessage = FastMessage()
+    fm.set_claim_check_store(FileSystemBlobStore(str(tmp_path)), threshold=10)
+    fm.set_output_compression('output', threshold=10)
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return dict(data='a' * x)
+
+    @fm.map(input_device='output', output_device='final')
+    def do_something2(data: str):
+        return len(data)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1000}')))
+    assert result is not None
+    checked_message = result[0].message_bundle.message
+    assert CLAIM_CHECK_HEADER in checked_message.headers
+    assert CONTENT_ENCODING_HEADER in checked_message.headers
+
+    result = fm.handle_message(FakeInputDevice('output'), MessageBundle(checked_message))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1000'
+
+
+def test_claim_check_without_store():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    with pytest.raises(ClaimCheckException):
+        fm.handle_message(FakeInputDevice('input1'),
+                          MessageBundle(Message(b'', headers={CLAIM_CHECK_HEADER: 'some_reference'})))
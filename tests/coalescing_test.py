@@ -0,0 +1,162 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from fastmessage import FastMessage, CoalescingNotAllowedException, InputDeviceName
+from messageflux.iodevices.base.common import MessageBundle, Message
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from tests.common import FakeInputDevice, send_messages, read_outputs, start_async_service
+
+
+def _handle_concurrently(fm: FastMessage, input_device: str, bodies):
+    barrier = threading.Barrier(len(bodies))
+    results = [None] * len(bodies)
+    errors = [None] * len(bodies)
+
+    def _handle(index, body):
+        barrier.wait()
+        try:
+            results[index] = list(fm.handle_message(FakeInputDevice(input_device), MessageBundle(Message(body))))
+        except Exception as ex:
+            errors[index] = ex
+
+    threads = [threading.Thread(target=_handle, args=(i, body)) for i, body in enumerate(bodies)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_coalescing():
+    fm = FastMessage(default_output_device='output')
+    calls = []
+
+    @fm.map(input_device='input', coalesce=True)
+    def do_something(x: int, device_name: InputDeviceName):
+        calls.append(x)
+        time.sleep(0.2)
+        return dict(x=x, calls=len(calls))
+
+    results, errors = _handle_concurrently(fm, 'input', [b'{"x": 1}'] * 8 + [b'{"x": 2}'] * 2)
+    assert errors == [None] * 10
+    assert sorted(calls) == [1, 2]
+    outputs = [json.loads(result[0].message_bundle.message.bytes) for result in results]
+    assert [output['x'] for output in outputs] == [1] * 8 + [2] * 2
+    assert len({output['calls'] for output in outputs[:8]}) == 1
+    # each message gets its own output
+    assert len({id(result[0].message_bundle) for result in results}) == 10
+
+    single_flight = fm.get_callback_wrapper('input').single_flight
+    assert single_flight.executions == 2
+    assert single_flight.coalesced == 8
+    assert single_flight.in_flight == 0
+
+    # nothing is kept after the call is done
+    fm.handle_message(FakeInputDevice('input'), MessageBundle(Message(b'{"x": 1}')))
+    assert sorted(calls) == [1, 1, 2]
+
+
+def test_coalesced_errors():
+    fm = FastMessage(default_output_device='output')
+    calls = []
+
+    @fm.map(input_device='input', coalesce=True)
+    def do_something(x: int):
+        calls.append(x)
+        time.sleep(0.2)
+        raise ValueError(x)
+
+    results, errors = _handle_concurrently(fm, 'input', [b'{"x": 1}'] * 5)
+    assert calls == [1]
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_coalesced_generator_return_value():
+    fm = FastMessage(default_output_device='output')
+
+    def _generate(x: int):
+        yield dict(x=x)
+        yield dict(x=x + 1)
+
+    @fm.map(input_device='input', coalesce=True)
+    def do_something(x: int):
+        time.sleep(0.2)
+        return _generate(x)  # a generator can be iterated only once, so it's not shared as is
+
+    results, errors = _handle_concurrently(fm, 'input', [b'{"x": 1}'] * 4)
+    assert errors == [None] * 4
+    for result in results:
+        assert [json.loads(r.message_bundle.message.bytes) for r in result] == [dict(x=1), dict(x=2)]
+    assert fm.get_callback_wrapper('input').single_flight.coalesced == 3
+
+
+def test_async_coalescing():
+    fm = FastMessage(default_output_device='output')
+    calls = []
+
+    @fm.map(input_device='input', coalesce=True)
+    async def do_something(x: int):
+        calls.append(x)
+        await asyncio.sleep(0.2)
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [json.dumps(dict(x=i % 2)).encode() for i in range(20)])
+    service = start_async_service(fm, device_manager, max_concurrency=100)
+    try:
+        results = read_outputs(device_manager, 'output', 20)
+    finally:
+        service.stop()
+
+    assert sorted(results) == [0] * 10 + [1] * 10
+    assert sorted(calls) == [0, 1]
+
+
+def test_coalescing_not_allowed():
+    fm = FastMessage()
+
+    def generator(x: int):
+        yield x
+
+    async def async_generator(x: int):
+        yield x
+
+    def with_message_bundle(x: int, message_bundle: MessageBundle):
+        pass
+
+    def with_timeout(x: int):
+        pass
+
+    for callback in (generator, async_generator, with_message_bundle):
+        with pytest.raises(CoalescingNotAllowedException):
+            fm.register_callback(callback, coalesce=True)
+
+    with pytest.raises(CoalescingNotAllowedException):
+        fm.register_callback(with_timeout, coalesce=True, timeout=1, dead_letter_device='dead_letter')
+
+
+def test_serial_service_warns_about_coalescing(caplog):
+    fm = FastMessage()
+
+    @fm.map(input_device='coalesced', coalesce=True)
+    def do_something(x: int):
+        return x
+
+    @fm.map(input_device='other')
+    def do_something_else(x: int):
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    fm.create_service(input_device_manager=device_manager, input_device_names='other')
+    assert 'coalesced' not in caplog.text
+
+    fm.create_service(input_device_manager=device_manager)
+    assert "input devices ['coalesced'] are coalesced" in caplog.text
+
+    caplog.clear()
+    fm.create_async_service(input_device_manager=device_manager)
+    assert 'coalesced' not in caplog.text
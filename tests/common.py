@@ -1,7 +1,12 @@
+import json
 import threading
-from typing import Optional
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
+from fastmessage import FastMessage, AsyncPipelineService
 from messageflux import InputDevice, ReadResult
+from messageflux.iodevices.base.common import Message
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
 
 
 class FakeInputDevice(InputDevice):
@@ -13,3 +18,38 @@ class FakeInputDevice(InputDevice):
 
     def __init__(self, name: str):
         super().__init__(None, name)
+
+
+def send_messages(device_manager: InMemoryDeviceManager,
+                  device_name: str,
+                  bodies: Iterable[bytes],
+                  headers: Optional[Dict[str, Any]] = None):
+    output_device = device_manager.get_output_device(device_name)
+    for body in bodies:
+        output_device.send_message(Message(body, headers=dict(headers or {})))
+
+
+def read_outputs(device_manager: InMemoryDeviceManager,
+                 device_name: str,
+                 count: int,
+                 timeout: float = 5) -> List[Any]:
+    input_device = device_manager.get_input_device(device_name)
+    results: List[Any] = []
+    end_time = time.time() + timeout
+    while len(results) < count and time.time() < end_time:
+        read_result = input_device.read_message(cancellation_token=threading.Event(),
+                                                timeout=0.1,
+                                                with_transaction=False)
+        if read_result is not None:
+            results.append(json.loads(read_result.message.bytes))
+    return results
+
+
+def start_async_service(fm: FastMessage, device_manager: InMemoryDeviceManager, **kwargs) -> AsyncPipelineService:
+    service = fm.create_async_service(input_device_manager=device_manager,
+                                      output_device_manager=device_manager,
+                                      should_stop_on_signal=False,
+                                      read_timeout=0.1,
+                                      **kwargs)
+    threading.Thread(target=service.start, daemon=True).start()
+    return service
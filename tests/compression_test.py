@@ -0,0 +1,163 @@
+import gzip
+import json
+import lzma
+import zlib
+
+import pytest
+
+from fastmessage import FastMessage, CONTENT_ENCODING_HEADER, CompressionCodec, UnknownCompressionCodecException, \
+    DecompressionException
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+class ReverseCodec(CompressionCodec):
+    def compress(self, data: bytes) -> bytes:
+        return data[::-1]
+
+    def decompress(self, data: bytes) -> bytes:
+        return data[::-1]
+
+
+@pytest.mark.parametrize('codec_name', ['zlib', 'gzip', 'lzma'])
+def test_compressed_round_trip(codec_name: str):
+    fm: FastMessage = FastMessage()
+    fm.set_output_compression('output', codec_name=codec_name, threshold=100)
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return dict(data='a' * x)
+
+    @fm.map(input_device='output', output_device='final')
+    def do_something2(data: str):
+        return len(data)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 10}')))
+    assert result is not None
+    assert CONTENT_ENCODING_HEADER not in result[0].message_bundle.message.headers
+    assert json.loads(result[0].message_bundle.message.bytes) == dict(data='a' * 10)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1000}')))
+    assert result is not None
+    compressed_message = result[0].message_bundle.message
+    assert compressed_message.headers[CONTENT_ENCODING_HEADER] == codec_name
+    assert len(compressed_message.bytes) < 1000
+
+    result = fm.handle_message(FakeInputDevice('output'), MessageBundle(compressed_message))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1000'
+
+
+def test_decompress_input():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    for data, codec_name, expected in ((gzip.compress(b'{"x": 1}'), 'gzip', b'1'),
+                                       (zlib.compress(b'{"x": 2}'), 'zlib', b'2')):
+        result = fm.handle_message(FakeInputDevice('input1'),
+                                   MessageBundle(Message(data, headers={CONTENT_ENCODING_HEADER: codec_name})))
+        assert result is not None
+        assert result[0].message_bundle.message.bytes == expected
+
+
+def test_custom_codec():
+    fm: FastMessage = FastMessage()
+    fm.register_compression_codec('reverse', ReverseCodec())
+    fm.set_output_compression('output', codec_name='reverse', threshold=0)
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return dict(x=x)
+
+    result = fm.handle_message(FakeInputDevice('input1'),
+                               MessageBundle(Message(b'}3 :"x"{', headers={CONTENT_ENCODING_HEADER: 'reverse'})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'}3 :"x"{'
+
+
+def test_unknown_codec():
+    fm: FastMessage = FastMessage()
+
+    with pytest.raises(UnknownCompressionCodecException):
+        fm.set_output_compression('output', codec_name='unknown')
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    with pytest.raises(UnknownCompressionCodecException):
+        fm.handle_message(FakeInputDevice('input1'),
+                          MessageBundle(Message(b'{"x": 1}', headers={CONTENT_ENCODING_HEADER: 'unknown'})))
+
+
+def test_identity_encoding():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    result = fm.handle_message(FakeInputDevice('input1'),
+                               MessageBundle(Message(b'{"x": 1}', headers={CONTENT_ENCODING_HEADER: 'identity'})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1'
+
+
+@pytest.mark.parametrize('codec_name, data', [('zlib', b'not zlib'),
+                                              ('gzip', b'not gzip'),
+                                              ('lzma', b'not lzma'),
+                                              ('zlib', zlib.compress(b'{"x": 1}')[:-3]),
+                                              ('gzip', gzip.compress(b'{"x": 1}')[:-10]),
+                                              ('lzma', lzma.compress(b'{"x": 1}')[:-10])])
+def test_corrupted_input(codec_name: str, data: bytes):
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    with pytest.raises(DecompressionException):
+        fm.handle_message(FakeInputDevice('input1'),
+                          MessageBundle(Message(data, headers={CONTENT_ENCODING_HEADER: codec_name})))
+
+
+@pytest.mark.parametrize('codec_name, compress', [('zlib', zlib.compress),
+                                                  ('gzip', gzip.compress),
+                                                  ('lzma', lzma.compress),
+                                                  ('reverse', ReverseCodec().compress)])
+def test_max_decompressed_size(codec_name: str, compress):
+    fm: FastMessage = FastMessage()
+    fm.register_compression_codec('reverse', ReverseCodec())
+    fm.set_max_decompressed_size(100)
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: str):
+        return len(x)
+
+    body = json.dumps(dict(x='a' * 80)).encode()
+    result = fm.handle_message(FakeInputDevice('input1'),
+                               MessageBundle(Message(compress(body), headers={CONTENT_ENCODING_HEADER: codec_name})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'80'
+
+    body = json.dumps(dict(x='a' * 1_000_000)).encode()
+    with pytest.raises(DecompressionException):
+        fm.handle_message(FakeInputDevice('input1'),
+                          MessageBundle(Message(compress(body), headers={CONTENT_ENCODING_HEADER: codec_name})))
+
+
+def test_multiple_gzip_members():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    data = gzip.compress(b'{"x": ') + gzip.compress(b'5}')
+    result = fm.handle_message(FakeInputDevice('input1'),
+                               MessageBundle(Message(data, headers={CONTENT_ENCODING_HEADER: 'gzip'})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'5'
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import threading
+import time
+
+from fastmessage import FastMessage, AdaptiveConcurrencyLimiter
+from messageflux.iodevices.base.common import MessageBundle, Message
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from tests.common import FakeInputDevice, send_messages, read_outputs, start_async_service
+
+
+def test_aimd():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, min_limit=2, max_limit=5, latency_target=0.1)
+    for _ in range(4):
+        limiter.acquire()
+    assert limiter.in_flight == 4
+
+    for _ in range(5):  # the limit is used, so each fast call increases it by 1/limit
+        limiter.release(latency=0.01)
+        limiter.acquire()
+    assert limiter.limit == 5
+    for _ in range(20):
+        limiter.release(latency=0.01)
+        limiter.acquire()
+    assert limiter.limit == 5  # max_limit
+
+    limiter.release(latency=1)
+    assert limiter.limit == 4  # 5 * 0.9
+    limiter.release(latency=1)  # was in flight together with the previous call, so the limit isn't decreased again
+    assert limiter.limit == 4
+    limiter.release()
+    limiter.release()
+    assert limiter.in_flight == 0
+
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(dropped=True)
+    assert limiter.limit == 2  # min_limit
+
+    stats = limiter.get_stats()
+    assert stats.in_flight == 0
+    assert stats.waiting == 0
+    assert stats.queued_count == 0
+    assert stats.baseline_latency == 0.01
+
+
+def test_baseline_follows_lasting_latency_increase():
+    limiter = AdaptiveConcurrencyLimiter(latency_target=None, baseline_window=0.05)
+    for latency in (0.01, 0.001, 0.01):
+        limiter.acquire()
+        limiter.release(latency=latency)
+    assert limiter.get_stats().baseline_latency == 0.001
+
+    # the latency without load has increased (e.g. the database was moved)
+    for _ in range(2):
+        time.sleep(0.05)
+        limiter.acquire()
+        limiter.release(latency=0.01)
+    assert limiter.get_stats().baseline_latency == 0.01  # the old minimum was forgotten after two windows
+
+    limiter.reset_baseline()
+    assert limiter.get_stats().baseline_latency is None
+
+
+def test_generator_holds_slot_until_iterated():
+    fm = FastMessage(default_output_device='output')
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, latency_target=10)
+
+    @fm.map(input_device='input', concurrency_limiter=limiter)
+    def do_something(x: int):
+        for i in range(x):
+            time.sleep(0.01)
+            yield i
+
+    results = fm.handle_message(FakeInputDevice('input'), MessageBundle(Message(b'{"x": 3}')))
+    assert limiter.in_flight == 1  # the body of the generator runs while the results are iterated
+    assert len(list(results)) == 3
+    assert limiter.in_flight == 0
+    assert limiter.get_stats().baseline_latency >= 0.03
+
+    results = fm.handle_message(FakeInputDevice('input'), MessageBundle(Message(b'{"x": 3}')))
+    next(iter(results))
+    results.close()  # the results were not iterated to the end
+    assert limiter.in_flight == 0
+
+
+def test_waiters_are_admitted_in_order():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+    admitted = []
+    limiter.acquire()
+
+    def _acquire(i):
+        limiter.acquire()
+        admitted.append(i)
+
+    threads = []
+    for i in range(3):
+        thread = threading.Thread(target=_acquire, args=(i,))
+        thread.start()
+        threads.append(thread)
+        while limiter.waiting < i + 1:
+            time.sleep(0.001)
+
+    for i in range(3):
+        limiter.release()
+        while len(admitted) < i + 1:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+
+    assert admitted == [0, 1, 2]
+    stats = limiter.get_stats()
+    assert stats.admitted_count == 4
+    assert stats.queued_count == 3
+    assert stats.max_wait_time > 0
+
+
+def test_limit_adapts_to_capacity():
+    fm = FastMessage()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, latency_tolerance=2)
+    concurrent = 0
+    lock = threading.Lock()
+
+    @fm.map(input_device='input1', output_device=None, concurrency_limiter=limiter)
+    def do_something():
+        nonlocal concurrent
+        with lock:
+            concurrent += 1
+            current = concurrent
+        time.sleep(0.005 * max(1.0, current / 5))  # a dependency that can handle 5 calls at the same time
+        with lock:
+            concurrent -= 1
+
+    end_time = time.time() + 1.5
+
+    def _worker():
+        while time.time() < end_time:
+            fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{}')))
+
+    threads = [threading.Thread(target=_worker) for _ in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the latency exceeds twice the baseline above 10 concurrent calls
+    assert 5 <= limiter.limit <= 15
+    assert limiter.get_stats().queued_count > 0
+
+
+def test_async_limiter():
+    fm = FastMessage(default_output_device='output')
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3)
+    in_flight = 0
+    max_in_flight = 0
+
+    @fm.map(input_device='input', concurrency_limiter=limiter)
+    async def do_something(x: int):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [json.dumps(dict(x=i)).encode() for i in range(30)])
+    service = start_async_service(fm, device_manager, max_concurrency=20)
+    try:
+        results = read_outputs(device_manager, 'output', 30)
+    finally:
+        service.stop()
+
+    assert sorted(results) == list(range(30))
+    assert max_in_flight == 3
+    assert limiter.in_flight == 0
+    assert limiter.get_stats().queued_count > 0
@@ -0,0 +1,267 @@
+import asyncio
+import gc
+import threading
+import time
+from typing import List
+
+import pytest
+
+from fastmessage import FastMessage, Depends, DependencyScope
+from fastmessage.dependencies import MessageScope
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+class Resource:
+    def __init__(self, events: List[str], name: str):
+        self.events = events
+        self.name = name
+        self.events.append(f'open {name}')
+
+    def close(self):
+        self.events.append(f'close {self.name}')
+
+
+def _handle(fm: FastMessage, input_device: str = 'input1', data: bytes = b'{"x": 1}'):
+    result = fm.handle_message(FakeInputDevice(input_device), MessageBundle(Message(data)))
+    if result is not None:
+        result = list(result)
+    return result
+
+
+def test_message_scope():
+    events: List[str] = []
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    def get_resource():
+        resource = Resource(events, 'message')
+        yield resource
+        resource.close()
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, r1: Resource = Depends(get_resource), r2: Resource = Depends(get_resource)):
+        assert r1 is r2
+        events.append(f'handle {x}')
+        return x
+
+    _handle(fm)
+    _handle(fm)
+    assert events == ['open message', 'handle 1', 'close message'] * 2
+
+
+def test_message_scope_teardown_on_exception():
+    events: List[str] = []
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    def get_resource():
+        resource = Resource(events, 'message')
+        yield resource
+        resource.close()
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, r: Resource = Depends(get_resource)):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        _handle(fm)
+    assert events == ['open message', 'close message']
+
+
+def test_message_scope_with_generator_callback():
+    events: List[str] = []
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    def get_resource():
+        resource = Resource(events, 'message')
+        yield resource
+        resource.close()
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, r: Resource = Depends(get_resource)):
+        for i in range(2):
+            events.append(f'yield {i}')
+            yield i
+
+    result = _handle(fm)
+    assert result is not None and len(result) == 2
+    assert events == ['open message', 'yield 0', 'yield 1', 'close message']
+
+
+def test_process_scope_with_async_providers():
+    events: List[str] = []
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    async def get_pool():
+        pool = Resource(events, 'pool')
+        yield pool
+        pool.close()
+
+    async def get_client(pool: Resource = Depends(get_pool, scope=DependencyScope.PROCESS)):
+        return f'client of {pool.name}'
+
+    @fm.map(input_device='input1')
+    async def do_something(x: int,
+                           pool: Resource = Depends(get_pool, scope=DependencyScope.PROCESS),
+                           client: str = Depends(get_client)):
+        events.append(f'handle {x} with {client}')
+        return x
+
+    _handle(fm)
+    _handle(fm)
+    assert events == ['open pool', 'handle 1 with client of pool', 'handle 1 with client of pool']
+
+    fm.shutdown()
+    assert events[-1] == 'close pool'
+
+
+def test_thread_scope():
+    events: List[str] = []
+    fm: FastMessage = FastMessage(default_output_device='output')
+    resources = []
+
+    def get_resource():
+        resource = Resource(events, threading.current_thread().name)
+        yield resource
+        resource.close()
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, r: Resource = Depends(get_resource, scope=DependencyScope.THREAD)):
+        resources.append(r)
+        return x
+
+    threads = [threading.Thread(target=_handle, args=(fm,), name=f'thread{i}') for i in range(2)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    _handle(fm)
+    _handle(fm)
+
+    assert len(set(map(id, resources))) == 3
+    fm.shutdown()
+    assert sorted(e for e in events if e.startswith('close')) == ['close MainThread', 'close thread0', 'close thread1']
+
+
+def test_process_scope_creation_does_not_block_other_values():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    other_resolved = threading.Event()
+
+    async def get_slow_client():
+        # waits (on this thread's event loop) for another thread to resolve its own dependency
+        while not other_resolved.is_set():
+            await asyncio.sleep(0.01)
+        return 'slow'
+
+    def get_other():
+        return 'other'
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, client: str = Depends(get_slow_client, scope=DependencyScope.PROCESS)):
+        return client
+
+    @fm.map(input_device='input2')
+    def do_something2(x: int, other: str = Depends(get_other, scope=DependencyScope.PROCESS)):
+        other_resolved.set()
+        return other
+
+    slow_thread = threading.Thread(target=_handle, args=(fm,))
+    slow_thread.start()
+    other_thread = threading.Thread(target=_handle, args=(fm, 'input2'))
+    other_thread.start()
+    try:
+        other_thread.join(timeout=2)
+        assert not other_thread.is_alive()
+    finally:
+        other_resolved.set()  # so the slow thread finishes anyway
+        slow_thread.join()
+        other_thread.join()
+    fm.shutdown()
+
+
+def test_process_scope_value_is_created_once():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    created: List[int] = []
+    clients = []
+
+    def get_client():
+        time.sleep(0.1)
+        created.append(1)
+        return object()
+
+    @fm.map(input_device='input1')
+    def do_something(x: int, client: object = Depends(get_client, scope=DependencyScope.PROCESS)):
+        clients.append(client)
+        return x
+
+    threads = [threading.Thread(target=_handle, args=(fm,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == [1]
+    assert len(set(map(id, clients))) == 1
+    fm.shutdown()
+
+
+def test_event_loop_teardown_runs_on_its_loop():
+    events: List[str] = []
+    fm: FastMessage = FastMessage()
+    depends = Depends(None, scope=DependencyScope.EVENT_LOOP)
+
+    async def get_pool():
+        pool = Resource(events, 'pool')
+        yield pool
+        events.append(f'close on {threading.current_thread().name}')
+
+    depends.provider = get_pool
+    resolver = fm._dependency_resolver
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name='loop thread')
+    loop_thread.start()
+    try:
+        future = asyncio.run_coroutine_threadsafe(resolver.resolve_async(depends, MessageScope()), loop)
+        assert future.result(timeout=5).name == 'pool'
+        fm.shutdown()  # the loop is running on another thread, so the teardown is run there
+        assert events == ['open pool', 'close on loop thread']
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+
+def test_close_event_loop():
+    events: List[str] = []
+    fm: FastMessage = FastMessage()
+    resolver = fm._dependency_resolver
+
+    async def get_pool():
+        pool = Resource(events, 'pool')
+        yield pool
+        pool.close()
+
+    async def use_pools():
+        pool = await resolver.resolve_async(Depends(get_pool, scope=DependencyScope.EVENT_LOOP), MessageScope())
+        process_pool = await resolver.resolve_async(Depends(get_pool, scope=DependencyScope.PROCESS), MessageScope())
+        return pool, process_pool
+
+    for _ in range(2):
+        loop = asyncio.new_event_loop()
+        pool, process_pool = loop.run_until_complete(use_pools())
+        assert pool is not process_pool
+        loop.run_until_complete(resolver.close_event_loop_async())
+        loop.close()
+
+    # the process scoped value was torn down with its loop, so it was created again on the next loop
+    assert events == ['open pool', 'open pool', 'close pool', 'close pool'] * 2
+
+    async def get_client():
+        return Resource(events, 'client')
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(resolver.resolve_async(Depends(get_client, scope=DependencyScope.EVENT_LOOP),
+                                                   MessageScope()))
+    assert len(resolver._event_loop_values) == 1
+    loop.close()
+    del loop
+    gc.collect()
+    assert len(resolver._event_loop_values) == 0  # the dropped loop is not kept alive by its values
@@ -0,0 +1,55 @@
+import time
+from typing import Tuple
+
+import pytest
+
+from fastmessage import FastMessage, MultipleReturnValues, CustomOutput
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+_FAN_OUT_SIZE = 100000
+_ROUNDS = 3
+
+fm: FastMessage = FastMessage(default_output_device='output')
+
+
+@fm.map(input_device='generator')
+def generator_fan_out(y: int):
+    for i in range(y):
+        yield i if i % 2 else CustomOutput(value=i, output_device='even')
+
+
+@fm.map(input_device='multiple_return_values')
+def multiple_return_values_fan_out(y: int):
+    return MultipleReturnValues(MultipleReturnValues([i, CustomOutput(value=i, output_device='other')])
+                                for i in range(y // 2))
+
+
+@fm.map(input_device='nested_generators')
+def nested_generators_fan_out(y: int):
+    def nested(depth: int):
+        yield depth
+        if depth > 0:
+            yield nested(depth - 1)
+
+    return nested(y // 5)  # deeply nested generators are much slower per item
+
+
+def _run_fan_out(input_device: str, size: int) -> Tuple[int, float]:
+    message_bundle = MessageBundle(message=Message(data=f'{{"y": {size}}}'.encode()))
+    count = 0
+    best_time = float('inf')
+    for _ in range(_ROUNDS):
+        start_time = time.perf_counter()
+        count = sum(1 for _ in fm.handle_message(FakeInputDevice(input_device), message_bundle))
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return count, best_time
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('input_device', ['generator', 'multiple_return_values', 'nested_generators'])
+def test_fan_out_benchmark(input_device: str):
+    count, best_time = _run_fan_out(input_device, _FAN_OUT_SIZE)
+    print(f'\n{input_device}: {count} results in {best_time * 1000:.0f}ms (best of {_ROUNDS})')
+    assert count >= _FAN_OUT_SIZE // 5
+    assert best_time < 20  # a loose bound, that catches only quadratic regressions
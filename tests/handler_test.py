@@ -6,7 +6,8 @@ import pytest
 from pydantic import BaseModel, ValidationError
 
 from fastmessage import FastMessage, MissingCallbackException, DuplicateCallbackException, \
-    InputDeviceName, SpecialDefaultValueException, NotAllowedParamKindException, MultipleReturnValues, CustomOutput
+    InputDeviceName, SpecialDefaultValueException, NotAllowedParamKindException, MultipleReturnValues, CustomOutput, \
+    LazyBody
 from messageflux.iodevices.base import InputDevice
 from messageflux.iodevices.base.common import MessageBundle, Message
 from messageflux.pipeline_service import PipelineResult
@@ -323,4 +324,103 @@ def test_return_complex():
     assert result[7].message_bundle.message.bytes == b'8'
     assert result[8].message_bundle.message.bytes == b'9'
 
+
+def test_large_fan_out():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input1')
+    def do_something1(y: int):
+        for i in range(y):
+            yield i if i % 2 else CustomOutput(value=i, output_device='even')
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(message=Message(data=b'{"y": 100000}')))
+    count = 0
+    for pipeline_result in result:
+        assert pipeline_result.output_device_name == ('even' if count % 2 == 0 else 'output')
+        count += 1
+    assert count == 100000
+    assert pipeline_result.message_bundle.message.bytes == b'99999'
+
+
+def test_deeply_nested_results():
+    fm: FastMessage = FastMessage(default_output_device='output')
+
+    def nested(depth: int):
+        yield depth
+        if depth > 0:
+            yield MultipleReturnValues([nested(depth - 1)])
+
+    @fm.map(input_device='input1')
+    def do_something1(y: int):
+        return nested(y)
+
+    # much deeper than the recursion limit
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(message=Message(data=b'{"y": 20000}')))
+    result = list(result)
+    assert len(result) == 20001
+    assert result[0].message_bundle.message.bytes == b'20000'
+    assert result[-1].message_bundle.message.bytes == b'0'
+
+
+def test_results_are_streamed():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    yielded = []
+
+    @fm.map(input_device='input1')
+    def do_something1(y: int):
+        for i in range(y):
+            yielded.append(i)
+            yield MultipleReturnValues([CustomOutput(value=i, output_device='other')])
+
+    result = iter(fm.handle_message(FakeInputDevice('input1'), MessageBundle(message=Message(data=b'{"y": 10}'))))
+    first = next(result)
+    assert first.output_device_name == 'other'
+    assert yielded == [0]
+
+
+def test_no_body_params_skips_parsing():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(m: Message, d: InputDeviceName):
+        return m.headers['route']
+
+    result = fm.handle_message(FakeInputDevice('input1'),
+                               MessageBundle(Message(b'this is not json', headers={'route': 'a'})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'"a"'
+
+
+def test_lazy_body():
+    fm: FastMessage = FastMessage()
+    lazy_bodies = []
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(m: Message, body: LazyBody[SomeModel]):
+        lazy_bodies.append(body)
+        if m.headers.get('parse'):
+            return body.value.x
+        return None
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'not json')))
+    assert result is None
+    assert not lazy_bodies[0].is_parsed
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 5}', headers={'parse': 1})))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'5'
+    assert lazy_bodies[1].is_parsed
+
+    with pytest.raises(ValidationError):
+        _ = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"y": 5}', headers={'parse': 1})))
+
+
+def test_lazy_body_default_value():
+    fm: FastMessage = FastMessage()
+
+    with pytest.raises(SpecialDefaultValueException, match='LazyBody'):
+        @fm.map(input_device='input1')
+        def do_something1(body: LazyBody[SomeModel] = None):
+            pass
+
 # add tests for no output devices, etc...
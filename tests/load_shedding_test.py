@@ -0,0 +1,77 @@
+import time
+
+from fastmessage import FastMessage, EXPIRES_AT_HEADER, SENT_AT_HEADER, LoadShedder
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+def test_expires_at_header():
+    fm: FastMessage = FastMessage()
+    calls = []
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        calls.append(x)
+        return x
+
+    expired_bundle = MessageBundle(Message(b'not json', headers={EXPIRES_AT_HEADER: time.time() - 1}))
+    assert fm.handle_message(FakeInputDevice('input1'), expired_bundle) is None
+    assert calls == []
+
+    valid_bundle = MessageBundle(Message(b'{"x": 1}', headers={EXPIRES_AT_HEADER: str(time.time() + 100)}))
+    assert fm.handle_message(FakeInputDevice('input1'), valid_bundle) is not None
+    assert calls == [1]
+    assert fm.get_callback_wrapper('input1').load_shedder.expired_count == 1
+
+
+def test_ttl_with_expired_output_device():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output', ttl=10, expired_output_device='expired')
+    def do_something1(x: int):
+        return x
+
+    expired_bundle = MessageBundle(Message(b'{"x": 1}', headers={SENT_AT_HEADER: time.time() - 20}))
+    result = fm.handle_message(FakeInputDevice('input1'), expired_bundle)
+    assert result is not None
+    assert result.output_device_name == 'expired'
+    assert result.message_bundle is expired_bundle
+
+    valid_bundle = MessageBundle(Message(b'{"x": 1}', headers={SENT_AT_HEADER: time.time() - 5}))
+    result = fm.handle_message(FakeInputDevice('input1'), valid_bundle)
+    assert result is not None
+    assert result[0].output_device_name == 'output'
+
+
+def test_ttl_between_hops():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='input2')
+    def do_something1(x: int):
+        return dict(x=x)
+
+    @fm.map(input_device='input2', output_device='output', ttl=10)
+    def do_something2(x: int):
+        return x
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    output_message = result[0].message_bundle.message
+    assert time.time() - output_message.headers[SENT_AT_HEADER] < 5
+    assert fm.handle_message(FakeInputDevice('input2'), MessageBundle(output_message)) is not None
+
+    output_message.headers[SENT_AT_HEADER] -= 20  # as if it waited in the queue
+    assert fm.handle_message(FakeInputDevice('input2'), MessageBundle(output_message)) is None
+    assert fm.get_callback_wrapper('input2').load_shedder.expired_count == 1
+
+
+def test_adaptive_shedding():
+    load_shedder = LoadShedder(latency_slo=0.1, latency_smoothing=1)
+    assert not load_shedder.should_shed({})
+
+    load_shedder.record_latency(0.05)
+    assert not any(load_shedder.should_shed({}) for _ in range(100))
+
+    load_shedder.record_latency(10)  # 1% of the messages should pass
+    shed = [load_shedder.should_shed({}) for _ in range(1000)]
+    assert sum(shed) > 900
+    assert load_shedder.shed_by_latency_count == sum(shed)
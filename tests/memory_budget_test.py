@@ -0,0 +1,151 @@
+import asyncio
+import json
+import threading
+import time
+
+from fastmessage import FastMessage, MemoryBudget, PriorityPipelineService
+from messageflux.iodevices.base.common import Message, MessageBundle
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from messageflux.pipeline_service import PipelineResult
+from tests.common import send_messages, read_outputs, start_async_service
+
+
+def _padded_message(x: int, size: int = 1000) -> bytes:
+    body = json.dumps(dict(x=x, padding='')).encode()
+    return json.dumps(dict(x=x, padding='-' * (size - len(body)))).encode()
+
+
+def test_memory_budget_accounting():
+    memory_budget = MemoryBudget(max_bytes=100, model_size_ratio=0.5)
+    first_bundle = MessageBundle(Message(b'a' * 40))
+    first_reservation = memory_budget.reserve(first_bundle)
+    assert first_reservation.total_bytes == 60
+    assert memory_budget.has_capacity()
+
+    second_reservation = memory_budget.reserve(MessageBundle(Message(b'b' * 40)))
+    memory_budget.add_outputs(first_bundle, [PipelineResult('output', MessageBundle(Message(b'c' * 10)))])
+    assert memory_budget.in_flight_bytes == 130
+    assert not memory_budget.has_capacity()
+    assert not memory_budget.wait_for_capacity(timeout=0.05)
+
+    threading.Timer(0.05, first_reservation.release).start()
+    assert memory_budget.wait_for_capacity(timeout=5)
+    assert memory_budget.in_flight_bytes == 60
+
+    stats = memory_budget.get_stats()
+    assert stats.input_bytes == 40
+    assert stats.model_bytes == 20
+    assert stats.output_bytes == 0
+    assert stats.peak_bytes == 130
+    assert stats.in_flight_messages == 1
+    assert stats.pause_count == 2
+    assert stats.paused_time > 0
+
+    second_reservation.release()
+    second_reservation.release()  # releasing twice does nothing
+    assert memory_budget.in_flight_bytes == 0
+    assert memory_budget.get_stats().in_flight_messages == 0
+
+
+def test_memory_budget_accounts_for_outputs():
+    fm = FastMessage(default_output_device='output')
+    memory_budget = MemoryBudget(max_bytes=100_000, model_size_ratio=0)
+    fm.set_memory_budget(memory_budget)
+
+    @fm.map(input_device='input')
+    def do_something(x: int):
+        return dict(padding='-' * 500 * x)
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', [_padded_message(1), _padded_message(2)])
+    service = fm.create_service(input_device_manager=device_manager,
+                                output_device_manager=device_manager,
+                                max_batch_read_count=2,
+                                wait_for_batch_count=True,
+                                read_timeout=1)
+    service._prepare_service()
+    try:
+        service._server_loop(threading.Event())
+    finally:
+        service._finalize_service()
+
+    output_sizes = [len(json.dumps(output)) for output in read_outputs(device_manager, 'output', 2)]
+    assert memory_budget.in_flight_bytes == 0
+    assert memory_budget.get_stats().peak_bytes == 2000 + sum(output_sizes)
+
+
+def test_memory_budget_limits_batches():
+    fm = FastMessage()
+    memory_budget = MemoryBudget(max_bytes=2500, model_size_ratio=0)
+    fm.set_memory_budget(memory_budget)
+    in_flight_bytes = []
+
+    @fm.map(input_device='input', output_device=None)
+    def do_something(x: int):
+        in_flight_bytes.append(memory_budget.in_flight_bytes)
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', map(_padded_message, range(10)))
+    # the batch ends once the budget is exceeded by its own messages, without waiting for the rest of the batch
+    service = fm.create_service(input_device_manager=device_manager,
+                                max_batch_read_count=10,
+                                wait_for_batch_count=True,
+                                read_timeout=1)
+    assert isinstance(service, PriorityPipelineService)
+    service._prepare_service()
+    try:
+        start_time = time.perf_counter()
+        service._server_loop(threading.Event())
+        assert time.perf_counter() - start_time < 0.5
+        assert in_flight_bytes == [3000] * 3  # the reading stopped once the budget was exceeded
+        while len(in_flight_bytes) < 9:
+            service._server_loop(threading.Event())
+    finally:
+        service._finalize_service()
+
+    assert memory_budget.in_flight_bytes == 0
+    assert memory_budget.get_stats().peak_bytes == 3000
+
+    other_reservation = memory_budget.reserve(MessageBundle(Message(b'a' * 3000)))
+    threading.Timer(0.05, other_reservation.release).start()
+    service._prepare_service()
+    try:
+        service._server_loop(threading.Event())  # the budget is held by others, so the reading waits for them
+    finally:
+        service._finalize_service()
+    assert in_flight_bytes[9] == 1000
+
+
+def test_memory_budget_pauses_async_reading():
+    fm = FastMessage(default_output_device='output')
+    memory_budget = MemoryBudget(max_bytes=2500, model_size_ratio=0)
+    fm.set_memory_budget(memory_budget)
+    in_flight = 0
+    max_in_flight = 0
+
+    @fm.map(input_device='input')
+    async def do_something(x: int):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return 'y' * 1000
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', map(_padded_message, range(20)))
+    service = start_async_service(fm, device_manager, max_concurrency=100)
+    try:
+        results = read_outputs(device_manager, 'output', 20)
+    finally:
+        service.stop()
+
+    assert len(results) == 20
+    assert max_in_flight == 3
+    end_time = time.time() + 5
+    while memory_budget.in_flight_bytes and time.time() < end_time:
+        time.sleep(0.01)
+    stats = memory_budget.get_stats()
+    assert stats.in_flight_bytes == 0
+    assert stats.peak_bytes > 3000  # the pending outputs were accounted for
+    assert stats.pause_count > 0
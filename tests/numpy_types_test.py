@@ -0,0 +1,118 @@
+import base64
+import json
+
+import pytest
+from pydantic import BaseModel, ValidationError, create_model
+
+from fastmessage import FastMessage, NDArray, conarray, encode_ndarray_base64
+from fastmessage.output_encoding import _output_encoders
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+np = pytest.importorskip('numpy')
+
+
+Samples = conarray('float32', ge=0, le=100)
+
+
+class Telemetry(BaseModel):
+    samples: Samples
+    counts: NDArray[np.int64]
+
+
+def test_validate_arrays():
+    telemetry = Telemetry.parse_raw(json.dumps(dict(samples=[1, 2.5, 100], counts=[[1, 2], [3, 4]])))
+    assert telemetry.samples.dtype == np.float32
+    assert telemetry.samples.tolist() == [1, 2.5, 100]
+    assert telemetry.counts.dtype == np.int64
+    assert telemetry.counts.shape == (2, 2)
+    assert telemetry.counts.flags.c_contiguous
+
+    samples = np.array([0.5, 1.5, 2.5], dtype='<f4')
+    telemetry = Telemetry(samples=base64.b64encode(samples.tobytes()).decode(), counts=[])
+    assert telemetry.samples.tolist() == [0.5, 1.5, 2.5]
+    assert telemetry.samples.flags.writeable
+    assert telemetry.counts.dtype == np.int64
+
+    bad_values = [
+        dict(samples=[1, 101], counts=[]),  # out of range
+        dict(samples=[-1], counts=[]),  # out of range
+        dict(samples=[1], counts=[1.5]),  # floats are not converted to ints
+        dict(samples=['1'], counts=[]),  # strings are not converted to numbers
+        dict(samples=[[1], [1, 2]], counts=[]),  # ragged
+        dict(samples='not base64!', counts=[]),
+        dict(samples=base64.b64encode(b'12345').decode(), counts=[]),  # not a multiple of the item size
+        dict(samples=[1, float('nan')], counts=[]),  # nan passes the range checks
+        dict(samples=base64.b64encode(np.array([np.nan], dtype='<f4').tobytes()).decode(), counts=[]),
+    ]
+    for bad_value in bad_values:
+        with pytest.raises(ValidationError):
+            Telemetry(**bad_value)
+
+    with pytest.raises(ValidationError):
+        create_model('Small', x=(NDArray[np.uint8], ...))(x=[1, 300])
+    assert np.isnan(create_model('Unbounded', x=(NDArray, ...))(x=[float('nan')]).x).all()
+
+    with pytest.raises(TypeError):
+        conarray('complex128')
+
+
+def test_constraints_and_schema():
+    Matrix = conarray('int32', ndim=2, max_items=4)
+
+    class SomeModel(BaseModel):
+        matrix: Matrix
+
+    assert SomeModel(matrix=[[1, 2], [3, 4]]).matrix.shape == (2, 2)
+    with pytest.raises(ValidationError):
+        SomeModel(matrix=[1, 2])
+    with pytest.raises(ValidationError):
+        SomeModel(matrix=[[1, 2, 3], [4, 5, 6]])
+
+    schema = Telemetry.schema()['properties']['samples']
+    assert schema['anyOf'] == [{'type': 'array', 'items': {'type': 'number', 'minimum': 0, 'maximum': 100}},
+                               {'type': 'string', 'format': 'base64'}]
+    schema = SomeModel.schema()['properties']['matrix']
+    assert schema['anyOf'][0] == {'type': 'array', 'items': {'type': 'array', 'items': {'type': 'integer'}}}
+
+
+def test_array_params_and_outputs():
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input')
+    def do_something(samples: NDArray[np.float64], scale: float):
+        return samples * scale
+
+    @fm.map(input_device='input2')
+    def do_something2(samples: NDArray):
+        return samples.sum()
+
+    result = fm.handle_message(FakeInputDevice('input'), MessageBundle(Message(b'{"samples": [1, 2, 3], "scale": 2}')))
+    assert json.loads(result[0].message_bundle.message.bytes) == [2.0, 4.0, 6.0]
+
+    samples = base64.b64encode(np.arange(4, dtype='<f8').tobytes()).decode()
+    message = Message(json.dumps(dict(samples=samples)).encode())
+    result = fm.handle_message(FakeInputDevice('input2'), MessageBundle(message))
+    assert json.loads(result[0].message_bundle.message.bytes) == 6.0
+
+
+def test_base64_array_outputs(monkeypatch):
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input')
+    def do_something(samples: NDArray[np.float32]):
+        return samples.reshape(2, 2) * 2
+
+    @fm.map(input_device='input2')
+    def do_something2():
+        return np.array(['a', 'b'])
+
+    monkeypatch.setitem(_output_encoders, np.ndarray, encode_ndarray_base64)
+    message = Message(b'{"samples": [1, 2, 3, 4]}')
+    result = fm.handle_message(FakeInputDevice('input'), MessageBundle(message))
+    output = json.loads(result[0].message_bundle.message.bytes)
+    assert isinstance(output, str)
+    assert NDArray[np.float32].validate(output).tolist() == [2, 4, 6, 8]  # flattened
+
+    result = fm.handle_message(FakeInputDevice('input2'), MessageBundle(Message(b'{}')))
+    assert json.loads(result[0].message_bundle.message.bytes) == ['a', 'b']  # not a numeric array
@@ -0,0 +1,122 @@
+import dataclasses
+import datetime
+import json
+from typing import List, NamedTuple, Optional
+
+import pytest
+from pydantic import BaseModel, Extra, Field
+
+from fastmessage import FastMessage, PreSerializedOutput
+from fastmessage import output_encoding
+from fastmessage.output_encoding import encode_output, register_output_encoder, get_output_encoder
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+class InnerModel(BaseModel):
+    a: int
+    t: datetime.datetime
+
+
+class OuterModel(BaseModel):
+    x: List[InnerModel]
+    y: str
+
+
+class RootModel(BaseModel):
+    __root__: List[int]
+
+
+class CustomEncodersModel(BaseModel):
+    t: datetime.datetime
+
+    class Config:
+        json_encoders = {datetime.datetime: lambda t: t.year}
+
+
+class ExtraModel(BaseModel, extra=Extra.allow):
+    a: int
+
+
+class ExcludeModel(BaseModel):
+    a: int
+    b: int = Field(exclude=True)
+
+
+class NestedModel(BaseModel):
+    inner: InnerModel
+    other: Optional[CustomEncodersModel]
+    items: List[ExtraModel]
+    d: datetime.date
+
+
+@dataclasses.dataclass
+class SomeDataclass:
+    a: int
+    m: InnerModel
+
+
+class SomeNamedTuple(NamedTuple):
+    a: int
+    b: str
+
+
+class CustomType:
+    def __init__(self, value: int):
+        self.value = value
+
+
+SOME_TIME = datetime.datetime(2023, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def restore_output_encoders(monkeypatch):
+    monkeypatch.setattr(output_encoding, '_output_encoders', dict(output_encoding._output_encoders))
+
+
+@pytest.mark.parametrize('value', [
+    OuterModel(x=[InnerModel(a=1, t=SOME_TIME), InnerModel(a=2, t=SOME_TIME)], y='y'),
+    RootModel(__root__=[1, 2]),
+    CustomEncodersModel(t=SOME_TIME),
+    ExtraModel(a=1, b=SOME_TIME),
+    ExcludeModel(a=1, b=2),
+    NestedModel(inner=InnerModel(a=1, t=SOME_TIME), other=CustomEncodersModel(t=SOME_TIME),
+                items=[ExtraModel(a=1, b=2)], d=SOME_TIME.date()),
+    NestedModel(inner=InnerModel(a=1, t=SOME_TIME), other=None, items=[], d=SOME_TIME.date()),
+    NestedModel.construct(inner=InnerModel(a=1, t=SOME_TIME)),
+    SomeDataclass(a=1, m=InnerModel(a=1, t=SOME_TIME)),
+    SomeNamedTuple(a=1, b='b'),
+    {'a': 1, 'b': [1, 2], 'c': InnerModel(a=1, t=SOME_TIME)},
+    'some string',
+    5,
+    None,
+])
+def test_same_as_json_dumps(value):
+    json_encoder = getattr(value, '__json_encoder__', BaseModel.__json_encoder__)
+    assert encode_output(value) == json.dumps(value, default=json_encoder).encode()
+
+
+def test_encoder_is_cached():
+    assert get_output_encoder(OuterModel) is get_output_encoder(OuterModel)
+
+
+def test_register_output_encoder():
+    register_output_encoder(CustomType, lambda v: str(v.value).encode())
+    assert encode_output(CustomType(3)) == b'3'
+
+
+def test_registered_encoder_is_restored():
+    assert CustomType not in output_encoding._output_encoders  # registered by the previous test
+
+
+def test_pre_serialized_output():
+    fm: FastMessage = FastMessage()
+    constant_output = PreSerializedOutput({'status': 'ok'})
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return constant_output
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'{"status": "ok"}'
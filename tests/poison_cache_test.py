@@ -0,0 +1,99 @@
+import time
+
+import pytest
+from pydantic import BaseModel, ValidationError, validator
+
+from fastmessage import FastMessage, PoisonMessageCache, PoisonMessageError
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+validations = []
+
+
+class CountedModel(BaseModel):
+    x: int
+
+    @validator('x')
+    def count_validations(cls, value):
+        validations.append(value)
+        if value < 0:
+            raise ValueError('x must not be negative')
+        return value
+
+
+def test_poison_messages_are_not_validated_again():
+    validations.clear()
+    errors = []
+    fm = FastMessage(validation_error_handler=lambda input_device, message_bundle, error: errors.append(error))
+    fm.set_poison_message_cache(PoisonMessageCache())
+
+    @fm.map(input_device='input1', output_device=None)
+    def do_something1(model: CountedModel):
+        pass
+
+    @fm.map(input_device='input2', output_device=None)
+    def do_something2(model: CountedModel):
+        pass
+
+    for _ in range(3):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"model": {"x": -1}}')))
+
+    assert validations == [-1]
+    assert len(errors) == 3
+    assert not isinstance(errors[0], PoisonMessageError)
+    assert all(isinstance(error, PoisonMessageError) for error in errors[1:])
+    assert errors[1].errors() == errors[0].errors()
+
+    # the same payload on another device is validated by its own callback
+    fm.handle_message(FakeInputDevice('input2'), MessageBundle(Message(b'{"model": {"x": -1}}')))
+    assert validations == [-1, -1]
+
+    # valid messages are not cached
+    fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"model": {"x": 1}}')))
+    fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"model": {"x": 1}}')))
+    assert validations == [-1, -1, 1, 1]
+
+    stats = fm.poison_message_cache.get_stats()
+    assert stats.size == 2
+    assert stats.hits == 2
+    assert stats.inserts == 2
+
+
+def test_poison_messages_to_dead_letter_device():
+    fm = FastMessage()
+    fm.set_poison_message_cache(PoisonMessageCache(dead_letter_device='poison'))
+
+    @fm.map(input_device='input1', output_device='output')
+    def do_something1(x: int):
+        return x
+
+    with pytest.raises(ValidationError):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": "bad"}')))
+
+    bundle = MessageBundle(Message(b'{"x": "bad"}'))
+    result = fm.handle_message(FakeInputDevice('input1'), bundle)
+    assert result.output_device_name == 'poison'
+    assert result.message_bundle is bundle
+
+
+def test_ttl_and_eviction():
+    cache = PoisonMessageCache(max_size=2, ttl=0.05)
+    error = ValidationError([], CountedModel)
+    keys = [cache.get_key('input', Message(f'{i}'.encode())) for i in range(3)]
+    for key in keys:
+        cache.add(key, error)
+
+    assert cache.get(keys[0]) is None  # evicted
+    assert cache.get(keys[1]) is error
+    time.sleep(0.1)
+    assert cache.get(keys[2]) is None  # expired
+
+    stats = cache.get_stats()
+    assert stats.evictions == 1
+    assert stats.expirations == 1
+    assert stats.hits == 1
+    assert stats.misses == 2
+    assert stats.size == 1
+
+    compressed_key = cache.get_key('input', Message(b'1', headers={'content-encoding': 'gzip'}))
+    assert compressed_key != keys[1]
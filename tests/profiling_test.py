@@ -0,0 +1,122 @@
+import asyncio
+import os
+import pstats
+import tempfile
+
+from fastmessage import FastMessage
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+def _busy_function(x: int):
+    return sum(range(x))
+
+
+def test_profiling_samples_calls():
+    fm = FastMessage()
+
+    @fm.map(input_device='profiled')
+    def do_something(x: int):
+        return _busy_function(x)
+
+    @fm.map(input_device='not_profiled')
+    def do_something_else(x: int):
+        return x
+
+    fm.enable_profiling('profiled', sample_rate=2)
+    assert fm.get_profiler('not_profiled') is None
+    profiler = fm.get_profiler('profiled')
+    assert profiler is not None
+    assert profiler.get_stats() is None
+
+    for _ in range(10):
+        fm.handle_message(FakeInputDevice('profiled'), MessageBundle(Message(b'{"x": 100}')))
+        fm.handle_message(FakeInputDevice('not_profiled'), MessageBundle(Message(b'{"x": 100}')))
+
+    assert profiler.sampled_calls == 5
+    stats = profiler.get_stats()
+    assert any(func_name == '_busy_function' for _, _, func_name in stats.stats)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'profile.prof')
+        profiler.dump_stats(path)
+        assert pstats.Stats(path).total_calls == stats.total_calls
+
+    profiler.reset()
+    assert profiler.sampled_calls == 0
+    assert profiler.get_stats() is None
+
+    fm.disable_profiling()
+    assert fm.get_profiler('profiled') is None
+
+
+def test_profiling_generators_and_coroutines():
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='generator')
+    def do_something(x: int):
+        for i in range(x):
+            yield _busy_function(i)
+
+    @fm.map(input_device='coroutine')
+    async def do_something_async(x: int):
+        await asyncio.sleep(0)
+        return _busy_function(x)
+
+    fm.enable_profiling(sample_rate=1)
+    results = fm.handle_message(FakeInputDevice('generator'), MessageBundle(Message(b'{"x": 3}')))
+    assert fm.get_profiler('generator').sampled_calls == 0  # the generator is still running
+    assert len(list(results)) == 3
+    assert fm.get_profiler('generator').sampled_calls == 1
+
+    fm.handle_message(FakeInputDevice('coroutine'), MessageBundle(Message(b'{"x": 10}')))
+    for input_device in ('generator', 'coroutine'):
+        stats = fm.get_profiler(input_device).get_stats()
+        assert any(func_name == '_busy_function' for _, _, func_name in stats.stats)
+    fm.shutdown()
+
+
+def _other_busy_function(x: int):
+    return sum(range(x))
+
+
+def test_profiling_asyncio_native():
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='profiled', timeout=5)
+    async def do_something(x: int):
+        await asyncio.sleep(0)
+        return _busy_function(x)
+
+    @fm.map(input_device='profiled_generator')
+    async def do_something_generator(x: int):
+        for i in range(x):
+            await asyncio.sleep(0)
+            yield _busy_function(i)
+
+    @fm.map(input_device='not_profiled')
+    async def do_something_else(x: int):
+        for _ in range(3):
+            await asyncio.sleep(0)
+            _other_busy_function(x)
+
+    async def _handle(input_device: str):
+        callback_wrapper = fm.get_callback_wrapper(input_device)
+        message_bundle = MessageBundle(Message(b'{"x": 100}'))
+        kwargs = callback_wrapper.decode(FakeInputDevice(input_device), message_bundle)
+        return await callback_wrapper.execute_async(kwargs, message_bundle)
+
+    async def _handle_concurrently():
+        return await asyncio.gather(_handle('profiled'), _handle('profiled_generator'), _handle('not_profiled'))
+
+    fm.enable_profiling(['profiled', 'profiled_generator'], sample_rate=1)
+    (result, _), (items, _), _ = asyncio.run(_handle_concurrently())
+    assert result == _busy_function(100)
+    assert len(items) == 100
+
+    for input_device in ('profiled', 'profiled_generator'):
+        profiler = fm.get_profiler(input_device)
+        assert profiler.sampled_calls == 1
+        func_names = {func_name for _, _, func_name in profiler.get_stats().stats}
+        assert '_busy_function' in func_names
+        assert '_other_busy_function' not in func_names  # the other tasks on the event loop are not profiled
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from fastmessage import FastMessage, RetryPolicy
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+class TransientError(Exception):
+    pass
+
+
+FAST_RETRY = RetryPolicy(exceptions=(TransientError,), max_attempts=3, initial_delay=0.001, jitter=0)
+
+
+def test_get_delay():
+    retry_policy = RetryPolicy(initial_delay=1, backoff_factor=2, max_delay=5, jitter=0)
+    assert [retry_policy.get_delay(i) for i in range(1, 6)] == [1, 2, 4, 5, 5]
+
+    retry_policy = RetryPolicy(initial_delay=1, jitter=0.5)
+    assert all(0.5 <= retry_policy.get_delay(1) <= 1.5 for _ in range(100))
+
+
+@pytest.mark.parametrize('is_async', [False, True])
+def test_retry_until_success(is_async: bool):
+    fm: FastMessage = FastMessage(default_output_device='output')
+    attempts = []
+
+    def do_something(x: int):
+        attempts.append(x)
+        if len(attempts) < 3:
+            raise TransientError()
+        return x
+
+    async def do_something_async(x: int):
+        return do_something(x)
+
+    fm.register_callback(do_something_async if is_async else do_something,
+                         input_device='input1',
+                         retry_policy=FAST_RETRY)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'1'
+    assert attempts == [1, 1, 1]
+
+
+@pytest.mark.parametrize('is_async', [False, True])
+def test_retry_exhausted(is_async: bool):
+    fm: FastMessage = FastMessage(default_output_device='output')
+    attempts = []
+
+    def do_something(x: int):
+        attempts.append(x)
+        raise TransientError()
+
+    async def do_something_async(x: int):
+        return do_something(x)
+
+    fm.register_callback(do_something_async if is_async else do_something,
+                         input_device='input1',
+                         retry_policy=FAST_RETRY)
+
+    with pytest.raises(TransientError):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    assert len(attempts) == 3
+
+
+def test_not_retried_exception():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    attempts = []
+
+    @fm.map(input_device='input1', retry_policy=FAST_RETRY)
+    def do_something(x: int):
+        attempts.append(x)
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    assert len(attempts) == 1
+
+
+def test_timeout_cancellation_is_not_retried():
+    fm: FastMessage = FastMessage(default_output_device='output')
+    attempts = []
+
+    # BaseException covers asyncio.CancelledError on every python version (on 3.7 Exception covers it too)
+    @fm.map(input_device='input1', timeout=0.05, dead_letter_device='dead_letter',
+            retry_policy=RetryPolicy(exceptions=(BaseException,), max_attempts=3, initial_delay=0))
+    async def do_something(x: int):
+        attempts.append(x)
+        await asyncio.sleep(10)
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"x": 1}')))
+    assert result[0].output_device_name == 'dead_letter'
+    assert len(attempts) == 1
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+
+from fastmessage import FastMessage, PriorityInputDevice, PriorityPipelineService, SENT_AT_HEADER
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from tests.common import send_messages
+
+
+def _bodies(count: int):
+    return [json.dumps(dict(x=i)).encode() for i in range(count)]
+
+
+def _read_device_names(device: PriorityInputDevice, count: int):
+    device_names = []
+    for _ in range(count):
+        read_result = device.read_message(cancellation_token=threading.Event(), timeout=0, with_transaction=False)
+        if read_result is None:
+            break
+        assert device.last_read_device is not None
+        device_names.append(device.last_read_device.name)
+    return device_names
+
+
+def test_strict_priority_and_weights():
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'bulk1', _bodies(10))
+    send_messages(device_manager, 'bulk2', _bodies(10))
+    send_messages(device_manager, 'urgent', _bodies(2))
+    device = PriorityInputDevice(manager=device_manager,
+                                 inner_devices=[device_manager.get_input_device(name)
+                                                for name in ('bulk1', 'bulk2', 'urgent')],
+                                 priorities=dict(urgent=1),
+                                 weights=dict(bulk1=3))
+
+    assert _read_device_names(device, 2) == ['urgent', 'urgent']
+    assert _read_device_names(device, 8) == ['bulk1', 'bulk1', 'bulk2', 'bulk1'] * 2
+
+    send_messages(device_manager, 'urgent', _bodies(1))
+    assert _read_device_names(device, 1) == ['urgent']
+
+    # once bulk1 is empty, bulk2 gets all the reads
+    assert _read_device_names(device, 100) == ['bulk1', 'bulk1', 'bulk2', 'bulk1', 'bulk1'] + ['bulk2'] * 7
+    assert device.read_message(cancellation_token=threading.Event(), timeout=0.05, with_transaction=False) is None
+
+
+def test_priority_service_and_wait_stats():
+    fm = FastMessage(default_output_device='output')
+    handled = []
+
+    @fm.map(input_device='bulk')
+    def handle_bulk(x: int):
+        handled.append('bulk')
+
+    @fm.map(input_device='interactive', priority=10)
+    def handle_interactive(x: int):
+        handled.append('interactive')
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'bulk', _bodies(20), headers={SENT_AT_HEADER: time.time() - 5})
+    send_messages(device_manager, 'interactive', _bodies(5), headers={SENT_AT_HEADER: time.time() - 1})
+
+    service = fm.create_service(input_device_manager=device_manager,
+                                output_device_manager=device_manager,
+                                read_timeout=0.01)
+    assert isinstance(service, PriorityPipelineService)
+    service._prepare_service()
+    try:
+        for _ in range(25):
+            service._server_loop(threading.Event())
+    finally:
+        service._finalize_service()
+
+    assert handled == ['interactive'] * 5 + ['bulk'] * 20
+    wait_stats = fm.get_wait_stats()
+    assert wait_stats['interactive'].read_count == 5
+    assert 1 <= wait_stats['interactive'].max_wait < 5
+    assert wait_stats['bulk'].measured_count == 20
+    assert wait_stats['bulk'].p50_wait >= 5
+
+
+def test_no_priorities_uses_default_service():
+    fm = FastMessage()
+
+    @fm.map(input_device='input')
+    def do_something(x: int):
+        pass
+
+    device_manager = InMemoryDeviceManager()
+    send_messages(device_manager, 'input', _bodies(3), headers={SENT_AT_HEADER: time.time() - 2})
+    send_messages(device_manager, 'input', _bodies(1))
+    service = fm.create_service(input_device_manager=device_manager, read_timeout=0.01)
+    assert not isinstance(service, PriorityPipelineService)
+    service._prepare_service()
+    try:
+        for _ in range(4):
+            service._server_loop(threading.Event())
+    finally:
+        service._finalize_service()
+
+    wait_stats = fm.get_wait_stats('input')['input']  # the wait is recorded without priorities as well
+    assert wait_stats.read_count == 4
+    assert wait_stats.measured_count == 3
+    assert wait_stats.p50_wait >= 2
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from fastmessage import FastMessage
+from fastmessage.selective_decoding import SelectiveJSONDecoder
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+pytest.importorskip('simdjson')
+
+
+class SomeModel(BaseModel):
+    x: int
+
+
+WIDE_DOCUMENT = json.dumps({
+    **{f'field{i}': {'nested': [i, str(i), {'deep': '}]"\\'}]} for i in range(50)},
+    'a': 1,
+    'b': {'x': 2},
+    'c': [1, 2, 3],
+    'd': 'some "quoted" string',
+    'e': None,
+    'f': True,
+    'g': -1.5e3,
+})
+
+
+def test_decode_selected_keys():
+    decoder = SelectiveJSONDecoder(['a', 'b', 'c', 'd', 'e', 'f', 'g', 'missing'])
+    result = decoder.decode(WIDE_DOCUMENT.encode())
+    assert result == dict(a=1, b={'x': 2}, c=[1, 2, 3], d='some "quoted" string', e=None, f=True, g=-1.5e3)
+
+
+@pytest.mark.parametrize('document', [b'[1, 2]', b'{"a": 1', b'{"a" 1}', b'{"z": [1, 2}', b'not json'])
+def test_decode_invalid_document(document: bytes):
+    decoder = SelectiveJSONDecoder(['a', 'b'])
+    with pytest.raises(ValueError):
+        decoder.decode(document)
+
+
+def test_selective_decoding_callback():
+    fm: FastMessage = FastMessage()
+
+    @fm.map(input_device='input1', output_device='output', selective_decoding=True)
+    def do_something1(a: int, b: SomeModel, z: int = 3):
+        return a + b.x + z
+
+    result = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(WIDE_DOCUMENT.encode())))
+    assert result is not None
+    assert result[0].message_bundle.message.bytes == b'6'
+
+    with pytest.raises(ValidationError):
+        _ = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"a": 1, "b": {"y": 2}}')))
+
+    with pytest.raises(ValidationError):
+        _ = fm.handle_message(FakeInputDevice('input1'), MessageBundle(Message(b'{"a": 1, "b"')))
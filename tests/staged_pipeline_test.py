@@ -0,0 +1,157 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from fastmessage import FastMessage, Depends
+from fastmessage.staged_pipeline import StagedPipelineService
+from messageflux.iodevices.base.common import Message
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+
+
+class SomeModel(BaseModel):
+    x: int
+
+
+def _run_batch(fm: FastMessage, device_manager: InMemoryDeviceManager, messages, input_device='input'):
+    output_device = device_manager.get_output_device(input_device)
+    for message in messages:
+        output_device.send_message(Message(message))
+
+    service = fm.create_service(input_device_manager=device_manager,
+                                output_device_manager=device_manager,
+                                staged=True,
+                                max_batch_read_count=len(messages),
+                                read_timeout=0.1)
+    assert isinstance(service, StagedPipelineService)
+    service._prepare_service()
+    try:
+        service._server_loop(threading.Event())
+    finally:
+        service._finalize_service()
+
+
+def _read_all(device_manager: InMemoryDeviceManager, device_name: str):
+    input_device = device_manager.get_input_device(device_name)
+    results = []
+    while True:
+        read_result = input_device.read_message(cancellation_token=threading.Event(),
+                                                timeout=0,
+                                                with_transaction=False)
+        if read_result is None:
+            return results
+        results.append(json.loads(read_result.message.bytes))
+
+
+def test_staged_pipeline_keeps_order():
+    fm = FastMessage(default_output_device='output')
+    callback_threads = set()
+
+    @fm.map(input_device='input')
+    def do_something(x: int, model: SomeModel):
+        callback_threads.add(threading.get_ident())
+        time.sleep(0.001 * (x % 3))
+        return model
+
+    device_manager = InMemoryDeviceManager()
+    _run_batch(fm, device_manager, [json.dumps(dict(x=i, model=dict(x=i))).encode() for i in range(50)])
+
+    assert _read_all(device_manager, 'output') == [dict(x=i) for i in range(50)]
+    assert callback_threads == {threading.get_ident()}  # the callbacks run on the service thread
+
+
+def test_staged_pipeline_overlaps_decoding():
+    fm = FastMessage(default_output_device='output')
+    decoded = []
+
+    class RecordingModel(BaseModel):
+        x: int
+
+        def __init__(self, **data):
+            super().__init__(**data)
+            decoded.append(self.x)
+
+    @fm.map(input_device='input')
+    def do_something(model: RecordingModel):
+        time.sleep(0.05)
+        if model.x < 2:
+            assert model.x + 1 in decoded  # the next message was decoded while this callback ran
+        return model.x
+
+    device_manager = InMemoryDeviceManager()
+    _run_batch(fm, device_manager, [json.dumps(dict(model=dict(x=i))).encode() for i in range(3)])
+
+    assert _read_all(device_manager, 'output') == [0, 1, 2]
+
+
+def test_staged_pipeline_validation_error():
+    fm = FastMessage(default_output_device='output')
+    errors = []
+    fm.register_validation_error_handler(lambda input_device, message_bundle, error: errors.append(error))
+
+    @fm.map(input_device='input')
+    def do_something(x: int):
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    _run_batch(fm, device_manager, [b'{"x": 1}', b'{"x": "bad"}', b'{"x": 3}'])
+
+    assert _read_all(device_manager, 'output') == [1, 3]
+    assert len(errors) == 1
+
+
+def test_staged_pipeline_generator():
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input')
+    def do_something(x: int):
+        for i in range(x):
+            yield i
+
+    device_manager = InMemoryDeviceManager()
+    _run_batch(fm, device_manager, [b'{"x": 2}', b'{"x": 3}'])
+
+    assert _read_all(device_manager, 'output') == [0, 1, 0, 1, 2]
+
+
+def test_staged_pipeline_async_generator_dependencies():
+    fm = FastMessage(default_output_device='output')
+    teardown_threads = []
+
+    async def get_session():
+        yield 'session'
+        await asyncio.sleep(0.001)
+        teardown_threads.append(threading.get_ident())
+
+    @fm.map(input_device='input')
+    async def do_something(x: int, session: str = Depends(get_session)):
+        await asyncio.sleep(0.01)
+        return x
+
+    device_manager = InMemoryDeviceManager()
+    _run_batch(fm, device_manager, [json.dumps(dict(x=i)).encode() for i in range(5)])
+
+    assert _read_all(device_manager, 'output') == list(range(5))
+    assert teardown_threads == [threading.get_ident()] * 5  # torn down on the service thread (that owns the loop)
+
+
+def test_staged_pipeline_warms_up_decode_thread():
+    pytest.importorskip('simdjson')
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='input', selective_decoding=True)
+    def do_something(x: int):
+        return x
+
+    decoder = fm.get_callback_wrapper('input')._selective_decoder
+    service = fm.create_service(input_device_manager=InMemoryDeviceManager(), staged=True)
+    assert isinstance(service, StagedPipelineService)
+    service._prepare_service()
+    try:
+        decode_thread_parser = service._decode_executor.submit(lambda: getattr(decoder._local, 'parser', None))
+        assert decode_thread_parser.result() is not None
+    finally:
+        service._finalize_service()
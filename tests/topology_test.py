@@ -0,0 +1,71 @@
+from fastmessage import FastMessage, OtherMethodOutput, MultipleReturnValues
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+
+def _create_fastmessage():
+    fm = FastMessage(default_output_device='output')
+
+    @fm.map(input_device='split')
+    def split(x: int):
+        return MultipleReturnValues(OtherMethodOutput(work, y=i) for i in range(x))
+
+    @fm.map(input_device='work', output_device='done')
+    def work(y: int):
+        return y
+
+    return fm
+
+
+def test_static_topology():
+    fm = _create_fastmessage()
+    topology = fm.get_topology()
+
+    assert set(topology.callback_devices) == {'split', 'work'}
+    assert set(topology.devices) == {'split', 'work', 'output', 'done'}
+    edges = {(edge.source, edge.target): edge for edge in topology.edges}
+    assert edges.keys() == {('split', 'output'), ('work', 'done')}
+    assert all(edge.static and edge.fan_out == 1 for edge in edges.values())
+
+
+def test_observed_topology():
+    fm = _create_fastmessage()
+    for _ in range(4):
+        results = list(fm.handle_message(FakeInputDevice('split'), MessageBundle(Message(b'{"x": 3}'))))
+        for result in results:
+            list(fm.handle_message(FakeInputDevice(result.output_device_name), result.message_bundle))
+
+    topology = fm.get_topology()
+    edges = {(edge.source, edge.target): edge for edge in topology.edges}
+    assert edges.keys() == {('split', 'output'), ('split', 'work'), ('work', 'done')}
+    assert edges[('split', 'work')].static is False
+    assert edges[('split', 'work')].observed_count == 12
+    assert edges[('split', 'work')].fan_out == 3
+    assert edges[('split', 'output')].fan_out == 0
+    assert edges[('work', 'done')].fan_out == 1
+    assert topology.costs.keys() == {'split', 'work'}
+
+    report = topology.capacity_report(ingress_rates={'split': 10}, costs={'work': 0.07}, target_utilization=0.7)
+    assert report['split'].message_rate == 10
+    assert report['work'].message_rate == 30
+    assert report['done'].message_rate == 30
+    assert abs(report['work'].load - 2.1) < 1e-9
+    assert report['work'].required_workers == 3
+    assert report['done'].cost is None
+    assert report['split'].cost is not None  # measured
+
+
+def test_topology_with_cycle():
+    fm = FastMessage()
+
+    @fm.map(input_device='retry', output_device='retry')
+    def retry(x: int):
+        return x
+
+    # half of the messages are routed back to the same queue
+    fm.get_callback_wrapper('retry').route_counter.record_message()
+    fm.get_callback_wrapper('retry').route_counter.record_message()
+    fm.get_callback_wrapper('retry').route_counter.record_output('retry')
+
+    rates = fm.get_topology().get_message_rates({'retry': 10})
+    assert abs(rates['retry'] - 20) < 1e-6
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from fastmessage import FastMessage, OtherMethodOutput, InMemorySpanExporter, FileSpanExporter, \
+    TRACE_ID_HEADER, SPAN_ID_HEADER, SENT_AT_HEADER
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+fm = FastMessage(default_output_device='output')
+
+
+@fm.map(input_device='step1')
+def step1(x: int):
+    return OtherMethodOutput(step2, y=x + 1)
+
+
+@fm.map(input_device='step2')
+def step2(y: int):
+    return [y, y]
+
+
+def test_trace_propagation():
+    exporter = InMemorySpanExporter()
+    fm.set_span_exporter(exporter)
+    try:
+        message = Message(b'{"x": 1}', headers={SENT_AT_HEADER: time.time() - 1})
+        results = list(fm.handle_message(FakeInputDevice('step1'), MessageBundle(message)))
+        assert len(exporter.spans) == 1
+        first_span = exporter.spans[0]
+        assert first_span.parent_span_id is None
+        assert first_span.input_device_name == 'step1'
+        assert first_span.queue_wait >= 1
+        assert first_span.processing_time >= 0
+
+        output_headers = results[0].message_bundle.message.headers
+        assert output_headers[TRACE_ID_HEADER] == first_span.trace_id
+        assert output_headers[SPAN_ID_HEADER] == first_span.span_id
+
+        results = list(fm.handle_message(FakeInputDevice(results[0].output_device_name), results[0].message_bundle))
+        assert len(results) == 1
+        second_span = exporter.spans[1]
+        assert second_span.trace_id == first_span.trace_id
+        assert second_span.parent_span_id == first_span.span_id
+        assert second_span.input_device_name == 'step2'
+        assert second_span.queue_wait < 1
+        assert results[0].message_bundle.message.headers[SPAN_ID_HEADER] == second_span.span_id
+    finally:
+        fm.set_span_exporter(None)
+
+    results = fm.handle_message(FakeInputDevice('step1'), MessageBundle(Message(b'{"x": 1}')))
+    assert TRACE_ID_HEADER not in list(results)[0].message_bundle.message.headers
+
+
+def test_trace_error():
+    exporter = InMemorySpanExporter()
+    fm.set_span_exporter(exporter)
+    try:
+        with pytest.raises(ValidationError):
+            fm.handle_message(FakeInputDevice('step1'), MessageBundle(Message(b'{"x": "bad"}')))
+    finally:
+        fm.set_span_exporter(None)
+
+    assert len(exporter.spans) == 1
+    assert 'ValidationError' in exporter.spans[0].error
+
+
+def test_file_exporter():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'spans.jsonl')
+        exporter = FileSpanExporter(path)
+        fm.set_span_exporter(exporter)
+        try:
+            for i in range(3):
+                list(fm.handle_message(FakeInputDevice('step2'), MessageBundle(Message(b'{"y": 1}'))))
+        finally:
+            fm.set_span_exporter(None)
+            exporter.close()
+
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        assert len(spans) == 3
+        assert all(span['input_device_name'] == 'step2' for span in spans)
+        assert len({span['trace_id'] for span in spans}) == 3
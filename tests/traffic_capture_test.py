@@ -0,0 +1,98 @@
+from pathlib import Path
+
+from fastmessage import FastMessage, TrafficRecorder, read_traffic, replay_traffic
+from fastmessage.traffic_capture import main
+from messageflux.iodevices.base.common import MessageBundle, Message
+from tests.common import FakeInputDevice
+
+fm = FastMessage(default_output_device='output')
+
+
+@fm.map(input_device='input1')
+def do_something1(x: int):
+    return x + 1
+
+
+@fm.map(input_device='input2')
+def do_something2(y: str):
+    return [y, y]
+
+
+def _record(path: str):
+    recorder = TrafficRecorder(path)
+    fm.set_traffic_recorder(recorder)
+    try:
+        for i in range(10):
+            fm.handle_message(FakeInputDevice('input1'),
+                              MessageBundle(Message(f'{{"x": {i}}}'.encode(), headers={'index': i})))
+        fm.handle_message(FakeInputDevice('input2'), MessageBundle(Message(b'{"y": "a"}')))
+    finally:
+        fm.set_traffic_recorder(None)
+        recorder.close()
+
+
+def test_record_and_read(tmp_path: Path):
+    path = str(tmp_path / 'traffic.bin')
+    _record(path)
+    _record(path)  # appends to the same file
+
+    recorded_messages = list(read_traffic(path))
+    assert len(recorded_messages) == 22
+    assert recorded_messages[3].input_device_name == 'input1'
+    assert recorded_messages[3].headers == {'index': 3}
+    assert recorded_messages[3].data == b'{"x": 3}'
+    assert recorded_messages[10].input_device_name == 'input2'
+    assert all(m1.timestamp <= m2.timestamp for m1, m2 in zip(recorded_messages, recorded_messages[1:]))
+
+
+def test_read_partial_record(tmp_path: Path):
+    path = tmp_path / 'traffic.bin'
+    _record(str(path))
+    with open(path, 'r+b') as f:
+        f.truncate(path.stat().st_size - 3)
+
+    assert len(list(read_traffic(str(path)))) == 10
+
+
+def test_replay(tmp_path: Path):
+    path = str(tmp_path / 'traffic.bin')
+    _record(path)
+
+    stats = replay_traffic(fm, path)
+    assert stats.keys() == {'input1', 'input2'}
+    assert stats['input1'].count == 10
+    assert stats['input2'].count == 1
+    assert stats['input1'].throughput > 0
+    assert stats['input1'].percentile(50) <= stats['input1'].percentile(99)
+    assert stats['input1'].error_count == 0
+
+    stats = replay_traffic(fm, path, speed=1)
+    assert stats['input1'].count == 10
+
+
+def test_replay_errors(tmp_path: Path, capsys):
+    path = str(tmp_path / 'traffic.bin')
+    recorder = TrafficRecorder(path)
+    recorder.record('input1', MessageBundle(Message(b'{"x": "bad"}')))
+    recorder.record('input1', MessageBundle(Message(b'{"x": 1}')))
+    recorder.record('unknown', MessageBundle(Message(b'{"x": 1}')))
+    recorder.record('input1', MessageBundle(Message(b'{"x": 2}')))
+    recorder.close()
+
+    stats = replay_traffic(fm, path)
+    assert stats['input1'].count == 2  # the replay continued after the bad message
+    assert stats['input1'].errors == {'ValidationError': 1}
+    assert stats['unknown'].errors == {'MissingCallbackException': 1}
+
+    main([f'{__name__}:fm', path])
+    assert 'input1: 1 errors (ValidationError=1)' in capsys.readouterr().out
+
+
+def test_replay_tool(tmp_path: Path, capsys):
+    path = str(tmp_path / 'traffic.bin')
+    _record(path)
+
+    main([f'{__name__}:fm', path])
+    output = capsys.readouterr().out
+    assert output.startswith('input1: 10 messages')
+    assert 'input2: 1 messages' in output
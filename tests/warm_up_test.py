@@ -0,0 +1,129 @@
+import datetime
+import json
+import threading
+import time
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, conint, constr
+
+from fastmessage import FastMessage, Depends, DependencyScope, PoisonMessageCache
+from fastmessage.output_encoding import _output_encoders
+from fastmessage.schema_samples import build_schema_sample
+from messageflux.iodevices.base.common import MessageBundle, Message
+from messageflux.iodevices.in_memory_device import InMemoryDeviceManager
+from tests.common import FakeInputDevice
+
+
+class Color(Enum):
+    RED = 'red'
+    GREEN = 'green'
+
+
+class Child(BaseModel):
+    name: constr(min_length=3)
+    children: List['Child'] = []
+
+
+Child.update_forward_refs()
+
+
+class Parent(BaseModel):
+    count: conint(gt=10, le=20)
+    ratio: float
+    color: Color
+    created: datetime.datetime
+    child: Child
+    children: List[Child]
+    maybe: Optional[int]
+    flag: bool = True
+
+
+class Output(BaseModel):
+    value: int
+
+
+def test_build_schema_sample():
+    sample = build_schema_sample(Parent.schema())
+    parent = Parent.parse_obj(json.loads(json.dumps(sample)))
+    assert parent.count == 11
+    assert parent.color is Color.RED
+    assert parent.child.name == 'aaa'
+    assert len(parent.children) == 1
+
+
+def test_warm_up(monkeypatch):
+    fm = FastMessage(default_output_device='output')
+    fm.set_poison_message_cache(PoisonMessageCache())
+    created = []
+
+    def get_client():
+        created.append(1)
+        return 'client'
+
+    @fm.map(input_device='input')
+    def do_something(parent: Parent, client: str = Depends(get_client, scope=DependencyScope.PROCESS)) -> Output:
+        return Output(value=parent.count)
+
+    @fm.map(input_device='input2')
+    async def do_something_async(x: int):
+        return x
+
+    assert not fm.is_ready
+    assert not fm.wait_until_ready(timeout=0.01)
+    monkeypatch.delitem(_output_encoders, Output, raising=False)
+
+    fm.warm_up(samples={'input': [b'{"parent": {"count": "bad"}}']}, synthetic=True)
+    assert fm.is_ready
+    assert created == [1]
+    assert Output in _output_encoders
+    assert fm._thread_local.event_loop is not None
+    assert fm.poison_message_cache.get_stats().size == 0  # the bad sample is not remembered
+
+    sample = json.dumps(dict(parent=build_schema_sample(Parent.schema()))).encode()
+    result = fm.handle_message(FakeInputDevice('input'), MessageBundle(Message(sample)))
+    assert json.loads(result[0].message_bundle.message.bytes) == dict(value=11)
+    assert created == [1]  # the dependency was created by the warm up
+
+    @fm.map(input_device='input3')
+    def do_something_else(x: int):
+        pass
+
+    assert not fm.is_ready  # the new callback is not warmed up
+    fm.prepare()
+    assert fm.is_ready
+
+    fm.shutdown()
+    assert not fm.is_ready
+
+
+def test_service_starts_after_warm_up():
+    fm = FastMessage(default_output_device='output')
+    warmed_up = threading.Event()
+    handled = []
+
+    def get_client():
+        assert warmed_up.wait(5)
+        return 'client'
+
+    @fm.map(input_device='input')
+    def do_something(x: int, client: str = Depends(get_client, scope=DependencyScope.PROCESS)):
+        handled.append((fm.is_ready, x))
+
+    device_manager = InMemoryDeviceManager()
+    device_manager.get_output_device('input').send_message(Message(b'{"x": 1}'))
+    service = fm.create_service(input_device_manager=device_manager,
+                                should_stop_on_signal=False,
+                                read_timeout=0.1)
+    threading.Thread(target=service.start, daemon=True).start()
+    try:
+        assert not fm.wait_until_ready(timeout=0.2)
+        assert handled == []
+        warmed_up.set()
+        assert fm.wait_until_ready(timeout=5)
+        end_time = time.time() + 5
+        while not handled and time.time() < end_time:
+            time.sleep(0.01)
+        assert handled == [(True, 1)]
+    finally:
+        service.stop()